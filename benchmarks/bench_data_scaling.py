@@ -0,0 +1,128 @@
+"""
+Data-scaling benchmark for the Lift Log repository layer.
+
+For each dataset size the scratch database is emptied, filled with
+generate_dataset, and every read in src/repository/db.py is timed against
+a sample of users. The output is a table plus an ASCII chart of median
+latency by dataset size, which shows which queries grow with total data
+and which stay flat.
+
+THIS TRUNCATES users, sessions, sets and their derived tables. Point it
+at a scratch database only.
+
+Usage:
+    python -m benchmarks.bench_data_scaling --dsn postgresql://localhost/liftlog_bench \
+        --sizes 10,100,1000 --years 3 --i-understand-this-truncates
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks.generate_dataset import generate
+from src.repository import db
+
+def _reads(conn, user_id: int, session_id: int, exercise: str, username: str) -> dict:
+    '''every repository read, bound to one sample user'''
+    return {
+        "db_get_user": lambda: db.db_get_user(conn, username),
+        "db_get_active_session": lambda: db.db_get_active_session(conn, user_id),
+        "db_get_active_session_row": lambda: db.db_get_active_session_row(conn, user_id),
+        "db_get_sessions_for_user": lambda: db.db_get_sessions_for_user(conn, user_id),
+        "db_get_sets_for_session": lambda: db.db_get_sets_for_session(conn, session_id),
+        "db_get_sets_by_session": lambda: db.db_get_sets_by_session(conn, session_id),
+        "db_get_exercises_for_user": lambda: db.db_get_exercises_for_user(conn, user_id),
+        "db_get_sets_for_exercise": lambda: db.db_get_sets_for_exercise(conn, user_id, exercise),
+        "db_get_next_set_index": lambda: db.db_get_next_set_index(conn, session_id, exercise),
+        "db_get_changes": lambda: db.db_get_changes(conn, user_id, 0),
+        "db_search_sessions": lambda: db.db_search_sessions(conn, user_id, "sore knee squats", False, 20, 0),
+    }
+
+def _reset(conn):
+    cur = conn.cursor()
+    cur.execute((
+        "TRUNCATE sets, sessions, users, change_log, idempotency_keys, personal_records, jobs, user_shards "
+        "RESTART IDENTITY;"
+    ))
+    conn.commit()
+
+def _sample(conn, n: int, rng: random.Random) -> list[tuple]:
+    '''(user_id, username, a session of theirs, an exercise they did) for n random users'''
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT DISTINCT ON (users.user_id) users.user_id, users.username, sets.session_id, sets.exercise
+        FROM users JOIN sessions ON sessions.user_id = users.user_id
+        JOIN sets ON sets.session_id = sessions.session_id
+        ORDER BY users.user_id, sets.set_id DESC;
+    """)
+    rows = cur.fetchall()
+    return rng.sample(rows, k=min(n, len(rows)))
+
+def time_reads(conn, samples: list[tuple], repeats: int) -> dict[str, tuple[float, float]]:
+    '''read name -> (median ms, p95 ms)'''
+    timings: dict[str, list[float]] = {}
+    for user_id, username, session_id, exercise in samples:
+        for name, read in _reads(conn, user_id, session_id, exercise, username).items():
+            read()  # warm the cache; we want steady-state latency
+            for _ in range(repeats):
+                t = time.perf_counter()
+                read()
+                timings.setdefault(name, []).append((time.perf_counter() - t) * 1000)
+            conn.rollback()
+    return {
+        name: (statistics.median(ms), statistics.quantiles(ms, n=20)[-1] if len(ms) > 1 else ms[0])
+        for name, ms in timings.items()
+    }
+
+def chart(results: dict[int, dict], width: int = 40) -> str:
+    '''one block per read, one bar per dataset size, scaled to the slowest median'''
+    names = list(next(iter(results.values())))
+    slowest = max(r[name][0] for r in results.values() for name in names) or 1
+    lines = []
+    for name in names:
+        lines.append(name)
+        for size, r in results.items():
+            median = r[name][0]
+            lines.append(f"  {size:>7} users |{'#' * max(1, round(median / slowest * width)):<{width}}| {median:.3f} ms")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True)
+    parser.add_argument("--sizes", default="10,100,1000", help="comma-separated user counts")
+    parser.add_argument("--years", type=float, default=3)
+    parser.add_argument("--sessions-per-week", type=int, default=3)
+    parser.add_argument("--exercises-per-session", type=int, default=4)
+    parser.add_argument("--sets-per-exercise", type=int, default=4)
+    parser.add_argument("--sample-users", type=int, default=20)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--i-understand-this-truncates", action="store_true")
+    args = parser.parse_args()
+    if not args.i_understand_this_truncates:
+        parser.error("this benchmark empties the target database; pass --i-understand-this-truncates")
+
+    db.DATABASE_URL = args.dsn
+    db.db_init_db()
+    rng = random.Random(args.seed)
+
+    results = {}
+    with db.get_conn() as conn:
+        for size in (int(s) for s in args.sizes.split(",")):
+            _reset(conn)
+            counts = generate(
+                conn, size, args.years, args.sessions_per_week,
+                args.exercises_per_session, args.sets_per_exercise, args.seed,
+            )
+            print(f"\n{size} users: {counts['sessions']} sessions, {counts['sets']} sets "
+                  f"(loaded in {counts['seconds']:.1f}s)")
+            results[size] = time_reads(conn, _sample(conn, args.sample_users, rng), args.repeats)
+            for name, (median, p95) in results[size].items():
+                print(f"  {name:<28} median {median:8.3f} ms   p95 {p95:8.3f} ms")
+
+    print("\nmedian latency by dataset size\n")
+    print(chart(results))
+
+if __name__ == "__main__":
+    main()
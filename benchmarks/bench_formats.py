@@ -0,0 +1,79 @@
+"""
+Payload size and encode time of the history response formats.
+
+Builds a synthetic exercise history (the /users/{id}/sets row shape) in memory
+and encodes it the way each format is served:
+  rows JSON      what the default path does (jsonable_encoder + JSON)
+  columns JSON   application/vnd.liftlog.columns+json
+  msgpack        application/msgpack (skipped if msgpack isn't installed)
+Sizes are reported raw and gzipped, since most clients negotiate gzip as well.
+
+Usage: python -m benchmarks.bench_formats [--rows 1000,10000,100000]
+"""
+
+import argparse
+import gzip
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+
+from src.api import formats
+
+def history(n: int, seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)
+    start = datetime(2015, 1, 5, 18)
+    return [
+        {
+            "set_id": 1000 + i,
+            "weight": float(rng.randrange(135, 315, 5)),
+            "reps": rng.choice((1, 3, 5, 8)),
+            "is_1rm": 0,
+            "session_id": 100 + i // 12,
+            "performed_at": start + timedelta(days=2 * (i // 12)),
+        }
+        for i in range(n)
+    ]
+
+def to_columns(rows: list[dict]) -> dict[str, list]:
+    return {name: [r[name] for r in rows] for name in rows[0]}
+
+def _time(fn, repeats: int = 5) -> tuple[float, bytes]:
+    timings, out = [], b""
+    for _ in range(repeats):
+        t = time.perf_counter()
+        out = fn()
+        timings.append((time.perf_counter() - t) * 1000)
+    return statistics.median(timings), out
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="1000,10000,100000")
+    args = parser.parse_args()
+
+    try:
+        import msgpack  # noqa: F401
+        has_msgpack = True
+    except ImportError:
+        has_msgpack = False
+
+    print(f"{'rows':>8}  {'format':<13} {'bytes':>11} {'gzip bytes':>11} {'encode ms':>10}")
+    for n in (int(x) for x in args.rows.split(",")):
+        rows = history(n)
+        columns = to_columns(rows)  # the repository hands these over already transposed
+        encoders = {
+            "rows JSON": lambda: json.dumps(jsonable_encoder(rows)).encode(),
+            "columns JSON": lambda: formats.encode_columns(columns, formats.COLUMNS_JSON),
+        }
+        if has_msgpack:
+            encoders["msgpack"] = lambda: formats.encode_columns(columns, formats.MSGPACK)
+
+        for name, encode in encoders.items():
+            ms, body = _time(encode)
+            print(f"{n:>8}  {name:<13} {len(body):>11,} {len(gzip.compress(body)):>11,} {ms:>10.2f}")
+
+if __name__ == "__main__":
+    main()
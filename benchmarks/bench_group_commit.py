@@ -0,0 +1,101 @@
+"""
+Set-insert throughput with and without group commit.
+
+Simulates peak hour: --clients threads, each a different user with an active
+session, log one set after another for --seconds, through the same service
+call POST /users/{id}/sets uses. Runs once with every insert committing on its
+own and once through the group-commit writer (GROUP_COMMIT_MS = --window-ms),
+then reports inserts per second, commits per second, inserts per commit, and
+the per-request latency the window adds.
+
+The group commit run takes one pooled connection; the direct run needs one per
+client thread, so the pool is sized to --clients for both. Creates its own
+users and leaves their rows behind: point it at a scratch database.
+
+Usage:
+    python -m benchmarks.bench_group_commit --dsn postgresql://localhost/liftlog_bench \
+        --clients 32 --seconds 10 --window-ms 5
+"""
+
+import argparse
+import statistics
+import threading
+import time
+import uuid
+
+from src.repository import db
+from src.services import api_services, group_commit
+
+def _users(n: int) -> list[int]:
+    '''n fresh users, each with an active session'''
+    prefix = f"bench_gc_{uuid.uuid4().hex[:8]}"
+    user_ids = [api_services.create_user(f"{prefix}_{i}", "benchmark")["user_id"] for i in range(n)]
+    for user_id in user_ids:
+        api_services.create_session(user_id, None, None, None)
+    return user_ids
+
+def run(user_ids: list[int], seconds: float) -> dict:
+    '''every user logs sets back to back until time is up'''
+    latencies: list[list[float]] = [[] for _ in user_ids]
+    start = threading.Barrier(len(user_ids) + 1)
+    stop = threading.Event()
+
+    def client(i: int, user_id: int):
+        start.wait()
+        while not stop.is_set():
+            t = time.perf_counter()
+            api_services.add_sets_to_active_session(user_id, "squat", [(225.0, 5, 0)])
+            latencies[i].append((time.perf_counter() - t) * 1000)
+
+    threads = [threading.Thread(target=client, args=(i, u)) for i, u in enumerate(user_ids)]
+    for t in threads:
+        t.start()
+    batches = group_commit.stats["batches"]
+    start.wait()
+    began = time.perf_counter()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - began
+
+    ms = [x for per_client in latencies for x in per_client]
+    # without the writer every insert is its own (autocommit) transaction
+    commits = group_commit.stats["batches"] - batches if group_commit.enabled() else len(ms)
+    return {
+        "inserts/s": len(ms) / elapsed,
+        "commits/s": commits / elapsed,
+        "inserts/commit": len(ms) / max(commits, 1),
+        "p50 ms": statistics.median(ms),
+        "p95 ms": statistics.quantiles(ms, n=20)[-1] if len(ms) > 1 else ms[0],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--window-ms", type=float, default=5)
+    parser.add_argument("--max-batch", type=int, default=group_commit.GROUP_COMMIT_MAX_BATCH)
+    args = parser.parse_args()
+
+    db.DATABASE_URL = args.dsn
+    db.DB_POOL_SIZE = args.clients
+    db.db_init_db()
+    user_ids = _users(args.clients)
+
+    results = {}
+    for name, window_ms in (("direct", 0.0), ("group commit", args.window_ms)):
+        group_commit.GROUP_COMMIT_MS = window_ms
+        group_commit.GROUP_COMMIT_MAX_BATCH = args.max_batch
+        results[name] = run(user_ids, args.seconds)
+
+    print(f"\n{args.clients} clients, {args.seconds:.0f}s each, window {args.window_ms} ms\n")
+    columns = list(results["direct"])
+    print(f"{'':<14}" + "".join(f"{c:>16}" for c in columns))
+    for name, row in results.items():
+        print(f"{name:<14}" + "".join(f"{row[c]:>16.1f}" for c in columns))
+    db.close_pools()
+
+if __name__ == "__main__":
+    main()
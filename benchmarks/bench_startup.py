@@ -0,0 +1,108 @@
+"""
+Import-time and boot-time benchmark for the Lift Log API.
+
+Measures, in fresh interpreters:
+  - import: wall time of `import src.api.main`, and which heavy modules it pulls in
+  - boot: time from spawning the server (cold-start mode) until /healthz answers, both
+    through uvicorn directly and through the Procfile's entry point, src.api.server
+
+Each measurement is the median of --runs attempts and is checked against a budget;
+the script exits non-zero when a budget is exceeded so it can gate CI.
+
+Usage: python -m benchmarks.bench_startup [--runs 5] [--import-budget-ms 600] [--boot-budget-ms 1500]
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+# should stay out of the import path in cold-start mode
+DEFERRED_MODULES = ("psycopg2", "bcrypt", "numpy")
+
+IMPORT_SNIPPET = """
+import json, sys, time
+t = time.perf_counter()
+import src.api.main
+elapsed = (time.perf_counter() - t) * 1000
+print(json.dumps({"ms": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (DEFERRED_MODULES,)
+
+def measure_import() -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET],
+        cwd=ROOT_DIR, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+# how each entry point is started on a given port
+BOOT_COMMANDS = {
+    "uvicorn": lambda port: [sys.executable, "-m", "uvicorn", "src.api.main:app", "--port", str(port),
+                             "--log-level", "warning"],
+    "src.api.server": lambda port: [sys.executable, "-m", "src.api.server"],
+}
+
+def measure_boot(entry: str, timeout: float = 30.0) -> float:
+    port = _free_port()
+    env = dict(os.environ, LIFT_LOG_COLD_START="1", HOST="127.0.0.1", PORT=str(port))
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        BOOT_COMMANDS[entry](port),
+        cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=1) as res:
+                    if res.status == 200:
+                        return (time.perf_counter() - started) * 1000
+            except OSError:
+                time.sleep(0.01)
+        raise TimeoutError("server never answered /healthz")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget-ms", type=float, default=600)
+    parser.add_argument("--boot-budget-ms", type=float, default=1500)
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.runs)]
+    import_ms = statistics.median(r["ms"] for r in imports)
+    loaded = sorted({m for r in imports for m in r["loaded"]})
+    boot_ms = {entry: statistics.median(measure_boot(entry) for _ in range(args.runs)) for entry in BOOT_COMMANDS}
+
+    failures = []
+    print(f"import src.api.main: {import_ms:8.1f} ms  (budget {args.import_budget_ms:.0f} ms)")
+    for entry, ms in boot_ms.items():
+        print(f"boot to /healthz:    {ms:8.1f} ms  (budget {args.boot_budget_ms:.0f} ms, {entry})")
+    if loaded:
+        failures.append(f"deferred modules imported at startup: {', '.join(loaded)}")
+    if import_ms > args.import_budget_ms:
+        failures.append("import time over budget")
+    for entry, ms in boot_ms.items():
+        if ms > args.boot_budget_ms:
+            failures.append(f"boot time over budget ({entry})")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
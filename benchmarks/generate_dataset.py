@@ -0,0 +1,174 @@
+"""
+Deterministic synthetic dataset generator for Lift Log.
+
+Populates a Postgres database with users who train a few times a week for a
+number of years. Each exercise follows a progression curve: fast early gains
+that flatten out, periodic deload weeks, day-to-day noise, and an occasional
+tested 1RM. The same arguments and seed always produce the same rows.
+
+Rows are bulk loaded with COPY, using explicitly assigned ids; the id
+sequences are moved past them afterwards. Run it against a scratch database.
+
+Usage:
+    python -m benchmarks.generate_dataset --dsn postgresql://localhost/liftlog_bench \
+        --users 100 --years 3 --sessions-per-week 3 --exercises-per-session 4 --sets-per-exercise 4
+"""
+
+import argparse
+import io
+import math
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from src.repository import db
+
+# exercise -> (starting 1RM range in lb, relative long-term gain)
+EXERCISES = {
+    "bench press": ((95, 225), 0.45),
+    "squat": ((135, 315), 0.60),
+    "deadlift": ((155, 365), 0.60),
+    "overhead press": ((65, 135), 0.35),
+    "barbell row": ((95, 185), 0.40),
+    "front squat": ((95, 225), 0.45),
+    "incline bench press": ((85, 185), 0.40),
+    "romanian deadlift": ((115, 255), 0.50),
+    "pull up": ((0, 45), 0.80),
+    "dip": ((0, 45), 0.80),
+}
+REP_SCHEMES = (5, 5, 3, 8, 10)
+
+def one_rm_at(start: float, gain: float, weeks: float) -> float:
+    '''diminishing returns: most of the gain comes in the first couple of years'''
+    return start * (1 + gain * math.log1p(weeks / 26) / math.log1p(4))
+
+def round_to_plate(weight: float) -> float:
+    return max(0.0, float(round(weight / 5) * 5))
+
+# building blocks for session notes, so full-text search has something to rank
+NOTE_PHRASES = (
+    "felt strong", "lower back tight", "bar speed slow", "new belt", "slept badly",
+    "knee sore after squats", "easy deload", "grip gave out", "paused reps", "great pump",
+    "shoulder clicking on bench", "rushed between sets", "tried wider stance", "pr attempt",
+)
+
+def session_note(rng: random.Random) -> Optional[str]:
+    '''a short free-text note, or None for about half the sessions'''
+    if rng.random() < 0.5:
+        return None
+    return ", ".join(rng.sample(NOTE_PHRASES, k=rng.randint(1, 3)))
+
+def generate_user(rng: random.Random, years: float, sessions_per_week: int,
+                  exercises_per_session: int, sets_per_exercise: int, start_day: datetime):
+    '''yields (performed_at, [(exercise, weight, reps, is_1rm, set_index), ...]) per session'''
+    lifts = rng.sample(sorted(EXERCISES), k=min(len(EXERCISES), max(exercises_per_session + 2, 4)))
+    start_1rm = {ex: rng.uniform(*EXERCISES[ex][0]) for ex in lifts}
+    total_weeks = int(years * 52)
+
+    for week in range(total_weeks):
+        deload = week % 8 == 7
+        for day in sorted(rng.sample(range(7), k=min(7, sessions_per_week))):
+            performed_at = start_day + timedelta(weeks=week, days=day, hours=rng.randint(6, 20))
+            rows = []
+            for exercise in rng.sample(lifts, k=min(len(lifts), exercises_per_session)):
+                one_rm = one_rm_at(start_1rm[exercise], EXERCISES[exercise][1], week) * rng.uniform(0.97, 1.03)
+                if deload:
+                    one_rm *= 0.85
+                reps = rng.choice(REP_SCHEMES)
+                for set_index in range(1, sets_per_exercise + 1):
+                    weight = round_to_plate(one_rm / (1 + reps / 30) * rng.uniform(0.9, 1.0))
+                    rows.append((exercise, weight, reps, 0, set_index))
+                # now and then, work up to a tested single
+                if not deload and rng.random() < 0.02:
+                    rows.append((exercise, round_to_plate(one_rm), 1, 1, sets_per_exercise + 1))
+            yield performed_at, rows
+
+def _copy(cur, table: str, columns: tuple, rows: list):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join("\\N" if v is None else str(v) for v in row) + "\n")
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+def generate(conn, users: int, years: float, sessions_per_week: int, exercises_per_session: int,
+             sets_per_exercise: int, seed: int = 0) -> dict:
+    '''
+    I: open connection and dataset shape
+    P: build rows deterministically, COPY them user by user, then move the id sequences
+    O: row counts and load time
+    '''
+    started = time.perf_counter()
+    cur = conn.cursor()
+    cur.execute("SELECT COALESCE(MAX(user_id), 0) FROM users;")
+    next_user = cur.fetchone()[0] + 1
+    cur.execute("SELECT COALESCE(MAX(session_id), 0) FROM sessions;")
+    next_session = cur.fetchone()[0] + 1
+    cur.execute("SELECT COALESCE(MAX(set_id), 0) FROM sets;")
+    next_set = cur.fetchone()[0] + 1
+
+    start_day = datetime(2020, 1, 6)
+    counts = {"users": 0, "sessions": 0, "sets": 0}
+    for n in range(users):
+        rng = random.Random(f"{seed}:{n}")
+        # its own stream, so adding notes left the generated sets unchanged
+        notes_rng = random.Random(f"{seed}:{n}:notes")
+        user_id = next_user + n
+        # '!' is not a bcrypt hash: synthetic users can't log in
+        user_row = (user_id, f"synthetic_{seed}_{n}", "!", start_day.isoformat())
+
+        session_rows, set_rows = [], []
+        for performed_at, rows in generate_user(
+            rng, years, sessions_per_week, exercises_per_session, sets_per_exercise, start_day
+        ):
+            ended_at = performed_at + timedelta(minutes=rng.randint(40, 100))
+            session_rows.append((
+                next_session, user_id, performed_at.isoformat(), session_note(notes_rng), ended_at.isoformat(), None,
+            ))
+            for exercise, weight, reps, is_1rm, set_index in rows:
+                set_rows.append((next_set, next_session, exercise, weight, reps, set_index, is_1rm))
+                next_set += 1
+            next_session += 1
+
+        _copy(cur, "users", ("user_id", "username", "password_hash", "created_at"), [user_row])
+        _copy(cur, "sessions", ("session_id", "user_id", "performed_at", "notes", "ended_at", "session_name"), session_rows)
+        _copy(cur, "sets", ("set_id", "session_id", "exercise", "weight", "reps", "set_index", "is_1rm"), set_rows)
+        counts["users"] += 1
+        counts["sessions"] += len(session_rows)
+        counts["sets"] += len(set_rows)
+
+    cur.execute("SELECT setval(pg_get_serial_sequence('users', 'user_id'), %s);", (next_user + users - 1,))
+    cur.execute("SELECT setval(pg_get_serial_sequence('sessions', 'session_id'), %s);", (max(next_session - 1, 1),))
+    cur.execute("SELECT setval(pg_get_serial_sequence('sets', 'set_id'), %s);", (max(next_set - 1, 1),))
+    conn.commit()
+    cur.execute("ANALYZE users; ANALYZE sessions; ANALYZE sets;")
+    conn.commit()
+
+    counts["seconds"] = time.perf_counter() - started
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True, help="scratch database to load into")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--years", type=float, default=3)
+    parser.add_argument("--sessions-per-week", type=int, default=3)
+    parser.add_argument("--exercises-per-session", type=int, default=4)
+    parser.add_argument("--sets-per-exercise", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    db.DATABASE_URL = args.dsn
+    db.db_init_db()
+    with db.get_conn() as conn:
+        counts = generate(
+            conn, args.users, args.years, args.sessions_per_week,
+            args.exercises_per_session, args.sets_per_exercise, args.seed,
+        )
+    print(
+        f"loaded {counts['users']} users, {counts['sessions']} sessions, {counts['sets']} sets "
+        f"in {counts['seconds']:.1f}s"
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+The web frontend, served by the API itself.
+
+frontend/index.html stays a single self-contained file (it can still be hosted
+anywhere). When the API serves it, the file is rebuilt once per worker, in memory:
+
+  - the API base URL becomes '' so the page calls its own origin: no CORS preflights
+  - the inline stylesheet and app script move to /assets/<name>.<content hash>.<ext>,
+    cached by browsers for a year without revalidating (a new build is a new URL)
+  - the page itself is small and revalidated on every load; its ETag makes that a 304
+  - every asset is gzip- and (if the optional `brotli` package is installed)
+    brotli-compressed up front, so no request compresses anything
+
+Set FRONTEND_PATH to serve another file, or to an empty value to serve none.
+"""
+
+import functools
+import gzip
+import hashlib
+import logging
+import os
+import re
+from pathlib import Path
+
+logger = logging.getLogger("uvicorn.error")
+
+_DEFAULT_PATH = Path(__file__).resolve().parents[2] / "frontend" / "index.html"
+FRONTEND_PATH = os.environ.get('FRONTEND_PATH', str(_DEFAULT_PATH))
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+_API_BASE = re.compile(r"const API = '[^']*';")
+_INLINE_STYLE = re.compile(r"<style>(.*?)</style>", re.S)
+_INLINE_SCRIPT = re.compile(r"<script>(.*?)</script>", re.S)
+
+# preferred first when the client weighs them equally
+_ENCODINGS = ("br", "gzip", "identity")
+
+class Asset:
+    __slots__ = ("media_type", "cache_control", "digest", "bodies")
+
+    def __init__(self, body: bytes, media_type: str, cache_control: str):
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()[:16]
+        self.bodies = {"identity": body, **_compress(body)}
+
+    def etag(self, encoding: str) -> str:
+        # each encoding is a different representation, so it gets its own strong tag
+        return f'"{self.digest}"' if encoding == "identity" else f'"{self.digest}-{encoding}"'
+
+def _compress(body: bytes) -> dict[str, bytes]:
+    compressed = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+    except ImportError:
+        return compressed
+    compressed["br"] = brotli.compress(body, quality=11)
+    return compressed
+
+def build(html: str) -> dict[str, Asset]:
+    '''
+    I: frontend source
+    P:  (1) point the API base URL at this origin
+        (2) move the inline stylesheet and app script out to content-hashed paths
+        (3) compress everything once
+    O: request path -> Asset
+    '''
+    html, found = _API_BASE.subn("const API = '';", html, count=1)
+    if not found:
+        logger.warning("frontend has no `const API = '...'` line; it will keep calling its configured API")
+
+    assets = {}
+
+    def extract(pattern: re.Pattern, name: str, ext: str, media_type: str, tag: str) -> str:
+        match = pattern.search(html)
+        if match is None:
+            return html
+        asset = Asset(match.group(1).encode(), media_type, IMMUTABLE)
+        path = f"/assets/{name}.{asset.digest}.{ext}"
+        assets[path] = asset
+        return html[:match.start()] + tag.format(path=path) + html[match.end():]
+
+    html = extract(_INLINE_STYLE, "app", "css", "text/css; charset=utf-8", '<link rel="stylesheet" href="{path}">')
+    # the app script is the last inline one; external scripts run in document order all the same
+    html = extract(_INLINE_SCRIPT, "app", "js", "text/javascript; charset=utf-8", '<script src="{path}"></script>')
+    assets["/"] = Asset(html.encode(), "text/html; charset=utf-8", REVALIDATE)
+    return assets
+
+@functools.lru_cache(maxsize=1)
+def bundle() -> dict[str, Asset]:
+    '''this worker's assets, built on first use; empty when there is no frontend to serve'''
+    if not FRONTEND_PATH:
+        return {}
+    try:
+        html = Path(FRONTEND_PATH).read_text(encoding="utf-8")
+    except FileNotFoundError:
+        logger.warning("frontend not found at %s; not serving it", FRONTEND_PATH)
+        return {}
+    return build(html)
+
+def negotiate(accept_encoding: str | None, available) -> str:
+    '''
+    I: Accept-Encoding header, encodings the asset has
+    P: highest q-value wins, ties go to the smaller encoding; identity unless refused
+    O: encoding to send
+    '''
+    weights = {}
+    for part in (accept_encoding or "").split(","):
+        coding, *params = [p.strip() for p in part.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if coding:
+            weights[coding.lower()] = q
+    star = weights.get("*", 0.0)
+    choices = [
+        (-weights.get(coding, star), rank, coding)
+        for rank, coding in enumerate(_ENCODINGS)
+        if coding in available and coding != "identity"
+    ]
+    choices = [c for c in choices if c[0] < 0]
+    return min(choices)[2] if choices else "identity"
+
+def not_modified(if_none_match: str | None, etag: str) -> bool:
+    '''If-None-Match uses weak comparison: W/"x" matches "x"'''
+    if not if_none_match:
+        return False
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags
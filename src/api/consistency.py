@@ -0,0 +1,67 @@
+"""
+Read-your-writes across worker processes for the Lift Log API.
+
+db.mark_write keeps its window in one process, but with WEB_CONCURRENCY workers the
+read after a write usually lands on another one, which would send it to a replica that
+may not have replayed the write yet. So the client carries the marker: a successful
+write response sets a short-lived cookie holding the write time, and while it is fresh
+every read on that client's requests goes to the primary, whichever worker serves it.
+
+The cookie only routes the client's own reads; a forged one costs nothing but primary load.
+"""
+
+import math
+import time
+
+from src.repository import db
+
+COOKIE = "lift_log_wrote"
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+CLOCK_SKEW_SECONDS = 1.0  # workers on different hosts don't share a clock exactly
+
+def _cookie(scope, name: str):
+    for key, value in scope["headers"]:
+        if key != b"cookie":
+            continue
+        for part in value.decode("latin-1").split(";"):
+            k, _, v = part.strip().partition("=")
+            if k == name:
+                return v
+    return None
+
+def wrote_recently(value, now: float) -> bool:
+    '''whether a cookie value is a write time inside the read-your-writes window'''
+    try:
+        wrote_at = float(value)
+    except (TypeError, ValueError):
+        return False
+    return now - db.READ_YOUR_WRITES_SECONDS <= wrote_at <= now + CLOCK_SKEW_SECONDS
+
+class ReadYourWritesMiddleware:
+    '''ASGI middleware: route reads to the primary after this client's writes, on any worker'''
+
+    def __init__(self, app, clock=time.time):
+        self.app = app
+        self.clock = clock
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        now = self.clock()
+        writing = scope["method"] not in SAFE_METHODS
+
+        async def send_marking_writes(message):
+            if writing and message["type"] == "http.response.start" and message["status"] < 400:
+                cookie = (f"{COOKIE}={now:.3f}; Max-Age={math.ceil(db.READ_YOUR_WRITES_SECONDS)}; "
+                          "Path=/; HttpOnly; SameSite=Lax")
+                message = {**message, "headers": [*message.get("headers", []), (b"set-cookie", cookie.encode())]}
+            await send(message)
+
+        # the context is copied into the threadpool that runs sync endpoints
+        token = db.reads_on_primary.set(wrote_recently(_cookie(scope, COOKIE), now))
+        try:
+            await self.app(scope, receive, send_marking_writes)
+        finally:
+            db.reads_on_primary.reset(token)
@@ -0,0 +1,66 @@
+"""
+Response formats for Lift Log history endpoints.
+
+History is usually a long list of rows, and plain JSON repeats every key on
+every row. Clients choose a format with the Accept header:
+
+    application/json                        rows (default)
+    application/vnd.liftlog.columns+json    {"column": [values], ...}, keys once per response
+    application/msgpack                     the same columns, MessagePack encoded
+
+Both columnar forms are encoded straight from the transposed query result.
+MessagePack needs the optional `msgpack` package; without it the server
+answers 406 for that type.
+"""
+
+import json
+from datetime import datetime
+
+from fastapi import HTTPException
+from fastapi.responses import Response
+
+JSON = "application/json"
+COLUMNS_JSON = "application/vnd.liftlog.columns+json"
+MSGPACK = "application/msgpack"
+_ALIASES = {"application/x-msgpack": MSGPACK, "application/*": JSON, "*/*": JSON}
+SUPPORTED = (JSON, COLUMNS_JSON, MSGPACK)
+
+def negotiate(accept: str | None) -> str:
+    '''
+    I: Accept header
+    P: highest q-value supported type wins; ties keep header order
+    O: media type to respond with; JSON when nothing matches
+    '''
+    if not accept:
+        return JSON
+    choices = []
+    for position, part in enumerate(accept.split(",")):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        media_type = _ALIASES.get(media_type.lower(), media_type.lower())
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if media_type in SUPPORTED and q > 0:
+            choices.append((-q, position, media_type))
+    return min(choices)[2] if choices else JSON
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"cannot encode {type(value).__name__}")
+
+def encode_columns(columns: dict[str, list], media_type: str) -> bytes:
+    if media_type == MSGPACK:
+        try:
+            import msgpack
+        except ImportError:
+            raise HTTPException(status_code=406, detail="application/msgpack is not available on this server")
+        return msgpack.packb(columns, default=_default, use_bin_type=True)
+    return json.dumps(columns, default=_default, separators=(",", ":")).encode()
+
+def columns_response(columns: dict[str, list], media_type: str) -> Response:
+    return Response(content=encode_columns(columns, media_type), media_type=media_type, headers={"Vary": "Accept"})
@@ -0,0 +1,158 @@
+"""
+Per-user / per-IP rate limiting and load shedding for the Lift Log API.
+
+Token buckets are kept in memory per worker, so limits are per worker process.
+Each request is charged to its user (from /users/{id}/...) and to its client IP,
+against the budget of its route class: login, history, or default. Load is shed
+with a fast 503 when this worker already has too many requests in flight, or
+too many requests queued for a pooled DB connection. Rejected requests never
+reach a threadpool worker or a connection.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+
+from src.repository import db
+
+def _budget(name: str, rate: str, burst: str) -> tuple[float, float]:
+    '''(tokens per second, bucket size) from LIMIT_<NAME>_RATE / LIMIT_<NAME>_BURST'''
+    return (
+        float(os.environ.get(f'LIMIT_{name}_RATE', rate)),
+        float(os.environ.get(f'LIMIT_{name}_BURST', burst)),
+    )
+
+# route class -> {"user": budget, "ip": budget}
+BUDGETS = {
+    "login": {"ip": _budget("LOGIN_IP", "0.2", "10")},
+    "history": {"user": _budget("HISTORY_USER", "2", "20"), "ip": _budget("HISTORY_IP", "10", "50")},
+    "default": {"user": _budget("USER", "10", "40"), "ip": _budget("IP", "50", "100")},
+}
+MAX_IN_FLIGHT = int(os.environ.get('MAX_IN_FLIGHT', '64'))
+MAX_POOL_WAITERS = int(os.environ.get('MAX_POOL_WAITERS', '16'))
+
+# never limited: probes must always answer
+EXEMPT_PATHS = {"/healthz"}
+
+_USER_PATH = re.compile(r"^/users/(\d+)(/.*)?$")
+_HISTORY_SUFFIXES = ("/sessions", "/sets", "/changes", "/stats", "/exercises", "/search")
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        '''spend one token; returns 0 if allowed, else seconds until one is available'''
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class RateLimiter:
+    '''buckets keyed by (route class, "user" | "ip", key); idle full buckets are dropped'''
+
+    def __init__(self, budgets: dict, clock=time.monotonic):
+        self.budgets = budgets
+        self.clock = clock
+        self._buckets: dict[tuple, TokenBucket] = {}
+        self._lock = threading.Lock()
+        self._next_prune = clock() + 60
+
+    def check(self, route_class: str, keys: dict) -> float:
+        '''
+        I: route class, {"user": user_id or None, "ip": address}
+        O: 0 if every applicable bucket had a token, else the longest wait
+        '''
+        now = self.clock()
+        wait = 0.0
+        with self._lock:
+            for scope, (rate, burst) in self.budgets[route_class].items():
+                key = keys.get(scope)
+                if key is None:
+                    continue
+                bucket = self._buckets.get((route_class, scope, key))
+                if bucket is None:
+                    bucket = self._buckets[(route_class, scope, key)] = TokenBucket(rate, burst, now)
+                wait = max(wait, bucket.take(now))
+            if now >= self._next_prune:
+                self._prune(now)
+        return wait
+
+    def _prune(self, now: float):
+        # a bucket that would have refilled completely is the same as a new one
+        idle = [k for k, b in self._buckets.items() if b.tokens + (now - b.updated) * b.rate >= b.capacity]
+        for key in idle:
+            del self._buckets[key]
+        self._next_prune = now + 60
+
+def classify(method: str, path: str) -> tuple[str, str | None]:
+    '''(route class, user id from the path or None)'''
+    if method == "POST" and path in ("/login", "/users"):
+        return "login", None
+    match = _USER_PATH.match(path)
+    user_id = match.group(1) if match else None
+    if method == "GET" and user_id and (match.group(2) or "").endswith(_HISTORY_SUFFIXES):
+        return "history", user_id
+    return "default", user_id
+
+class LimitsMiddleware:
+    '''ASGI middleware: shed load first (cheapest check), then charge the rate limits'''
+
+    def __init__(self, app, limiter: RateLimiter = None, max_in_flight: int = None, max_pool_waiters: int = None):
+        self.app = app
+        self.limiter = limiter or RateLimiter(BUDGETS)
+        self.max_in_flight = MAX_IN_FLIGHT if max_in_flight is None else max_in_flight
+        self.max_pool_waiters = MAX_POOL_WAITERS if max_pool_waiters is None else max_pool_waiters
+        self.in_flight = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        # live streams stay open indefinitely; they are rate limited on connect but
+        # don't count as in-flight work
+        streaming = scope["path"].endswith("/events")
+
+        if not streaming and (self.in_flight >= self.max_in_flight or db.pool_waiters() >= self.max_pool_waiters):
+            await _reject(send, 503, "Server is busy, retry shortly", 1)
+            return
+
+        route_class, user_id = classify(scope["method"], scope["path"])
+        client = scope.get("client")
+        wait = self.limiter.check(route_class, {"user": user_id, "ip": client[0] if client else None})
+        if wait > 0:
+            await _reject(send, 429, "Too many requests", wait)
+            return
+
+        if streaming:
+            await self.app(scope, receive, send)
+            return
+
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+async def _reject(send, status: int, detail: str, retry_after: float):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, round(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -1,21 +1,83 @@
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
-from src.repository.db import db_init_db
-from src.api.routes import users, sessions, sets
+from src.repository.db import db_init_db, close_pools, UserMovingError
+from src.api.routes import users, sessions, sets, batch, frontend
+from src.api import assets
+from src.api.limits import LimitsMiddleware
+from src.api.consistency import ReadYourWritesMiddleware
+from src.services import jobs
 from fastapi.middleware.cors import CORSMiddleware
 
+import logging
 import os
+import threading
+import time
 
+logger = logging.getLogger("uvicorn.error")
+
+# boot timings for this worker process, in ms since src.api.main was imported
+BOOT_STARTED = time.perf_counter()
+boot_stats = {"pid": os.getpid(), "startup_ms": None, "db_ready_ms": None, "first_request_ms": None}
+
+# scale-to-zero hosts: start serving (and answering /healthz) right away, and run
+# the schema check plus one connection warm-up in the background instead
+COLD_START = os.environ.get('LIFT_LOG_COLD_START') == '1'
+db_ready = threading.Event()
+
+def _ms_since_boot() -> float:
+    return round((time.perf_counter() - BOOT_STARTED) * 1000, 1)
+
+def _prepare_db():
+    # one SELECT when the schema is current; its connection stays warm in the pool
+    db_init_db()
+    db_ready.set()
+    boot_stats["db_ready_ms"] = _ms_since_boot()
+
+def _prepare_db_in_background():
+    try:
+        _prepare_db()
+    except Exception:
+        logger.exception("background database warm-up failed; requests will connect on demand")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup logic
-    db_init_db()
+    if COLD_START:
+        threading.Thread(target=_prepare_db_in_background, name="db-warmup", daemon=True).start()
+    else:
+        _prepare_db()
+        # compress the frontend now rather than on the first page load
+        assets.bundle()
+    boot_stats["startup_ms"] = _ms_since_boot()
+    workers = jobs.start()
     yield
-    # Shutdown logic (none needed for now)
+    # Shutdown logic
+    await jobs.stop(workers)
+    close_pools()
+
+class FirstRequestTimer:
+    '''ASGI middleware: logs time-to-first-request once per worker, then stays out of the way'''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        await self.app(scope, receive, send)
+        if scope["type"] == "http" and boot_stats["first_request_ms"] is None:
+            boot_stats["first_request_ms"] = _ms_since_boot()
+            logger.info(
+                "worker %s: startup %.1f ms, first request served %.1f ms after boot",
+                boot_stats["pid"], boot_stats["startup_ms"] or 0, boot_stats["first_request_ms"],
+            )
 
 app = FastAPI(title="lift_log API", lifespan=lifespan)
 
+# innermost: only requests that get past the limits are routed
+app.add_middleware(ReadYourWritesMiddleware)
+# CORS is only for the frontend hosted elsewhere; served from here (GET /) it is same-origin
+# inside CORS, so 429/503 responses still carry CORS headers the browser can read
+app.add_middleware(LimitsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -28,13 +90,35 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(FirstRequestTimer)
+
+@app.exception_handler(UserMovingError)
+async def user_moving(request, exc):
+    # the rebalancer holds a user's writes for a few seconds while it copies their rows
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "5"})
 
 app.include_router(users.router)
 app.include_router(sessions.router)
 app.include_router(sets.router)
+app.include_router(batch.router)
+app.include_router(frontend.router)
 
 @app.get("/debug-env")
 def debug_env():
     url = os.environ.get('DATABASE_URL', 'NOT SET')
     # mask the password
-    return {"database_url": url[:30] + "..." if url else "NOT SET"}
\ No newline at end of file
+    return {"database_url": url[:30] + "..." if url else "NOT SET"}
+
+@app.get("/healthz")
+async def healthz():
+    # never touches the database, so it answers before the warm-up finishes
+    return {"status": "ok", "db_ready": db_ready.is_set()}
+
+@app.get("/debug-boot")
+def debug_boot():
+    return boot_stats
+
+@app.get("/debug-jobs")
+def debug_jobs():
+    # depth and lag of the deferred-work queue; write latency shouldn't move when these do
+    return jobs.metrics()
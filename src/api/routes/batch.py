@@ -0,0 +1,40 @@
+from fastapi import APIRouter, HTTPException
+from src.api.routes.sets import exercise_and_rows
+from src.api.schemas import WriteBatchRequest, StartSessionOperation, AddSetsOperation
+from src.services.api_services import apply_write_batch, local_iso
+from src.services.errors import BadRequestError
+
+router = APIRouter(tags=["batch"])
+
+@router.post("/users/{user_id}/batch")
+def post_batch(user_id: int, batch: WriteBatchRequest):
+    '''
+    apply queued offline writes in one transaction. retrying a batch is safe:
+    operations whose idempotency_key was already applied return the stored result
+    '''
+    operations = []
+    rejected = {}  # position -> result of an operation that fails before reaching the database
+    for i, op in enumerate(batch.operations):
+        if isinstance(op, StartSessionOperation):
+            performed_at = local_iso(op.performed_at) if op.performed_at else None
+            kwargs = {"session_name": op.session_name, "performed_at": performed_at, "notes": op.notes}
+        elif isinstance(op, AddSetsOperation):
+            try:
+                exercise, rows = exercise_and_rows(op.sets)
+            except BadRequestError as e:
+                # like a failure in the database, it is not stored: a corrected retry runs
+                rejected[i] = {"idempotency_key": op.idempotency_key, "status": 400, "replayed": False,
+                               "detail": str(e)}
+                continue
+            kwargs = {"exercise": exercise, "sets": rows}
+        else:
+            kwargs = {"session_name": op.session_name}
+        operations.append((op.idempotency_key, op.op, kwargs))
+
+    if len({op.idempotency_key for op in batch.operations}) != len(batch.operations):
+        raise HTTPException(status_code=400, detail="Idempotency keys must be unique within a batch")
+    try:
+        applied = iter(apply_write_batch(user_id, operations))
+    except BadRequestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"results": [rejected[i] if i in rejected else next(applied) for i in range(len(batch.operations))]}
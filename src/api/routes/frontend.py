@@ -0,0 +1,28 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response
+
+from src.api import assets
+
+router = APIRouter(tags=["frontend"])
+
+def _serve(path: str, request: Request) -> Response:
+    asset = assets.bundle().get(path)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    encoding = assets.negotiate(request.headers.get("accept-encoding"), asset.bodies)
+    etag = asset.etag(encoding)
+    headers = {"ETag": etag, "Cache-Control": asset.cache_control, "Vary": "Accept-Encoding"}
+    if assets.not_modified(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=asset.bodies[encoding], media_type=asset.media_type, headers=headers)
+
+@router.api_route("/", methods=["GET", "HEAD"], include_in_schema=False)
+async def index(request: Request):
+    return _serve("/", request)
+
+@router.api_route("/assets/{name}", methods=["GET", "HEAD"], include_in_schema=False)
+async def asset(name: str, request: Request):
+    return _serve(f"/assets/{name}", request)
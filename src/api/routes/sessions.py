@@ -1,18 +1,27 @@
-from fastapi import APIRouter, HTTPException
+import asyncio
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from src.api import formats
 from src.api.schemas import SessionCreate, SessionResponse, SessionEnd
 from src.services.api_services import (
     create_session,
     end_active_session,
     get_active_session,
-    get_sessions_for_user
+    get_sessions_for_user,
+    local_iso,
+    search_sessions,
 )
 from src.services.errors import BadRequestError, ConflictError, NotFoundError
+from src.services import events
 
 router = APIRouter(tags=["sessions"])
 
 @router.post("/users/{user_id}/sessions", response_model=SessionResponse, status_code=201)
 def post_session(user_id: int, session: SessionCreate):
-    performed_at = session.performed_at.isoformat(timespec="seconds") if session.performed_at else None
+    performed_at = local_iso(session.performed_at) if session.performed_at else None
     try:
         return create_session(user_id, session.session_name, performed_at, session.notes)
     except BadRequestError as e:
@@ -40,6 +49,55 @@ def read_active_session(user_id: int):
     except NotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
 
+@router.get("/users/{user_id}/sessions/active/events")
+async def stream_active_session(user_id: int, request: Request):
+    '''server-sent events: sets_added and session_ended for this user's active session'''
+    async def event_stream():
+        queue = events.subscribe(user_id)
+        try:
+            yield ": connected\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=events.HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield events.format_sse(event)
+        finally:
+            events.unsubscribe(user_id, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/users/{user_id}/sessions/search")
+def read_session_search(user_id: int, q: str, limit: int = 20, offset: int = 0, match: str = "any"):
+    try:
+        return search_sessions(user_id, q, limit, offset, match)
+    except BadRequestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.get("/users/{user_id}/sessions")
-def read_sessions(user_id: int):
-    return get_sessions_for_user(user_id)
\ No newline at end of file
+def read_sessions(
+        user_id: int,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        include: Optional[str] = None,
+        fields: Optional[str] = None,
+        accept: Optional[str] = Header(None),
+):
+    # include=sets embeds each session's sets; fields=session_id,performed_at,sets.weight,...
+    if include not in (None, "sets"):
+        raise HTTPException(status_code=400, detail="include only supports 'sets'")
+    media_type = formats.negotiate(accept)
+    try:
+        if media_type != formats.JSON:
+            columns = get_sessions_for_user(
+                user_id, start, end, include_sets=include == "sets", fields=fields, as_columns=True,
+            )
+            return formats.columns_response(columns, media_type)
+        return get_sessions_for_user(user_id, start, end, include_sets=include == "sets", fields=fields)
+    except BadRequestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
@@ -1,6 +1,12 @@
-from fastapi import APIRouter, HTTPException
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException
+from src.api import formats
 from src.api.schemas import UserCreate, UserResponse, LoginRequest
-from src.services.api_services import create_user, login_user, get_exercises_for_user, get_sets_for_exercise
+from src.services.api_services import (
+    create_user, login_user, get_exercises_for_user, get_sets_for_exercise, get_changes_for_user,
+    get_exercise_stats, get_personal_records,
+)
 from src.services.errors import BadRequestError, ConflictError, NotFoundError
 
 router = APIRouter(tags=["users"])
@@ -26,5 +32,36 @@ def read_exercises(id: int):
     return get_exercises_for_user(id)
 
 @router.get("/users/{id}/sets")
-def read_sets_for_exercise(id: int, exercise: str):
-    return get_sets_for_exercise(id, exercise)
\ No newline at end of file
+def read_sets_for_exercise(
+        id: int,
+        exercise: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        accept: Optional[str] = Header(None),
+):
+    media_type = formats.negotiate(accept)
+    try:
+        if media_type == formats.JSON:
+            return get_sets_for_exercise(id, exercise, start, end)
+        columns = get_sets_for_exercise(id, exercise, start, end, as_columns=True)
+    except BadRequestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return formats.columns_response(columns, media_type)
+
+@router.get("/users/{id}/stats")
+def read_exercise_stats(id: int, exercise: str):
+    try:
+        return get_exercise_stats(id, exercise)
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@router.get("/users/{id}/records")
+def read_personal_records(id: int):
+    return get_personal_records(id)
+
+@router.get("/users/{id}/changes")
+def read_changes(id: int, since: int = 0):
+    try:
+        return get_changes_for_user(id, since)
+    except BadRequestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
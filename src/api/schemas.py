@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import List, Optional
+from typing import Annotated, List, Literal, Optional, Union
 
 # USER SCHEMAS
 
@@ -32,7 +32,7 @@ class SessionResponse(BaseModel):
     session_name: Optional[str] = None
 
 class SessionEnd(BaseModel):
-    session_name: Optional[str] = None
+    session_name: Optional[str] = Field(None, max_length=100)
 
 # SET SCHEMAS
 class SetCreate(BaseModel):
@@ -44,3 +44,25 @@ class SetCreate(BaseModel):
 # CONVENIENCE SCHEMAS
 class SetCreateRequest(BaseModel):
     sets: List[SetCreate] = Field(..., min_length=1)
+
+# BATCH SCHEMAS
+# each queued operation reuses the body of its single-shot endpoint
+class BatchOperationBase(BaseModel):
+    idempotency_key: str = Field(..., min_length=1, max_length=100)
+
+class StartSessionOperation(BatchOperationBase, SessionCreate):
+    op: Literal["start_session"]
+
+class AddSetsOperation(BatchOperationBase, SetCreateRequest):
+    op: Literal["add_sets"]
+
+class EndSessionOperation(BatchOperationBase, SessionEnd):
+    op: Literal["end_session"]
+
+BatchOperation = Annotated[
+    Union[StartSessionOperation, AddSetsOperation, EndSessionOperation],
+    Field(discriminator="op"),
+]
+
+class WriteBatchRequest(BaseModel):
+    operations: List[BatchOperation] = Field(..., min_length=1, max_length=100)
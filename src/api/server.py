@@ -0,0 +1,61 @@
+"""
+Production entry point for the Lift Log API.
+
+Runs uvicorn with WEB_CONCURRENCY worker processes. The schema check runs
+once in the parent before the workers fork, so each worker's own startup
+check is a single SELECT. With LIFT_LOG_COLD_START=1 the parent skips it and
+binds the port right away; each worker's background warm-up migrates instead,
+under the same advisory lock. The database connection budget is split evenly
+across workers unless DB_POOL_SIZE is set explicitly.
+
+The per-IP rate limits key on the client address, so behind the host's proxy
+X-Forwarded-For must be trusted: FORWARDED_ALLOW_IPS lists the proxy addresses or
+CIDRs (default 127.0.0.1, uvicorn's). The client is the rightmost hop that isn't
+one of them, so an address the client wrote into the header itself is ignored.
+
+Usage: python -m src.api.server
+"""
+
+import os
+
+import uvicorn
+
+from src.repository.db import db_init_db, close_pools
+
+def worker_pool_size(workers: int) -> int:
+    '''
+    I: number of worker processes
+    P: DB_POOL_SIZE wins if set; otherwise share DB_MAX_CONNECTIONS evenly
+    O: connections each worker may hold
+    '''
+    if os.environ.get('DB_POOL_SIZE'):
+        return int(os.environ['DB_POOL_SIZE'])
+    max_connections = int(os.environ.get('DB_MAX_CONNECTIONS', '20'))
+    return max(1, max_connections // workers)
+
+def forwarded_allow_ips() -> str:
+    '''proxies whose X-Forwarded-For is believed; anything else is limited by its own address'''
+    # never '*': uvicorn would then take the leftmost X-Forwarded-For entry, which the client writes
+    return os.environ.get('FORWARDED_ALLOW_IPS', '127.0.0.1')
+
+def main():
+    workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+    # workers inherit the environment, so this is their budget
+    os.environ['DB_POOL_SIZE'] = str(worker_pool_size(workers))
+
+    # read here rather than imported from src.api.main, which the parent has no need to load
+    if os.environ.get('LIFT_LOG_COLD_START') != '1':
+        db_init_db()
+        close_pools()  # workers open their own pools
+
+    uvicorn.run(
+        "src.api.main:app",
+        host=os.environ.get('HOST', '0.0.0.0'),
+        port=int(os.environ.get('PORT', '8000')),
+        workers=workers,
+        proxy_headers=True,
+        forwarded_allow_ips=forwarded_allow_ips(),
+    )
+
+if __name__ == "__main__":
+    main()
@@ -3,14 +3,57 @@ Entry point for the Lift Log application.
 
 Initializes the application and runs the main program loop,
 handling user interaction and control flow.
+
+Batch mode: python -m src.main import log.txt --username <name>
 """
 
+import argparse
+import sys
+
 from src.menu_options import (start_new_session, add_set_ui, view_active_session,
                           view_stats, view_sessions, end_active_session, closeout)
-from src.services.services import get_username, get_or_create_user, get_menu_choice
+from src.services.services import get_username, get_or_create_user, get_menu_choice, get_user_id, import_log
 from src.repository.db import db_init_db
 
+def run_import(argv: list[str]) -> int:
+    '''
+    I: command line after 'import'
+    P:  (1) stream the log file through import_log, no prompts
+        (2) print each skipped token/line and a throughput summary
+    O: exit status (1 if anything was skipped)
+    '''
+    parser = argparse.ArgumentParser(prog="python -m src.main import")
+    parser.add_argument("path", help="text log: '# YYYY-MM-DD name' headers, 'exercise: 135x5, 225x1 1RM' lines")
+    parser.add_argument("--username", required=True, help="existing account to import into")
+    args = parser.parse_args(argv)
+
+    db_init_db()
+    user_id = get_user_id(args.username)
+    if user_id is None:
+        print(f"No account found with username '{args.username}'.")
+        return 1
+
+    errors = 0
+
+    def report(line_no: int, message: str):
+        nonlocal errors
+        errors += 1
+        print(f"line {line_no}: {message} (skipped)")
+
+    with open(args.path, encoding="utf-8") as log:
+        summary = import_log(user_id, log, on_error=report)
+
+    print(
+        f"imported {summary['sessions']} sessions, {summary['sets']} sets "
+        f"from {summary['lines']} lines in {summary['seconds']:.2f}s "
+        f"({summary['lines_per_second']:.0f} lines/s); {errors} skipped, "
+        f"{summary['already_imported']} sessions already imported"
+    )
+    return 1 if errors else 0
+
 def main():
+    if sys.argv[1:2] == ["import"]:
+        sys.exit(run_import(sys.argv[2:]))
 
     db_init_db()
     active_username = get_username()
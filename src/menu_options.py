@@ -22,7 +22,7 @@ def start_new_session(user_id: int, notes=None) -> int:
     '''
     performed_at = datetime.now().isoformat(timespec="seconds")
 
-    with get_conn() as conn:
+    with get_conn(user_id=user_id) as conn:
         # end any existing active sessions & start new one
         closed_sessions = db_end_all_open_sessions(conn, user_id, performed_at)
         if closed_sessions > 0:
@@ -44,7 +44,7 @@ def add_set_ui(user_id):
     O: none
     '''
 
-    with get_conn() as conn:
+    with get_conn(user_id=user_id) as conn:
         session_id = db_get_active_session(conn, user_id)
 
         if session_id is None:
@@ -87,7 +87,7 @@ def view_active_session(user_id):
     O: none
     '''
 
-    with get_conn() as conn:
+    with get_conn(user_id=user_id) as conn:
         session_id = db_get_active_session(conn, user_id)
 
         if session_id is None:
@@ -118,15 +118,15 @@ def view_stats(user_id):
         print("No exercise provided.")
         return
 
-    with get_conn() as conn:
+    with get_conn(user_id=user_id) as conn:
         cursor = conn.cursor()
 
         cursor.execute('''
             SELECT s.weight, s.reps, s.is_1rm
             FROM sets s
             JOIN sessions sess ON sess.session_id = s.session_id
-            WHERE sess.user_id = ?
-            AND lower(s.exercise) = ?
+            WHERE sess.user_id = %s
+            AND lower(s.exercise) = %s
             ORDER BY s.weight DESC
             ''', (user_id, exercise,))
 
@@ -146,8 +146,8 @@ def view_stats(user_id):
             SELECT s.weight, s.reps
             FROM sets s
             JOIN sessions sess ON sess.session_id = s.session_id
-            WHERE sess.user_id = ?
-            AND lower(s.exercise) = ?
+            WHERE sess.user_id = %s
+            AND lower(s.exercise) = %s
             AND s.is_1rm = 1
             ORDER BY s.weight DESC
             LIMIT 1
@@ -168,12 +168,12 @@ def view_sessions(user_id):
     O: none
     '''
 
-    with get_conn() as conn:
+    with get_conn(user_id=user_id) as conn:
         cursor = conn.cursor()
         cursor.execute('''
             SELECT session_id, performed_at
             FROM sessions
-            WHERE user_id = ?
+            WHERE user_id = %s
             ORDER BY session_id DESC
             ''', (user_id,))
         rows = cursor.fetchall()
@@ -193,7 +193,7 @@ def end_active_session(user_id):
     O: none
     '''
 
-    with get_conn() as conn:
+    with get_conn(user_id=user_id) as conn:
         cursor = conn.cursor()
         ended_at = datetime.now().isoformat(timespec="seconds")
 
@@ -201,7 +201,7 @@ def end_active_session(user_id):
             """
             SELECT session_id
             FROM sessions
-            WHERE user_id = ?
+            WHERE user_id = %s
             AND ended_at IS NULL
             ORDER BY session_id DESC
             LIMIT 1
@@ -218,8 +218,8 @@ def end_active_session(user_id):
 
         cursor.execute(
             """UPDATE sessions
-            SET ended_at = ?
-            WHERE session_id = ?
+            SET ended_at = %s
+            WHERE session_id = %s
             """,
             (ended_at, session_id)
         )
@@ -230,7 +230,7 @@ def end_active_session(user_id):
 def closeout(user_id):
     '''end program, option to close open session'''
 
-    with get_conn() as conn:
+    with get_conn(user_id=user_id) as conn:
         session_id = db_get_active_session(conn, user_id)
 
         if session_id is not None:
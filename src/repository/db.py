@@ -6,78 +6,682 @@ operations for storing and retrieving lift data.
 """
 
 import os
+import itertools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
 from typing import Optional, Sequence
-import psycopg2
-import psycopg2.extras
 
+from src.repository import shards
+
+# psycopg2 is imported on first use, not at import time, to keep it off the
+# cold-start path; see LIFT_LOG_COLD_START in src/api/main.py
+
+# primary takes every write; replicas (comma separated, optional) serve reads
 DATABASE_URL = os.environ.get('DATABASE_URL')
+DATABASE_REPLICA_URLS = [
+    url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()
+]
+# extra shard primaries (comma separated, optional). DATABASE_URL is always shard 0 and
+# keeps accounts and the user -> shard directory; see src/repository/shards.py
+DATABASE_SHARD_URLS = [
+    url.strip() for url in os.environ.get('DATABASE_SHARD_URLS', '').split(',') if url.strip()
+]
+# how long a process trusts its cached copy of a user's directory entry
+SHARD_DIRECTORY_TTL = float(os.environ.get('SHARD_DIRECTORY_TTL', '10'))
+# after a user writes, their reads stay on the primary for this many seconds
+READ_YOUR_WRITES_SECONDS = float(os.environ.get('READ_YOUR_WRITES_SECONDS', '5'))
+# per-worker connection budget, per DSN; total = workers x DB_POOL_SIZE
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '5'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+# server-side prepared statements for the single-statement writes; set to 0 behind a
+# transaction-pooling proxy (pgbouncer), where a prepared name doesn't stay on one backend
+DB_PREPARED_STATEMENTS = os.environ.get('DB_PREPARED_STATEMENTS', '1') != '0'
 
 SetRow = tuple[float, int, int]  # (weight, reps, is_1rm)
 
-def get_conn():
-    conn = psycopg2.connect(DATABASE_URL)
-    return conn
+# this process's own writes. other workers can't see them: for API requests the client
+# carries a write marker between workers instead (src/api/consistency.py), which sets
+# reads_on_primary for the request
+_recent_writes: dict[tuple[str, int], float] = {}  # ('user' | 'session', id) -> monotonic time
+_recent_writes_lock = threading.Lock()
+reads_on_primary: ContextVar[bool] = ContextVar("reads_on_primary", default=False)
+_replica_cycle = itertools.count()
+
+def mark_write(user_id: int = None, session_id: int = None):
+    '''record a committed write so the next reads for this user/session go to the primary'''
+    now = time.monotonic()
+    with _recent_writes_lock:
+        if user_id is not None:
+            _recent_writes[('user', user_id)] = now
+        if session_id is not None:
+            _recent_writes[('session', session_id)] = now
+
+        # keep the window table small; anything older than the window is irrelevant
+        if len(_recent_writes) > 10_000:
+            cutoff = now - READ_YOUR_WRITES_SECONDS
+            for key in [k for k, t in _recent_writes.items() if t < cutoff]:
+                del _recent_writes[key]
+
+def _wrote_recently(user_id: Optional[int], session_id: Optional[int]) -> bool:
+    cutoff = time.monotonic() - READ_YOUR_WRITES_SECONDS
+    with _recent_writes_lock:
+        for key in (('user', user_id), ('session', session_id)):
+            if key[1] is not None and _recent_writes.get(key, float('-inf')) >= cutoff:
+                return True
+    return False
+
+class UserMovingError(Exception):
+    '''the user is being moved between shards; their writes are refused until the move finishes'''
+
+def shard_urls() -> list[str]:
+    return [DATABASE_URL] + DATABASE_SHARD_URLS
+
+_directory: Optional[shards.Directory] = None
+_ring: Optional[shards.Ring] = None
+
+def _load_placement(user_id: int) -> Optional[tuple[int, bool]]:
+    with get_conn(shard=0, autocommit=True) as conn:
+        return db_get_user_placement(conn, user_id)
+
+def user_placement(user_id: int) -> tuple[int, bool]:
+    '''(shard, moving) for a user; without extra shards this never queries'''
+    global _directory
+    if not DATABASE_SHARD_URLS:
+        return 0, False
+    if _directory is None:
+        _directory = shards.Directory(SHARD_DIRECTORY_TTL, _load_placement)
+    return _directory.placement(user_id)
+
+def user_shard(user_id: int) -> int:
+    return user_placement(user_id)[0]
+
+def place_new_user(username: str) -> int:
+    '''shard for an account that doesn't exist yet'''
+    global _ring
+    n_shards = len(shard_urls())
+    if n_shards == 1:
+        return 0
+    if _ring is None or _ring.n_shards != n_shards:
+        _ring = shards.Ring(n_shards)
+    return _ring.shard_for(username)
+
+def pick_dsn(readonly: bool = False, user_id: int = None, session_id: int = None, shard: int = None) -> str:
+    '''
+    I: whether the caller only reads, who it reads for, or an explicit shard
+    P:  (1) shard: the explicit one, else the user's (directory), else the one the session id names
+        (2) writes, or reads inside a user's read-your-writes window (this process's, or the
+            client's, via reads_on_primary) -> that shard's primary
+        (3) any other read on shard 0 -> next replica, round robin
+    O: DSN to connect to
+    '''
+    if shard is None:
+        if user_id is not None:
+            shard = user_shard(user_id)
+        elif session_id is not None:
+            shard = shards.shard_of_id(session_id, len(shard_urls()))
+        else:
+            shard = 0
+    if shard != 0:
+        return shard_urls()[shard]
+    if not readonly or not DATABASE_REPLICA_URLS or reads_on_primary.get() or _wrote_recently(user_id, session_id):
+        return DATABASE_URL
+    return DATABASE_REPLICA_URLS[next(_replica_cycle) % len(DATABASE_REPLICA_URLS)]
+
+_round_trips = 0
+_round_trips_lock = threading.Lock()
+
+def round_trips() -> int:
+    '''statements (and BEGIN/COMMITs) this process has sent to a database; tests diff it around a request'''
+    return _round_trips
+
+def _count_round_trips(n: int = 1):
+    global _round_trips
+    with _round_trips_lock:
+        _round_trips += n
+
+_connection_class = None
+
+def _connection_factory():
+    '''
+    psycopg2 connection class for pooled connections: counts round trips and remembers
+    which statements are prepared on its backend. built on first use, like every psycopg2 import here
+    '''
+    global _connection_class
+    if _connection_class is not None:
+        return _connection_class
+
+    import psycopg2.extensions
+    import psycopg2.extras
+
+    class CountingCursorMixin:
+        def execute(self, query, vars=None):
+            self.connection.count_round_trips()
+            return super().execute(query, vars)
+
+        def executemany(self, query, vars_list):
+            vars_list = list(vars_list)
+            self.connection.count_round_trips(len(vars_list))
+            return super().executemany(query, vars_list)
+
+    class Cursor(CountingCursorMixin, psycopg2.extensions.cursor):
+        pass
+
+    class DictCursor(CountingCursorMixin, psycopg2.extras.RealDictCursor):
+        pass
+
+    class Connection(psycopg2.extensions.connection):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.cursor_factory = Cursor
+            self.dict_cursor_factory = DictCursor
+            self.prepared: set[str] = set()
+
+        def count_round_trips(self, n: int = 1):
+            # outside autocommit psycopg2 sends its own BEGIN before the first statement
+            if not self.autocommit and self.status == psycopg2.extensions.STATUS_READY:
+                n += 1
+            _count_round_trips(n)
+
+        def commit(self):
+            if self.status != psycopg2.extensions.STATUS_READY:
+                _count_round_trips()
+            super().commit()
+
+        def rollback(self):
+            if self.status != psycopg2.extensions.STATUS_READY:
+                _count_round_trips()
+            super().rollback()
+
+    _connection_class = Connection
+    return _connection_class
+
+class _Pool:
+    '''
+    Per-DSN connection pool capped at DB_POOL_SIZE connections per worker.
+    Unlike psycopg2's pools, a checkout waits (up to DB_POOL_TIMEOUT seconds)
+    for a free connection instead of failing as soon as the budget is used up.
+    '''
+
+    def __init__(self, dsn: str, size: int):
+        import psycopg2.pool
+        self._pool = psycopg2.pool.ThreadedConnectionPool(0, size, dsn, connection_factory=_connection_factory())
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self.waiters = 0
+
+    def getconn(self):
+        with self._lock:
+            self.waiters += 1
+        try:
+            if not self._slots.acquire(timeout=DB_POOL_TIMEOUT):
+                import psycopg2.pool
+                raise psycopg2.pool.PoolError("timed out waiting for a database connection")
+        finally:
+            with self._lock:
+                self.waiters -= 1
+        try:
+            return self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        try:
+            self._pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+
+_pools: dict[str, _Pool] = {}
+_pools_lock = threading.Lock()
+
+def _get_pool(dsn: str) -> _Pool:
+    with _pools_lock:
+        pool = _pools.get(dsn)
+        if pool is None:
+            pool = _pools[dsn] = _Pool(dsn, DB_POOL_SIZE)
+    return pool
+
+def pool_waiters() -> int:
+    '''requests in this worker currently queued for a pooled connection'''
+    return sum(pool.waiters for pool in list(_pools.values()))
+
+def close_pools():
+    '''close every pooled connection (worker shutdown)'''
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.closeall()
+        _pools.clear()
+
+@contextmanager
+def get_conn(*, readonly: bool = False, autocommit: bool = None, user_id: int = None, session_id: int = None,
+             shard: int = None):
+    '''
+    borrow a pooled connection to the user's (or session's, or given) shard;
+    pass readonly=True to allow replica routing.
+    commits on a clean exit, rolls back on error, and always returns the connection to its pool.
+    autocommit (the default for reads) skips the BEGIN/COMMIT round trips: use it when
+    every statement stands alone, e.g. the single-statement writes below
+    '''
+    if autocommit is None:
+        autocommit = readonly
+    if not readonly and user_id is not None and user_placement(user_id)[1]:
+        raise UserMovingError(f"user {user_id} is being moved to another shard")
+    pool = _get_pool(pick_dsn(readonly, user_id, session_id, shard))
+    conn = pool.getconn()
+    try:
+        if conn.autocommit != autocommit:
+            conn.autocommit = autocommit
+        if autocommit:
+            # not `with conn`: since psycopg2 2.9 that opens a transaction even in autocommit
+            yield conn
+        else:
+            with conn:
+                yield conn
+    finally:
+        pool.putconn(conn)
+
+def _dict_cursor(conn):
+    import psycopg2.extras
+    return conn.cursor(cursor_factory=getattr(conn, 'dict_cursor_factory', psycopg2.extras.RealDictCursor))
+
+def _execute_prepared(cur, name: str, sql: str, params: Sequence):
+    '''
+    I: cursor, statement name, SQL with %s placeholders (cast wherever the type isn't implied), parameters
+    P:  (1) already prepared on this connection -> EXECUTE name(...)
+        (2) first use -> PREPARE and EXECUTE in one message, so preparing costs no extra round trip
+    O: the cursor holds the statement's result
+    '''
+    prepared = getattr(cur.connection, 'prepared', None)
+    if not DB_PREPARED_STATEMENTS or prepared is None:
+        cur.execute(sql, params)
+        return
+
+    import psycopg2
+
+    execute = f"EXECUTE {name} ({', '.join(['%s'] * len(params))});" if params else f"EXECUTE {name};"
+    if name in prepared:
+        try:
+            cur.execute(execute, params)
+        except psycopg2.Error as e:
+            if e.pgcode == '26000':  # invalid_sql_statement_name: the backend lost it, prepare again next time
+                prepared.discard(name)
+            raise
+        return
+
+    # %s placeholders become $1..$n; literal %% stay escaped for the EXECUTE parameters
+    parts = sql.strip().rstrip(';').split('%s')
+    body = parts[0] + ''.join(f'${i}{part}' for i, part in enumerate(parts[1:], 1))
+    try:
+        cur.execute(f"PREPARE {name} AS {body}; {execute}", params)
+    except psycopg2.Error as e:
+        # class 42 errors come from PREPARE itself (42P05: it already exists). anything else
+        # came from EXECUTE, after the statement was stored; rollbacks don't drop prepared statements
+        if not (e.pgcode or '').startswith('42') or e.pgcode == '42P05':
+            prepared.add(name)
+        raise
+    prepared.add(name)
+
+def _columns(cur) -> dict[str, list]:
+    '''transpose a tuple cursor's result into {column: [values]}, no per-row dicts'''
+    names = [d[0] for d in cur.description]
+    rows = cur.fetchall()
+    return {name: list(values) for name, values in zip(names, zip(*rows))} if rows else {n: [] for n in names}
+
+# each schema version lists the DDL that takes the previous version to it.
+# statements stay idempotent so databases created before versioning upgrade cleanly
+SCHEMA_VERSION = 10
+_SCHEMA_LOCK_KEY = 7_241_001  # advisory lock id shared by every lift_log process
+_USER_WRITES_LOCK_CLASS = 7_241  # (class, user_id) advisory locks serialize one user's write batches
+_MIGRATIONS: dict[int, list[str]] = {
+    1: [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id SERIAL PRIMARY KEY,
+            username TEXT NOT NULL UNIQUE,
+            password_hash TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        );
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            performed_at TEXT NOT NULL,
+            notes TEXT,
+            ended_at TEXT NULL,
+            session_name TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        );
+        ''',
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_one_active_session_per_user
+        ON sessions (user_id)
+        WHERE ended_at IS NULL;
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS sets (
+            set_id SERIAL PRIMARY KEY,
+            session_id INTEGER NOT NULL,
+            exercise TEXT NOT NULL,
+            weight REAL NOT NULL CHECK(weight >= 0),
+            reps INTEGER NOT NULL CHECK(reps > 0),
+            set_index INTEGER NOT NULL CHECK(set_index > 0),
+            is_1rm INTEGER NOT NULL CHECK(is_1rm IN (0, 1)),
+            FOREIGN KEY (session_id) REFERENCES sessions(session_id)
+        );
+        ''',
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_sets_unique_order
+        ON sets(session_id, exercise, set_index);
+        ''',
+    ],
+    # change log for delta sync. rows are appended by statement-level triggers so
+    # every write path is covered; txid orders them by commit visibility (see db_get_changes)
+    2: [
+        '''
+        CREATE TABLE IF NOT EXISTS change_log (
+            change_id BIGSERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            entity TEXT NOT NULL CHECK(entity IN ('session', 'set')),
+            entity_id INTEGER NOT NULL,
+            txid XID8 NOT NULL DEFAULT pg_current_xact_id()
+        );
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_change_log_user_txid
+        ON change_log (user_id, txid);
+        ''',
+        '''
+        CREATE OR REPLACE FUNCTION log_session_changes() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO change_log (user_id, entity, entity_id)
+            SELECT user_id, 'session', session_id FROM changed_rows;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql;
+        ''',
+        '''
+        CREATE OR REPLACE FUNCTION log_set_changes() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO change_log (user_id, entity, entity_id)
+            SELECT sessions.user_id, 'set', changed_rows.set_id
+            FROM changed_rows JOIN sessions ON sessions.session_id = changed_rows.session_id;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql;
+        ''',
+        "DROP TRIGGER IF EXISTS trg_sessions_insert_log ON sessions;",
+        '''
+        CREATE TRIGGER trg_sessions_insert_log AFTER INSERT ON sessions
+        REFERENCING NEW TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION log_session_changes();
+        ''',
+        "DROP TRIGGER IF EXISTS trg_sessions_update_log ON sessions;",
+        '''
+        CREATE TRIGGER trg_sessions_update_log AFTER UPDATE ON sessions
+        REFERENCING NEW TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION log_session_changes();
+        ''',
+        "DROP TRIGGER IF EXISTS trg_sets_insert_log ON sets;",
+        '''
+        CREATE TRIGGER trg_sets_insert_log AFTER INSERT ON sets
+        REFERENCING NEW TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION log_set_changes();
+        ''',
+        "DROP TRIGGER IF EXISTS trg_sets_update_log ON sets;",
+        '''
+        CREATE TRIGGER trg_sets_update_log AFTER UPDATE ON sets
+        REFERENCING NEW TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION log_set_changes();
+        ''',
+    ],
+    # results of applied batch operations, replayed when a client retries the same key
+    3: [
+        '''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            user_id INTEGER NOT NULL,
+            idempotency_key TEXT NOT NULL,
+            status INTEGER NOT NULL,
+            response JSONB NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (user_id, idempotency_key)
+        );
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created
+        ON idempotency_keys (created_at);
+        ''',
+    ],
+    # ISO TEXT timestamps -> real timestamps (naive, as the app has always written them),
+    # so time windows are index range scans instead of string comparisons
+    4: [
+        '''
+        ALTER TABLE users
+        ALTER COLUMN created_at TYPE TIMESTAMP USING created_at::timestamp;
+        ''',
+        '''
+        ALTER TABLE sessions
+        ALTER COLUMN performed_at TYPE TIMESTAMP USING performed_at::timestamp,
+        ALTER COLUMN ended_at TYPE TIMESTAMP USING ended_at::timestamp;
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_sessions_user_performed
+        ON sessions (user_id, performed_at);
+        ''',
+    ],
+    # outbox of deferred work (src/services/jobs.py) and the first derived table it maintains.
+    # one pending job per (kind, user): re-queueing bumps generation instead of adding a row
+    5: [
+        '''
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id BIGSERIAL PRIMARY KEY,
+            kind TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            generation INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            requested_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            run_after TIMESTAMPTZ NOT NULL DEFAULT now(),
+            failed_at TIMESTAMPTZ,
+            last_error TEXT
+        );
+        ''',
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_pending
+        ON jobs (kind, user_id)
+        WHERE failed_at IS NULL;
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_jobs_due
+        ON jobs (run_after)
+        WHERE failed_at IS NULL;
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS personal_records (
+            user_id INTEGER NOT NULL,
+            exercise TEXT NOT NULL,
+            set_id INTEGER NOT NULL,
+            weight REAL NOT NULL,
+            reps INTEGER NOT NULL,
+            estimated_1rm REAL NOT NULL,
+            performed_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (user_id, exercise),
+            FOREIGN KEY (user_id) REFERENCES users(user_id),
+            FOREIGN KEY (set_id) REFERENCES sets(set_id)
+        );
+        ''',
+    ],
+    # user -> shard directory. created on every shard, read only on shard 0; accounts
+    # from before sharding live on shard 0
+    6: [
+        '''
+        CREATE TABLE IF NOT EXISTS user_shards (
+            user_id INTEGER PRIMARY KEY,
+            shard INTEGER NOT NULL,
+            moving BOOLEAN NOT NULL DEFAULT false
+        );
+        ''',
+        '''
+        INSERT INTO user_shards (user_id, shard)
+        SELECT user_id, 0 FROM users
+        ON CONFLICT (user_id) DO NOTHING;
+        ''',
+    ],
+    # full-text search over session names (weighted higher) and notes; kept current by
+    # Postgres itself, so no write path has to remember it. adding it rewrites sessions once
+    7: [
+        '''
+        ALTER TABLE sessions
+        ADD COLUMN IF NOT EXISTS search_doc tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', COALESCE(session_name, '')), 'A') ||
+            setweight(to_tsvector('english', COALESCE(notes, '')), 'B')
+        ) STORED;
+        ''',
+    ],
+    # search is always within one user: one GIN index over (user_id, search_doc), via btree_gin,
+    # finds that user's matches without scanning other users' hits or the user's whole history.
+    # replaces the search_doc-only index an earlier version 7 created
+    8: [
+        "CREATE EXTENSION IF NOT EXISTS btree_gin;",
+        '''
+        CREATE INDEX IF NOT EXISTS idx_sessions_user_search
+        ON sessions USING GIN (user_id, search_doc);
+        ''',
+        "DROP INDEX IF EXISTS idx_sessions_search;",
+    ],
+    # what each idempotency key was used for, so reusing a key for a different operation is
+    # refused instead of replaying an unrelated result. NULL for keys stored before this
+    9: [
+        "ALTER TABLE idempotency_keys ADD COLUMN IF NOT EXISTS request_hash TEXT;",
+    ],
+    # change_log retention: rows older than CHANGE_LOG_TTL_HOURS are pruned, and the newest
+    # pruned txid is kept so a cursor from before it is answered with a full sync
+    10: [
+        "ALTER TABLE change_log ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ NOT NULL DEFAULT now();",
+        '''
+        CREATE INDEX IF NOT EXISTS idx_change_log_created
+        ON change_log (created_at);
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS change_log_horizon (
+            singleton BOOLEAN PRIMARY KEY DEFAULT true CHECK (singleton),
+            txid BIGINT NOT NULL
+        );
+        ''',
+    ],
+}
+
+def _db_schema_version(cur) -> int:
+    cur.execute("SELECT to_regclass('schema_version') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        return 0
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version;")
+    return cur.fetchone()[0]
+
+def db_schema_is_current() -> bool:
+    '''one cheap query per shard: is every database already at SCHEMA_VERSION?'''
+    for shard in range(len(shard_urls())):
+        with get_conn(shard=shard) as conn:
+            if _db_schema_version(conn.cursor()) < SCHEMA_VERSION:
+                return False
+    return True
 
 def db_init_db():
-    '''initialize database, create tables if they don't exist'''
-    with get_conn() as conn:
-        cur = conn.cursor()
+    '''
+    bring every shard's schema up to SCHEMA_VERSION.
+    a no-op (one SELECT per shard) when already current; otherwise the DDL runs once,
+    under a transaction-scoped advisory lock, however many workers start at the same time
+    '''
+    for shard in range(len(shard_urls())):
+        _migrate_shard(shard)
+    if DATABASE_SHARD_URLS:
+        _align_id_sequences()
 
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id SERIAL PRIMARY KEY,
-                username TEXT NOT NULL UNIQUE,
-                password_hash TEXT NOT NULL,
-                created_at TEXT NOT NULL
-            );
-        ''')
+# tables whose ids must stay unique across shards, since moved users keep their ids
+_SHARDED_IDS = (("sessions", "session_id"), ("sets", "set_id"))
 
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS sessions (
-                session_id SERIAL PRIMARY KEY,
-                user_id INTEGER NOT NULL,
-                performed_at TEXT NOT NULL,
-                notes TEXT,
-                ended_at TEXT NULL,
-                session_name TEXT,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            );
-        ''')
+def _session_id_increment(cur) -> int:
+    cur.execute("SELECT increment_by FROM pg_sequences WHERE sequencename = 'sessions_session_id_seq';")
+    return cur.fetchone()[0]
 
-        cur.execute('''
-            CREATE UNIQUE INDEX IF NOT EXISTS idx_one_active_session_per_user
-            ON sessions (user_id)
-            WHERE ended_at IS NULL;
-        ''')
+def _align_id_sequences():
+    '''
+    once per shard: make its sequences step by SHARD_ID_STRIDE from an id congruent to the
+    shard index, starting above every id any shard already has (with room for writes racing this)
+    '''
+    increments = {}
+    for shard in range(len(shard_urls())):
+        with get_conn(shard=shard) as conn:
+            cur = conn.cursor()
+            increments[shard] = _session_id_increment(cur)
+    if all(step == shards.SHARD_ID_STRIDE for step in increments.values()):
+        return
 
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS sets (
-                set_id SERIAL PRIMARY KEY,
-                session_id INTEGER NOT NULL,
-                exercise TEXT NOT NULL,
-                weight REAL NOT NULL CHECK(weight >= 0),
-                reps INTEGER NOT NULL CHECK(reps > 0),
-                set_index INTEGER NOT NULL CHECK(set_index > 0),
-                is_1rm INTEGER NOT NULL CHECK(is_1rm IN (0, 1)),
-                FOREIGN KEY (session_id) REFERENCES sessions(session_id)
-            );
-        ''')
+    floors = {table: 0 for table, _ in _SHARDED_IDS}
+    for shard in increments:
+        with get_conn(shard=shard) as conn:
+            cur = conn.cursor()
+            for table, column in _SHARDED_IDS:
+                cur.execute(f"SELECT COALESCE(MAX({column}), 0) FROM {table};")
+                floors[table] = max(floors[table], cur.fetchone()[0])
+
+    for shard, step in increments.items():
+        if step == shards.SHARD_ID_STRIDE:
+            continue
+        with get_conn(shard=shard) as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT pg_advisory_xact_lock(%s);", (_SCHEMA_LOCK_KEY,))
+            # another process may have aligned it while we waited for the lock
+            if _session_id_increment(cur) == shards.SHARD_ID_STRIDE:
+                continue
+            for table, column in _SHARDED_IDS:
+                start = shards.aligned_start(floors[table] + 1000 * shards.SHARD_ID_STRIDE, shard)
+                cur.execute("SELECT pg_get_serial_sequence(%s, %s);", (table, column))
+                cur.execute(
+                    f"ALTER SEQUENCE {cur.fetchone()[0]} INCREMENT BY {shards.SHARD_ID_STRIDE} RESTART WITH {start};"
+                )
+
+def _migrate_shard(shard: int):
+    with get_conn(shard=shard) as conn:
+        cur = conn.cursor()
+        if _db_schema_version(cur) >= SCHEMA_VERSION:
+            return
+
+        cur.execute("SELECT pg_advisory_xact_lock(%s);", (_SCHEMA_LOCK_KEY,))
+        # another process may have migrated while we waited for the lock
+        current = _db_schema_version(cur)
+        if current >= SCHEMA_VERSION:
+            conn.commit()
+            return
 
         cur.execute('''
-            CREATE UNIQUE INDEX IF NOT EXISTS idx_sets_unique_order
-            ON sets(session_id, exercise, set_index);
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
         ''')
+        for version in range(current + 1, SCHEMA_VERSION + 1):
+            for statement in _MIGRATIONS[version]:
+                cur.execute(statement)
+            cur.execute("INSERT INTO schema_version (version) VALUES (%s);", (version,))
 
         conn.commit()
 
-def db_create_session(conn, user_id, session_name, performed_at, notes) -> int:
+def db_create_session(conn, user_id, session_name, performed_at, notes, ended_at=None) -> Optional[int]:
+    '''new session id, or None if ended_at is None and the user already has an active session'''
     cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO sessions (user_id, session_name, performed_at, ended_at, notes) VALUES (%s, %s, %s, %s, %s) RETURNING session_id;",
-        (user_id, session_name, performed_at, None, notes)
-    )
-    session_id = cur.fetchone()[0]
-    return session_id
+    _execute_prepared(cur, "create_session", '''
+        INSERT INTO sessions (user_id, session_name, performed_at, ended_at, notes)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (user_id) WHERE ended_at IS NULL DO NOTHING
+        RETURNING session_id;
+    ''', (user_id, session_name, performed_at, ended_at, notes))
+    row = cur.fetchone()
+    return row[0] if row else None
 
 def db_end_all_open_sessions(conn, user_id: int, ended_at: str, session_name: str = None) -> int:
     cur = conn.cursor()
@@ -111,6 +715,187 @@ def db_insert_sets(conn, session_id, exercise, rows: Sequence[SetRow]) -> int:
     )
     return cur.rowcount
 
+def db_create_imported_session(conn, user_id: int, session_name, performed_at) -> Optional[int]:
+    '''new ended session id, or None if the user already has one at performed_at with this name'''
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO sessions (user_id, session_name, performed_at, ended_at)
+        SELECT %(user_id)s, %(name)s, %(performed_at)s, %(performed_at)s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM sessions
+            WHERE user_id = %(user_id)s AND performed_at = %(performed_at)s
+              AND session_name IS NOT DISTINCT FROM %(name)s
+        )
+        RETURNING session_id;
+    """, {"user_id": user_id, "name": session_name, "performed_at": performed_at})
+    row = cur.fetchone()
+    return row[0] if row else None
+
+def db_insert_session_sets(conn, session_id: int, rows: Sequence[tuple[str, float, int, int, int]]) -> int:
+    '''
+    one multi-row INSERT for a whole session.
+    rows: (exercise, weight, reps, is_1rm, set_index), set_index already assigned
+    '''
+    import psycopg2.extras
+
+    cur = conn.cursor()
+    psycopg2.extras.execute_values(
+        cur,
+        "INSERT INTO sets (session_id, exercise, weight, reps, is_1rm, set_index) VALUES %s",
+        [(session_id, *row) for row in rows],
+        page_size=max(len(rows), 1),
+    )
+    return len(rows)
+
+# writes behind the API endpoints: the active-session check, the write and the live event's
+# NOTIFY are one statement, so each endpoint is a single round trip. the event payload is
+# built by the caller; the session id is merged in here since only the statement knows it
+
+def db_add_sets_to_active_session(conn, user_id: int, exercise: str, rows: Sequence[SetRow],
+                                  channel: str, event: str, jobs: Sequence[str] = ()) -> Optional[tuple[int, int]]:
+    '''
+    I: user id, normalized exercise, (weight, reps, is_1rm) rows, NOTIFY channel and JSON event, job kinds to queue
+    P:  (1) find the active session
+        (2) number the rows after the exercise's last set_index and insert them in one INSERT
+        (3) queue the jobs for this user, if anything was inserted
+        (4) notify with the session id added to the event
+    O: (session id, rows inserted), or None if the user has no active session
+    '''
+    cur = conn.cursor()
+    _execute_prepared(cur, "add_sets_to_active_session", '''
+        WITH active AS (
+            SELECT session_id FROM sessions
+            WHERE user_id = %s AND ended_at IS NULL
+        ), inserted AS (
+            INSERT INTO sets (session_id, exercise, weight, reps, is_1rm, set_index)
+            SELECT active.session_id, %s, added.weight, added.reps, added.is_1rm, prev.set_index + added.n
+            FROM active
+            CROSS JOIN LATERAL (
+                SELECT COALESCE(MAX(set_index), 0) AS set_index FROM sets
+                WHERE sets.session_id = active.session_id AND sets.exercise = %s
+            ) AS prev
+            CROSS JOIN unnest(%s::real[], %s::integer[], %s::integer[])
+                WITH ORDINALITY AS added(weight, reps, is_1rm, n)
+            RETURNING session_id
+        ), queued AS (
+            INSERT INTO jobs (kind, user_id)
+            SELECT kind, %s FROM unnest(%s::text[]) AS kind
+            WHERE EXISTS (SELECT 1 FROM inserted)
+            ON CONFLICT (kind, user_id) WHERE failed_at IS NULL
+            DO UPDATE SET generation = jobs.generation + 1
+        )
+        SELECT active.session_id, (SELECT COUNT(*) FROM inserted),
+               pg_notify(%s, (%s::jsonb || jsonb_build_object('session_id', active.session_id))::text)
+        FROM active;
+    ''', (
+        user_id, exercise, exercise,
+        [weight for weight, _, _ in rows], [reps for _, reps, _ in rows], [is_1rm for _, _, is_1rm in rows],
+        user_id, list(jobs),
+        channel, event,
+    ))
+    row = cur.fetchone()
+    return (row[0], row[1]) if row else None
+
+def db_add_sets_for_many(conn, requests: Sequence[tuple[int, str, Sequence[SetRow], str]],
+                         channel: str, jobs: Sequence[str] = ()) -> list[Optional[tuple[int, int]]]:
+    '''
+    db_add_sets_to_active_session for many requests (possibly from many users) in one statement.
+    I: (user id, normalized exercise, rows, JSON event) per request, in arrival order
+    P:  (1) find each request's active session
+        (2) number every row after its exercise's last set_index, in request order, so two
+            requests for the same exercise get consecutive indexes; one multi-row INSERT
+        (3) queue the jobs once per user that got rows
+        (4) notify per request, in request order. the event also carries the request's first
+            set_index: NOTIFY drops identical payloads sent in one transaction
+    O: per request, (session id, rows inserted), or None if that user has no active session
+    '''
+    cur = conn.cursor()
+    _execute_prepared(cur, "add_sets_for_many", '''
+        WITH request AS (
+            SELECT * FROM unnest(%s::integer[], %s::bigint[], %s::text[], %s::text[])
+                AS request(request_no, user_id, exercise, event)
+        ), active AS (
+            SELECT request.*, sessions.session_id
+            FROM request
+            JOIN sessions ON sessions.user_id = request.user_id AND sessions.ended_at IS NULL
+        ), added AS (
+            SELECT * FROM unnest(%s::integer[], %s::real[], %s::integer[], %s::integer[])
+                WITH ORDINALITY AS added(request_no, weight, reps, is_1rm, n)
+        ), numbered AS (
+            SELECT active.request_no, active.session_id, active.exercise, added.weight, added.reps, added.is_1rm,
+                   prev.set_index + ROW_NUMBER() OVER (
+                       PARTITION BY active.session_id, active.exercise ORDER BY added.n
+                   ) AS set_index
+            FROM added
+            JOIN active USING (request_no)
+            CROSS JOIN LATERAL (
+                SELECT COALESCE(MAX(set_index), 0) AS set_index FROM sets
+                WHERE sets.session_id = active.session_id AND sets.exercise = active.exercise
+            ) AS prev
+        ), inserted AS (
+            INSERT INTO sets (session_id, exercise, weight, reps, is_1rm, set_index)
+            SELECT session_id, exercise, weight, reps, is_1rm, set_index FROM numbered
+            RETURNING session_id
+        ), queued AS (
+            INSERT INTO jobs (kind, user_id)
+            SELECT kind, users.user_id
+            FROM (SELECT DISTINCT user_id FROM active) AS users
+            CROSS JOIN unnest(%s::text[]) AS kind
+            WHERE EXISTS (SELECT 1 FROM inserted)
+            ON CONFLICT (kind, user_id) WHERE failed_at IS NULL
+            DO UPDATE SET generation = jobs.generation + 1
+        ), per_request AS (
+            SELECT request_no, COUNT(*) AS n, MIN(set_index) AS first_set_index
+            FROM numbered GROUP BY request_no
+        )
+        SELECT active.request_no, active.session_id, per_request.n,
+               pg_notify(%s, (active.event::jsonb || jsonb_build_object(
+                   'session_id', active.session_id, 'first_set_index', per_request.first_set_index
+               ))::text)
+        FROM active
+        JOIN per_request USING (request_no)
+        ORDER BY active.request_no;
+    ''', (
+        list(range(len(requests))), [user_id for user_id, _, _, _ in requests],
+        [exercise for _, exercise, _, _ in requests], [event for _, _, _, event in requests],
+        [i for i, (_, _, rows, _) in enumerate(requests) for _ in rows],
+        [weight for _, _, rows, _ in requests for weight, _, _ in rows],
+        [reps for _, _, rows, _ in requests for _, reps, _ in rows],
+        [is_1rm for _, _, rows, _ in requests for _, _, is_1rm in rows],
+        list(jobs),
+        channel,
+    ))
+    results: list[Optional[tuple[int, int]]] = [None] * len(requests)
+    for request_no, session_id, inserted, _ in cur.fetchall():
+        results[request_no] = (session_id, inserted)
+    return results
+
+def db_end_active_session(conn, user_id: int, ended_at: str, session_name: str,
+                          channel: str, event: str, jobs: Sequence[str] = ()) -> int:
+    '''
+    db_end_all_open_sessions plus the jobs to queue and a NOTIFY per ended session,
+    in one statement; returns how many ended
+    '''
+    cur = conn.cursor()
+    _execute_prepared(cur, "end_active_session", '''
+        WITH ended AS (
+            UPDATE sessions
+            SET ended_at = %s, session_name = COALESCE(%s, session_name)
+            WHERE user_id = %s AND ended_at IS NULL
+            RETURNING session_id
+        ), queued AS (
+            INSERT INTO jobs (kind, user_id)
+            SELECT kind, %s FROM unnest(%s::text[]) AS kind
+            WHERE EXISTS (SELECT 1 FROM ended)
+            ON CONFLICT (kind, user_id) WHERE failed_at IS NULL
+            DO UPDATE SET generation = jobs.generation + 1
+        )
+        SELECT ended.session_id,
+               pg_notify(%s, (%s::jsonb || jsonb_build_object('session_id', ended.session_id))::text)
+        FROM ended;
+    ''', (ended_at, session_name, user_id, user_id, list(jobs), channel, event))
+    return len(cur.fetchall())
+
 def db_get_active_session(conn, user_id: int) -> Optional[int]:
     cur = conn.cursor()
     cur.execute(
@@ -126,20 +911,62 @@ def db_get_active_session(conn, user_id: int) -> Optional[int]:
     return row[0] if row else None
 
 def db_get_user(conn, username: str) -> Optional[tuple]:
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    cur = _dict_cursor(conn)
     cur.execute("SELECT user_id, password_hash FROM users WHERE username = %s;", (username,))
     return cur.fetchone()
 
-def db_create_user(conn, created_at: str, username: str, password_hash: str) -> int:
+def db_create_user(conn, created_at: str, username: str, password_hash: str, shard: int = 0) -> Optional[int]:
+    '''new user id (with its directory entry on `shard`), or None if the username is taken. shard 0 only'''
     cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO users (username, password_hash, created_at) VALUES (%s, %s, %s) RETURNING user_id;",
-        (username, password_hash, created_at)
-    )
-    return cur.fetchone()[0]
+    _execute_prepared(cur, "create_user", '''
+        WITH created AS (
+            INSERT INTO users (username, password_hash, created_at)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (username) DO NOTHING
+            RETURNING user_id
+        ), placed AS (
+            INSERT INTO user_shards (user_id, shard)
+            SELECT user_id, %s FROM created
+        )
+        SELECT user_id FROM created;
+    ''', (username, password_hash, created_at, shard))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+def db_copy_user(conn, user_id: int, created_at, username: str, password_hash: str):
+    '''the account row on the user's home shard, so its foreign keys hold there too'''
+    cur = conn.cursor()
+    cur.execute('''
+        INSERT INTO users (user_id, username, password_hash, created_at)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (user_id) DO NOTHING;
+    ''', (user_id, username, password_hash, created_at))
+
+def db_delete_account(conn, user_id: int):
+    '''undo db_create_user: the account and its directory entry, in one statement. shard 0 only'''
+    cur = conn.cursor()
+    cur.execute('''
+        WITH unplaced AS (
+            DELETE FROM user_shards WHERE user_id = %s
+        )
+        DELETE FROM users WHERE user_id = %s;
+    ''', (user_id, user_id))
+
+def db_get_user_placement(conn, user_id: int) -> Optional[tuple[int, bool]]:
+    cur = conn.cursor()
+    cur.execute("SELECT shard, moving FROM user_shards WHERE user_id = %s;", (user_id,))
+    row = cur.fetchone()
+    return (row[0], row[1]) if row else None
+
+def db_set_user_placement(conn, user_id: int, shard: int, moving: bool):
+    cur = conn.cursor()
+    cur.execute('''
+        INSERT INTO user_shards (user_id, shard, moving) VALUES (%s, %s, %s)
+        ON CONFLICT (user_id) DO UPDATE SET shard = EXCLUDED.shard, moving = EXCLUDED.moving;
+    ''', (user_id, shard, moving))
 
 def db_get_sets_by_session(conn, session_id: int):
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    cur = _dict_cursor(conn)
     cur.execute(
         """
         SELECT set_id, exercise, weight, reps, is_1rm
@@ -151,7 +978,7 @@ def db_get_sets_by_session(conn, session_id: int):
     return cur.fetchall()
 
 def db_get_active_session_row(conn, user_id: int):
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    cur = _dict_cursor(conn)
     cur.execute("""
         SELECT session_id, user_id, performed_at, notes, ended_at, session_name
         FROM sessions
@@ -160,18 +987,100 @@ def db_get_active_session_row(conn, user_id: int):
     """, (user_id,))
     return cur.fetchone()
 
-def db_get_sessions_for_user(conn, user_id: int):
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+# optional time windows are [start, end); None leaves that side open.
+# both bounds stay in the same (user_id, performed_at) index range scan
+
+def db_get_sessions_for_user(conn, user_id: int, start: datetime = None, end: datetime = None,
+                             as_columns: bool = False):
+    cur = conn.cursor() if as_columns else _dict_cursor(conn)
     cur.execute("""
         SELECT session_id, session_name, user_id, performed_at, notes, ended_at
         FROM sessions
         WHERE user_id = %s
+        AND performed_at >= COALESCE(%s::timestamp, '-infinity')
+        AND performed_at < COALESCE(%s::timestamp, 'infinity')
         ORDER BY performed_at DESC;
-    """, (user_id,))
+    """, (user_id, start, end))
+    return _columns(cur) if as_columns else cur.fetchall()
+
+SESSION_FIELDS = ("session_id", "session_name", "user_id", "performed_at", "notes", "ended_at")
+SET_FIELDS = ("set_id", "exercise", "weight", "reps", "set_index", "is_1rm")
+
+def db_get_sessions_with_sets(conn, user_id: int, session_fields: Sequence[str], set_fields: Sequence[str],
+                              start: datetime = None, end: datetime = None) -> list[dict]:
+    '''
+    I: user id, columns to return (names from SESSION_FIELDS / SET_FIELDS), optional [start, end) window
+    P:  (1) one LEFT JOIN over the user's sessions and their sets, only the requested columns
+        (2) group in a single pass over the ordered rows
+    O: sessions newest first, each with "sets" (set_fields only) if any set_fields were requested
+    '''
+    # names come from the whitelists above, never from the request
+    assert set(session_fields) <= set(SESSION_FIELDS) and set(set_fields) <= set(SET_FIELDS)
+
+    columns = ["sessions.session_id"] + [f"sessions.{f}" for f in session_fields]
+    columns += [f"sets.{f}" for f in set_fields]
+    join = "LEFT JOIN sets ON sets.session_id = sessions.session_id" if set_fields else ""
+    order = ", sets.exercise, sets.set_index" if set_fields else ""
+
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT {", ".join(columns)}
+        FROM sessions
+        {join}
+        WHERE sessions.user_id = %s
+        AND sessions.performed_at >= COALESCE(%s::timestamp, '-infinity')
+        AND sessions.performed_at < COALESCE(%s::timestamp, 'infinity')
+        ORDER BY sessions.performed_at DESC, sessions.session_id{order};
+    """, (user_id, start, end))
+
+    n_session = len(session_fields)
+    sessions = []
+    current_id = None
+    for row in cur:
+        if row[0] != current_id:
+            current_id = row[0]
+            session = dict(zip(session_fields, row[1:1 + n_session]))
+            if set_fields:
+                session["sets"] = []
+            sessions.append(session)
+        # a session with no sets comes back once, with NULL set columns
+        if set_fields and row[1 + n_session] is not None:
+            session["sets"].append(dict(zip(set_fields, row[1 + n_session:])))
+    return sessions
+
+def db_search_sessions(conn, user_id: int, query: str, match_all: bool, limit: int, offset: int) -> list[dict]:
+    '''
+    I: user id, search text, whether every term must match, page
+    P:  (1) match_all: web-search syntax ("quoted phrase", or, -term), every term required
+            otherwise: any of the text's terms, so partial matches still come back, ranked lower
+        (2) GIN index match on (user_id, search_doc), ranked by cover density (name hits outweigh notes)
+        (3) highlight the notes of the returned page only
+    O: one page of sessions with rank and snippet, best first
+    '''
+    cur = _dict_cursor(conn)
+    cur.execute("""
+        WITH query AS (
+            SELECT CASE WHEN %s THEN websearch_to_tsquery('english', %s) ELSE (
+                SELECT to_tsquery('simple', string_agg(quote_literal(lexeme), ' | '))
+                FROM unnest(tsvector_to_array(to_tsvector('english', %s))) AS lexeme
+            ) END AS q
+        ), hits AS (
+            SELECT sessions.session_id, sessions.session_name, sessions.user_id, sessions.performed_at,
+                   sessions.notes, sessions.ended_at, ts_rank_cd(sessions.search_doc, query.q) AS rank, query.q
+            FROM sessions, query
+            WHERE sessions.user_id = %s AND sessions.search_doc @@ query.q
+            ORDER BY rank DESC, sessions.performed_at DESC, sessions.session_id DESC
+            LIMIT %s OFFSET %s
+        )
+        SELECT session_id, session_name, user_id, performed_at, notes, ended_at, rank,
+               ts_headline('english', COALESCE(notes, ''), q, 'MaxWords=12, MinWords=4, MaxFragments=1') AS snippet
+        FROM hits
+        ORDER BY rank DESC, performed_at DESC, session_id DESC;
+    """, (match_all, query, query, user_id, limit, offset))
     return cur.fetchall()
 
 def db_get_sets_for_session(conn, session_id: int):
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    cur = _dict_cursor(conn)
     cur.execute("""
         SELECT exercise, set_id, weight, reps, set_index, is_1rm
         FROM sets WHERE session_id = %s
@@ -179,8 +1088,13 @@ def db_get_sets_for_session(conn, session_id: int):
     """, (session_id,))
     return cur.fetchall()
 
+def db_session_exists(conn, session_id: int) -> bool:
+    cur = conn.cursor()
+    cur.execute("SELECT EXISTS (SELECT 1 FROM sessions WHERE session_id = %s);", (session_id,))
+    return cur.fetchone()[0]
+
 def db_get_exercises_for_user(conn, user_id: int):
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    cur = _dict_cursor(conn)
     cur.execute("""
         SELECT DISTINCT sets.exercise
         FROM sets
@@ -190,13 +1104,365 @@ def db_get_exercises_for_user(conn, user_id: int):
     """, (user_id,))
     return cur.fetchall()
 
-def db_get_sets_for_exercise(conn, user_id: int, exercise: str):
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+def db_get_sets_for_exercise(conn, user_id: int, exercise: str, start: datetime = None, end: datetime = None,
+                             as_columns: bool = False):
+    cur = conn.cursor() if as_columns else _dict_cursor(conn)
     cur.execute("""
         SELECT sets.set_id, sets.weight, sets.reps, sets.is_1rm, sets.session_id, sessions.performed_at
         FROM sets
         JOIN sessions ON sets.session_id = sessions.session_id
         WHERE sessions.user_id = %s AND sets.exercise = %s
+        AND sessions.performed_at >= COALESCE(%s::timestamp, '-infinity')
+        AND sessions.performed_at < COALESCE(%s::timestamp, 'infinity')
         ORDER BY sessions.performed_at ASC;
-    """, (user_id, exercise))
-    return cur.fetchall()
\ No newline at end of file
+    """, (user_id, exercise, start, end))
+    return _columns(cur) if as_columns else cur.fetchall()
+
+def db_get_changes(conn, user_id: int, since: int) -> tuple[int, list, list, bool]:
+    '''
+    I: user id, cursor from the client's previous sync (0 for a full sync)
+    P:  (1) new cursor = oldest transaction still running; everything older is final
+        (2) a cursor at or before the pruned horizon may have lost changes: full sync instead
+        (3) full sync: every session and set of the user, read from the tables themselves
+            otherwise: sessions and sets logged by transactions in [since, cursor)
+    O: (cursor, changed session rows, changed set rows, whether this was a full sync)
+
+    change_id order is not commit order, so the cursor is a transaction id:
+    a slow transaction that logged early can't be skipped by a faster one.
+    '''
+    cur = _dict_cursor(conn)
+    cur.execute("""
+        SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint AS cursor,
+               (SELECT txid FROM change_log_horizon) AS horizon;
+    """)
+    row = cur.fetchone()
+    cursor = row["cursor"]
+    full = since == 0 or (row["horizon"] is not None and since <= row["horizon"])
+
+    if full:
+        cur.execute("""
+            SELECT session_id, session_name, user_id, performed_at, notes, ended_at
+            FROM sessions WHERE user_id = %s
+            ORDER BY session_id;
+        """, (user_id,))
+        sessions = cur.fetchall()
+        cur.execute("""
+            SELECT set_id, session_id, exercise, weight, reps, set_index, is_1rm
+            FROM sets
+            WHERE session_id IN (SELECT session_id FROM sessions WHERE user_id = %s)
+            ORDER BY set_id;
+        """, (user_id,))
+        return cursor, sessions, cur.fetchall(), True
+
+    cur.execute("""
+        SELECT session_id, session_name, user_id, performed_at, notes, ended_at
+        FROM sessions
+        WHERE session_id IN (
+            SELECT entity_id FROM change_log
+            WHERE user_id = %s AND entity = 'session'
+            AND txid >= %s::text::xid8 AND txid < %s::text::xid8
+        )
+        ORDER BY session_id;
+    """, (user_id, since, cursor))
+    sessions = cur.fetchall()
+
+    cur.execute("""
+        SELECT set_id, session_id, exercise, weight, reps, set_index, is_1rm
+        FROM sets
+        WHERE set_id IN (
+            SELECT entity_id FROM change_log
+            WHERE user_id = %s AND entity = 'set'
+            AND txid >= %s::text::xid8 AND txid < %s::text::xid8
+        )
+        ORDER BY set_id;
+    """, (user_id, since, cursor))
+    sets = cur.fetchall()
+
+    return cursor, sessions, sets, False
+
+def db_prune_change_log(conn, ttl_hours: float, limit: int = 1000) -> int:
+    '''
+    delete up to `limit` change_log rows older than ttl_hours and move the horizon past them,
+    in one statement; returns how many went
+    '''
+    cur = conn.cursor()
+    cur.execute("""
+        WITH pruned AS (
+            DELETE FROM change_log
+            WHERE change_id IN (
+                SELECT change_id FROM change_log
+                WHERE created_at < now() - %s * interval '1 hour'
+                LIMIT %s
+            )
+            RETURNING txid::text::bigint AS txid
+        ), horizon AS (
+            INSERT INTO change_log_horizon (txid)
+            SELECT MAX(txid) FROM pruned HAVING MAX(txid) IS NOT NULL
+            ON CONFLICT (singleton) DO UPDATE SET txid = GREATEST(change_log_horizon.txid, EXCLUDED.txid)
+        )
+        SELECT COUNT(*) FROM pruned;
+    """, (ttl_hours, limit))
+    return cur.fetchone()[0]
+
+def db_lock_user_writes(conn, user_id: int):
+    '''hold until commit/rollback: one write batch per user at a time'''
+    cur = conn.cursor()
+    cur.execute("SELECT pg_advisory_xact_lock(%s, %s);", (_USER_WRITES_LOCK_CLASS, user_id))
+
+def db_purge_idempotency_keys(conn, user_id: int, ttl_hours: float, limit: int = 100) -> int:
+    '''drop this user's expired keys, plus a bounded slice of everyone else's'''
+    cur = conn.cursor()
+    cur.execute("""
+        DELETE FROM idempotency_keys
+        WHERE user_id = %s AND created_at < now() - %s * interval '1 hour';
+    """, (user_id, ttl_hours))
+    purged = cur.rowcount
+    cur.execute("""
+        DELETE FROM idempotency_keys
+        WHERE ctid IN (
+            SELECT ctid FROM idempotency_keys
+            WHERE created_at < now() - %s * interval '1 hour'
+            LIMIT %s
+        );
+    """, (ttl_hours, limit))
+    return purged + cur.rowcount
+
+def db_get_idempotent_results(conn, user_id: int, keys: Sequence[str],
+                              ttl_hours: float) -> dict[str, tuple[int, dict, Optional[str]]]:
+    '''stored (status, response, request hash) for each of these keys that was already applied'''
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT idempotency_key, status, response, request_hash
+        FROM idempotency_keys
+        WHERE user_id = %s AND idempotency_key = ANY(%s)
+        AND created_at >= now() - %s * interval '1 hour';
+    """, (user_id, list(keys), ttl_hours))
+    return {key: (status, response, request_hash) for key, status, response, request_hash in cur.fetchall()}
+
+def db_save_idempotent_result(conn, user_id: int, key: str, status: int, response: dict, request_hash: str):
+    cur = conn.cursor()
+    cur.execute(
+        """
+        INSERT INTO idempotency_keys (user_id, idempotency_key, status, response, request_hash)
+        VALUES (%s, %s, %s, %s::jsonb, %s);
+        """,
+        (user_id, key, status, json.dumps(response), request_hash)
+    )
+
+def db_listen(channel: str, shard: int = 0):
+    '''
+    dedicated autocommit connection subscribed to a NOTIFY channel on one shard.
+    not pooled: it stays open for the life of the worker. always a primary,
+    since replicas do not relay notifications
+    '''
+    import psycopg2
+    import psycopg2.extensions
+
+    conn = psycopg2.connect(shard_urls()[shard])
+    conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    cur = conn.cursor()
+    cur.execute(f"LISTEN {channel};")
+    return conn
+
+def db_count_ended_sessions(conn, user_id: int) -> int:
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM sessions WHERE user_id = %s AND ended_at IS NOT NULL;", (user_id,))
+    return cur.fetchone()[0]
+
+def db_get_ended_session_ids(conn, user_id: int) -> list[int]:
+    cur = conn.cursor()
+    cur.execute("SELECT session_id FROM sessions WHERE user_id = %s AND ended_at IS NOT NULL;", (user_id,))
+    return [row[0] for row in cur.fetchall()]
+
+def db_get_sets_for_sessions(conn, session_ids: Sequence[int]):
+    cur = _dict_cursor(conn)
+    cur.execute("""
+        SELECT sets.set_id, sets.session_id, sets.exercise, sets.weight, sets.reps, sets.is_1rm, sessions.performed_at
+        FROM sets
+        JOIN sessions ON sets.session_id = sessions.session_id
+        WHERE sets.session_id = ANY(%s)
+        ORDER BY sets.session_id, sets.exercise, sets.set_index;
+    """, (list(session_ids),))
+    return cur.fetchall()
+
+def db_get_unsnapshotted_sets_for_exercise(conn, user_id: int, exercise: str, covered_session_ids: list[int]):
+    '''
+    db_get_sets_for_exercise, limited to sessions a snapshot doesn't cover yet: the active one,
+    and any that ended since its refresh job last ran
+    '''
+    cur = _dict_cursor(conn)
+    cur.execute("""
+        SELECT sets.set_id, sets.weight, sets.reps, sets.is_1rm, sets.session_id, sessions.performed_at
+        FROM sets
+        JOIN sessions ON sets.session_id = sessions.session_id
+        WHERE sessions.user_id = %s AND sets.exercise = %s AND sessions.session_id <> ALL(%s::bigint[])
+        ORDER BY sessions.performed_at, sessions.session_id, sets.set_index;
+    """, (user_id, exercise, covered_session_ids))
+    return cur.fetchall()
+
+# deferred work. a claimed job is leased, not locked: run_after moves past the lease,
+# so writers re-queueing it never wait on a worker and a dead worker's job comes back
+
+def db_enqueue_jobs(conn, user_id: int, jobs: Sequence[str]):
+    '''queue jobs outside the single-statement writes, e.g. after a bulk import'''
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO jobs (kind, user_id)
+        SELECT kind, %s FROM unnest(%s::text[]) AS kind
+        ON CONFLICT (kind, user_id) WHERE failed_at IS NULL
+        DO UPDATE SET generation = jobs.generation + 1;
+    """, (user_id, list(jobs)))
+
+def db_claim_jobs(conn, limit: int, lease_seconds: float) -> list[dict]:
+    '''lease up to limit due jobs, oldest first; concurrent claimers skip each other's rows'''
+    cur = _dict_cursor(conn)
+    cur.execute("""
+        UPDATE jobs
+        SET run_after = now() + %s * interval '1 second', attempts = attempts + 1
+        WHERE job_id IN (
+            SELECT job_id FROM jobs
+            WHERE failed_at IS NULL AND run_after <= now()
+            ORDER BY run_after
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING job_id, kind, user_id, generation, attempts;
+    """, (lease_seconds, limit))
+    return cur.fetchall()
+
+def db_complete_job(conn, job_id: int, generation: int):
+    '''delete a finished job, unless it was re-queued while it ran; then it is due again'''
+    cur = conn.cursor()
+    cur.execute("""
+        WITH done AS (
+            DELETE FROM jobs WHERE job_id = %s AND generation = %s
+            RETURNING job_id
+        )
+        UPDATE jobs
+        SET run_after = now(), attempts = 0, requested_at = now()
+        WHERE job_id = %s AND NOT EXISTS (SELECT 1 FROM done);
+    """, (job_id, generation, job_id))
+
+def db_fail_job(conn, job_id: int, error: str, retry_in_seconds: float, give_up: bool):
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE jobs
+        SET last_error = %s,
+            run_after = now() + %s * interval '1 second',
+            failed_at = CASE WHEN %s THEN now() END
+        WHERE job_id = %s;
+    """, (error, retry_in_seconds, give_up, job_id))
+
+def db_job_metrics(conn) -> list[dict]:
+    '''per kind: pending and failed job counts, and seconds since the oldest pending request'''
+    cur = _dict_cursor(conn)
+    cur.execute("""
+        SELECT kind,
+               COUNT(*) FILTER (WHERE failed_at IS NULL) AS pending,
+               COUNT(*) FILTER (WHERE failed_at IS NOT NULL) AS failed,
+               COALESCE(EXTRACT(EPOCH FROM now() - MIN(requested_at) FILTER (WHERE failed_at IS NULL)), 0)::float
+                   AS lag_seconds
+        FROM jobs
+        GROUP BY kind
+        ORDER BY kind;
+    """)
+    return cur.fetchall()
+
+def db_refresh_personal_records(conn, user_id: int) -> int:
+    '''recompute the user's best set per exercise by estimated 1RM (Epley, as in analytics.estimated_1rm)'''
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO personal_records (user_id, exercise, set_id, weight, reps, estimated_1rm, performed_at)
+        SELECT DISTINCT ON (sets.exercise)
+            sessions.user_id, sets.exercise, sets.set_id, sets.weight, sets.reps,
+            CASE WHEN sets.reps = 1 THEN sets.weight ELSE sets.weight * (1 + sets.reps / 30.0) END AS estimated_1rm,
+            sessions.performed_at
+        FROM sets
+        JOIN sessions ON sets.session_id = sessions.session_id
+        WHERE sessions.user_id = %s
+        ORDER BY sets.exercise, estimated_1rm DESC, sets.set_id
+        ON CONFLICT (user_id, exercise) DO UPDATE
+        SET set_id = EXCLUDED.set_id, weight = EXCLUDED.weight, reps = EXCLUDED.reps,
+            estimated_1rm = EXCLUDED.estimated_1rm, performed_at = EXCLUDED.performed_at
+        WHERE personal_records.set_id <> EXCLUDED.set_id;
+    """, (user_id,))
+    return cur.rowcount
+
+def db_get_personal_records(conn, user_id: int):
+    cur = _dict_cursor(conn)
+    cur.execute("""
+        SELECT exercise, set_id, weight, reps, estimated_1rm, performed_at
+        FROM personal_records
+        WHERE user_id = %s
+        ORDER BY exercise;
+    """, (user_id,))
+    return cur.fetchall()
+
+# moving a user between shards (src/repository/rebalance.py). ids are copied as they are;
+# the id sequences are strided per shard, so they can't collide with the target's own
+
+# table -> (columns, which rows belong to the user), in foreign-key order
+_USER_TABLES = {
+    "users": ("user_id, username, password_hash, created_at", "user_id = %s"),
+    "sessions": ("session_id, user_id, performed_at, notes, ended_at, session_name", "user_id = %s"),
+    "sets": (
+        "set_id, session_id, exercise, weight, reps, set_index, is_1rm",
+        "session_id IN (SELECT session_id FROM sessions WHERE user_id = %s)",
+    ),
+    "idempotency_keys": ("user_id, idempotency_key, status, response, created_at, request_hash", "user_id = %s"),
+    "personal_records": (
+        "user_id, exercise, set_id, weight, reps, estimated_1rm, performed_at", "user_id = %s",
+    ),
+    "jobs": ("kind, user_id, requested_at", "user_id = %s AND failed_at IS NULL"),
+}
+
+def db_export_user_rows(conn, user_id: int) -> dict[str, list[tuple]]:
+    cur = conn.cursor()
+    exported = {}
+    for table, (columns, owned) in _USER_TABLES.items():
+        cur.execute(f"SELECT {columns} FROM {table} WHERE {owned};", (user_id,))
+        exported[table] = cur.fetchall()
+    return exported
+
+def db_import_user_rows(conn, exported: dict[str, list[tuple]]) -> int:
+    '''insert exported rows; rows already there are skipped, so an interrupted move can be rerun'''
+    import psycopg2.extras
+
+    cur = conn.cursor()
+    copied = 0
+    for table, (columns, _) in _USER_TABLES.items():
+        rows = [
+            tuple(psycopg2.extras.Json(v) if isinstance(v, dict) else v for v in row)
+            for row in exported.get(table, [])
+        ]
+        if rows:
+            psycopg2.extras.execute_values(
+                cur, f"INSERT INTO {table} ({columns}) VALUES %s ON CONFLICT DO NOTHING", rows,
+            )
+            copied += len(rows)
+    return copied
+
+def db_delete_user_rows(conn, user_id: int, keep_account: bool) -> int:
+    '''drop a moved user's rows from the shard they left; shard 0 keeps the account row'''
+    cur = conn.cursor()
+    deleted = 0
+    cur.execute("DELETE FROM change_log WHERE user_id = %s;", (user_id,))
+    for table, (_, owned) in reversed(_USER_TABLES.items()):
+        if table == "users" and keep_account:
+            continue
+        if table == "jobs":
+            owned = "user_id = %s"
+        cur.execute(f"DELETE FROM {table} WHERE {owned};", (user_id,))
+        deleted += cur.rowcount
+    return deleted
+
+def db_count_users_per_shard(conn) -> list[tuple[int, int, int]]:
+    '''(shard, users, users being moved) from the directory'''
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT shard, COUNT(*), COUNT(*) FILTER (WHERE moving)
+        FROM user_shards
+        GROUP BY shard
+        ORDER BY shard;
+    """)
+    return cur.fetchall()
@@ -0,0 +1,94 @@
+"""
+Moves users between shards.
+
+A move:
+  (1) marks the user as moving in the directory, then waits until every process's
+      cached entry has expired: from then on their writes get a 503, reads still
+      come from the old shard
+  (2) copies the account, sessions, sets, idempotency keys, personal records and
+      pending jobs to the target in one transaction, keeping their ids
+  (3) points the directory at the target and clears the flag
+  (4) waits again, so no process still reads the old shard, and deletes the
+      user's rows there
+
+Usage:
+  python -m src.repository.rebalance status
+  python -m src.repository.rebalance move --user 42 --to 1
+"""
+
+import argparse
+import time
+from typing import Callable
+
+from src.repository import db
+
+def settle_seconds() -> float:
+    '''long enough for every process to drop its cached directory entry'''
+    return db.SHARD_DIRECTORY_TTL + 1.0
+
+def move_user(user_id: int, target: int, *, sleep: Callable[[float], None] = time.sleep,
+              log: Callable[[str], None] = print) -> dict:
+    '''
+    I: user id, target shard index
+    P: steps (1)-(4) above; if the copy fails the user is left where they were, writable again
+    O: {"user_id", "from", "to", "copied", "deleted"}
+    '''
+    n_shards = len(db.shard_urls())
+    if not 0 <= target < n_shards:
+        raise ValueError(f"shard {target} is not configured (have {n_shards})")
+
+    with db.get_conn(shard=0) as conn:
+        placement = db.db_get_user_placement(conn, user_id)
+    if placement is None:
+        raise ValueError(f"user {user_id} is not in the shard directory")
+    source, _ = placement
+    if source == target:
+        log(f"user {user_id} already lives on shard {target}")
+        return {"user_id": user_id, "from": source, "to": target, "copied": 0, "deleted": 0}
+
+    with db.get_conn(shard=0) as conn:
+        db.db_set_user_placement(conn, user_id, source, moving=True)
+    log(f"user {user_id}: writes paused, waiting {settle_seconds():.0f}s for every process to notice")
+    sleep(settle_seconds())
+
+    try:
+        with db.get_conn(shard=source) as conn:
+            exported = db.db_export_user_rows(conn, user_id)
+        with db.get_conn(shard=target) as conn:
+            copied = db.db_import_user_rows(conn, exported)
+    except Exception:
+        with db.get_conn(shard=0) as conn:
+            db.db_set_user_placement(conn, user_id, source, moving=False)
+        raise
+
+    with db.get_conn(shard=0) as conn:
+        db.db_set_user_placement(conn, user_id, target, moving=False)
+    log(f"user {user_id}: {copied} rows copied to shard {target}, writes resumed")
+    sleep(settle_seconds())
+
+    with db.get_conn(shard=source) as conn:
+        deleted = db.db_delete_user_rows(conn, user_id, keep_account=source == 0)
+    log(f"user {user_id}: {deleted} rows removed from shard {source}")
+    return {"user_id": user_id, "from": source, "to": target, "copied": copied, "deleted": deleted}
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="users per shard")
+    move = commands.add_parser("move", help="move one user to another shard")
+    move.add_argument("--user", type=int, required=True)
+    move.add_argument("--to", type=int, required=True, help="target shard index (0 = DATABASE_URL)")
+    args = parser.parse_args(argv)
+
+    if args.command == "status":
+        urls = db.shard_urls()
+        with db.get_conn(shard=0) as conn:
+            counts = {shard: (users, moving) for shard, users, moving in db.db_count_users_per_shard(conn)}
+        for shard, url in enumerate(urls):
+            users, moving = counts.get(shard, (0, 0))
+            print(f"shard {shard}: {users} users ({moving} moving)  {url.split('@')[-1]}")
+    else:
+        move_user(args.user, args.to)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+User sharding for Lift Log.
+
+Each user's sessions, sets and derived rows live on one shard (a Postgres primary).
+The first shard (DATABASE_URL) also holds every account and the user_shards directory
+that says where each user lives; new users are placed on the consistent-hash ring below.
+
+Ids generated on shard i are congruent to i modulo SHARD_ID_STRIDE, so a session id
+names the shard that created it. That is only a hint: a user moved by the rebalancer
+(src/repository/rebalance.py) keeps their ids, and lookups by id fall back to the
+other shards when the hinted one doesn't have the row.
+
+Nothing here touches a database; db.py wires these helpers into get_conn().
+"""
+
+import bisect
+import hashlib
+import threading
+import time
+from typing import Callable, Optional
+
+SHARD_ID_STRIDE = 64  # most shards a deployment can have; ids step by this much per shard
+RING_POINTS_PER_SHARD = 64
+
+def shard_of_id(entity_id: int, n_shards: int) -> int:
+    '''shard that generated this id (ids from before sharding was enabled may point anywhere)'''
+    shard = entity_id % SHARD_ID_STRIDE
+    return shard if shard < n_shards else 0
+
+def aligned_start(floor: int, shard: int) -> int:
+    '''a starting id above floor for shard `shard`: the next stride boundary plus the shard index'''
+    return (floor // SHARD_ID_STRIDE + 1) * SHARD_ID_STRIDE + shard
+
+def encode_cursor(xid: int, shard: int) -> int:
+    '''sync cursors are transaction ids, which only mean something on the shard that issued them'''
+    return xid * SHARD_ID_STRIDE + shard
+
+def decode_cursor(cursor: int, shard: int) -> int:
+    '''transaction id to sync from; a cursor from another shard (the user moved) means a full sync'''
+    if cursor % SHARD_ID_STRIDE != shard:
+        return 0
+    return cursor // SHARD_ID_STRIDE
+
+def _point(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+class Ring:
+    '''
+    consistent-hash ring over shard indexes (not DSNs, so a changed password moves nobody).
+    adding a shard takes over ~1/N of the key space; keys elsewhere keep their shard
+    '''
+
+    def __init__(self, n_shards: int, points_per_shard: int = RING_POINTS_PER_SHARD):
+        self.n_shards = n_shards
+        points = sorted(
+            (_point(f"shard-{shard}-{i}"), shard)
+            for shard in range(n_shards) for i in range(points_per_shard)
+        )
+        self._hashes = [h for h, _ in points]
+        self._shards = [s for _, s in points]
+
+    def shard_for(self, key: str) -> int:
+        i = bisect.bisect(self._hashes, _point(key)) % len(self._hashes)
+        return self._shards[i]
+
+class Directory:
+    '''
+    per-process cache of user -> (shard, moving) read from the directory table.
+    entries expire after ttl seconds; the rebalancer waits longer than that between
+    steps, so every process sees a move before it matters
+    '''
+
+    def __init__(self, ttl: float, load: Callable[[int], Optional[tuple[int, bool]]],
+                 clock: Callable[[], float] = time.monotonic, max_entries: int = 100_000):
+        self.ttl = ttl
+        self._load = load
+        self._clock = clock
+        self._max_entries = max_entries
+        self._entries: dict[int, tuple[float, tuple[int, bool]]] = {}
+        self._lock = threading.Lock()
+
+    def placement(self, user_id: int) -> tuple[int, bool]:
+        now = self._clock()
+        with self._lock:
+            cached = self._entries.get(user_id)
+        if cached is not None and now - cached[0] < self.ttl:
+            return cached[1]
+
+        placement = self._load(user_id)
+        if placement is None:
+            # every existing user has a row (migration 6 backfilled them), so a miss is an
+            # id that doesn't exist yet. not cached: it may be created on any shard any moment
+            return 0, False
+        with self._lock:
+            if len(self._entries) >= self._max_entries:
+                self._entries.clear()
+            self._entries[user_id] = (now, placement)
+        return placement
+
+    def forget(self, user_id: int = None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
@@ -0,0 +1,178 @@
+"""
+Columnar history snapshots for Lift Log analytics.
+
+Each user's ended sessions are stored as one flat little-endian file per
+column under SNAPSHOT_DIR/<user_id>/. Refreshes only append the sessions
+that ended since the last refresh. Readers memory-map the files, so a decade
+of history is read without building a Python object per set. NumPy is used
+when installed; otherwise the columns are memoryviews over the same mappings.
+
+Layout:
+    set_id.i4  session_id.i4  exercise_id.i4  weight.f8  reps.i4  is_1rm.u1  ts.i8
+    sessions.i4      ids of every ended session covered, including ones with no sets
+    exercises.json   exercise names; exercise_id indexes this list
+    meta.json        {"rows": N, "sessions": M}; readers never look past these counts
+"""
+
+import calendar
+import fcntl
+import json
+import mmap
+import os
+import sys
+from array import array
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from src.repository.db import db_count_ended_sessions, db_get_ended_session_ids, db_get_sets_for_sessions
+
+_numpy = False  # not looked for yet
+
+def numpy():
+    '''
+    the numpy module, or None if it isn't installed (analytics fall back to memoryviews).
+    imported on first use: it takes tens of ms, too much for the cold-start path
+    '''
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+        _numpy = np
+    return _numpy
+
+# unset: snapshots are disabled and analytics read from Postgres
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR')
+
+# column name -> array typecode (matches the numpy dtype below)
+COLUMNS = {
+    "set_id": "i",
+    "session_id": "i",
+    "exercise_id": "i",
+    "weight": "d",
+    "reps": "i",
+    "is_1rm": "B",
+    "ts": "q",
+}
+_SUFFIX = {"i": "i4", "d": "f8", "B": "u1", "q": "i8"}
+_DTYPE = {"i": "<i4", "d": "<f8", "B": "u1", "q": "<i8"}
+
+def enabled() -> bool:
+    return bool(SNAPSHOT_DIR)
+
+def _user_dir(user_id: int) -> Path:
+    return Path(SNAPSHOT_DIR) / str(user_id)
+
+def _column_path(directory: Path, name: str, typecode: str) -> Path:
+    return directory / f"{name}.{_SUFFIX[typecode]}"
+
+def _read_meta(directory: Path) -> dict:
+    try:
+        return json.loads((directory / "meta.json").read_text())
+    except FileNotFoundError:
+        return {"rows": 0, "sessions": 0}
+
+def _write_json(path: Path, value):
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(value))
+    os.replace(tmp, path)
+
+def to_epoch(value) -> int:
+    '''performed_at as stored (ISO text or datetime) -> epoch seconds, naive times taken as UTC'''
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        return int(value.timestamp())
+    return calendar.timegm(value.timetuple())
+
+def _append(path: Path, typecode: str, values: list, keep: int):
+    '''append values after the first `keep` items, dropping any torn tail from a crashed refresh'''
+    itemsize = array(typecode).itemsize
+    with open(path, "ab") as f:
+        f.truncate(keep * itemsize)
+        data = array(typecode, values)
+        if sys.byteorder != "little":
+            data.byteswap()
+        f.write(data.tobytes())
+
+def refresh_snapshot(conn, user_id: int) -> int:
+    '''
+    I: open connection, user id
+    P:  (1) no-op (one COUNT) if every ended session is already covered
+        (2) otherwise fetch only the uncovered sessions' sets and append them
+        (3) publish the new row counts in meta.json last, so readers never see a partial append
+    O: number of set rows appended
+    '''
+    directory = _user_dir(user_id)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    # one refresher per user at a time, across processes
+    with open(directory / ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        meta = _read_meta(directory)
+        if db_count_ended_sessions(conn, user_id) == meta["sessions"]:
+            return 0
+
+        covered = set(_read_column(directory, "sessions", "i", meta["sessions"]))
+        missing = [sid for sid in db_get_ended_session_ids(conn, user_id) if sid not in covered]
+        rows = db_get_sets_for_sessions(conn, missing)
+
+        exercises_path = directory / "exercises.json"
+        exercises = json.loads(exercises_path.read_text()) if exercises_path.exists() else []
+        exercise_ids = {name: i for i, name in enumerate(exercises)}
+        for row in rows:
+            if row["exercise"] not in exercise_ids:
+                exercise_ids[row["exercise"]] = len(exercises)
+                exercises.append(row["exercise"])
+
+        values = {
+            "set_id": [r["set_id"] for r in rows],
+            "session_id": [r["session_id"] for r in rows],
+            "exercise_id": [exercise_ids[r["exercise"]] for r in rows],
+            "weight": [r["weight"] for r in rows],
+            "reps": [r["reps"] for r in rows],
+            "is_1rm": [r["is_1rm"] for r in rows],
+            "ts": [to_epoch(r["performed_at"]) for r in rows],
+        }
+        for name, typecode in COLUMNS.items():
+            _append(_column_path(directory, name, typecode), typecode, values[name], meta["rows"])
+        _append(_column_path(directory, "sessions", "i"), "i", missing, meta["sessions"])
+
+        _write_json(exercises_path, exercises)
+        _write_json(directory / "meta.json", {"rows": meta["rows"] + len(rows), "sessions": meta["sessions"] + len(missing)})
+        return len(rows)
+
+def _read_column(directory: Path, name: str, typecode: str, count: int):
+    '''zero-copy view of the first `count` items of a column'''
+    np = numpy()
+    if count == 0:
+        return np.empty(0, dtype=_DTYPE[typecode]) if np is not None else memoryview(array(typecode))
+    path = _column_path(directory, name, typecode)
+    if np is not None:
+        return np.memmap(path, dtype=_DTYPE[typecode], mode="r", shape=(count,))
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mapped)[: count * array(typecode).itemsize].cast(typecode)
+
+def load_snapshot(user_id: int) -> Optional[dict]:
+    '''
+    O: {"exercises": [names], "rows": N, "covered_sessions": view, <column name>: view} or None
+       if there is no snapshot yet. views are memory-mapped; only pages that analytics touch are
+       read from disk
+    '''
+    directory = _user_dir(user_id)
+    meta = _read_meta(directory)
+    if meta["sessions"] == 0:
+        return None
+
+    snapshot = {
+        "exercises": json.loads((directory / "exercises.json").read_text()),
+        "rows": meta["rows"],
+        "covered_sessions": _read_column(directory, "sessions", "i", meta["sessions"]),
+    }
+    for name, typecode in COLUMNS.items():
+        snapshot[name] = _read_column(directory, name, typecode, meta["rows"])
+    return snapshot
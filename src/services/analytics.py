@@ -0,0 +1,152 @@
+"""
+Exercise analytics for Lift Log.
+
+Works on columns (weight, reps, is_1rm, ts) instead of row dicts, so the same
+code runs over memory-mapped snapshot columns (vectorized when NumPy is
+installed) and over the few rows of an active session fetched from Postgres.
+"""
+
+from datetime import datetime, timezone
+
+from src.repository.snapshots import numpy, to_epoch
+
+def estimated_1rm(weight: float, reps: int) -> float:
+    '''Epley; a single is its own 1RM'''
+    return weight if reps == 1 else weight * (1 + reps / 30)
+
+def _iso(ts: int) -> str:
+    return datetime.fromtimestamp(int(ts), tz=timezone.utc).replace(tzinfo=None).isoformat()
+
+def select_exercise(snapshot: dict, exercise: str, start: datetime = None, end: datetime = None):
+    '''positions of this exercise's sets in the snapshot, in the optional [start, end) window, ordered by time'''
+    np = numpy()
+    if exercise not in snapshot["exercises"]:
+        return []
+    exercise_id = snapshot["exercises"].index(exercise)
+    low = to_epoch(start) if start is not None else None
+    high = to_epoch(end) if end is not None else None
+    ts = snapshot["ts"]
+
+    if np is not None:
+        mask = snapshot["exercise_id"] == exercise_id
+        if low is not None:
+            mask &= ts >= low
+        if high is not None:
+            mask &= ts < high
+        picked = np.flatnonzero(mask)
+        return picked[np.argsort(ts[picked], kind="stable")]
+
+    picked = (
+        i for i, e in enumerate(snapshot["exercise_id"])
+        if e == exercise_id and (low is None or ts[i] >= low) and (high is None or ts[i] < high)
+    )
+    return sorted(picked, key=ts.__getitem__)
+
+def series_rows(snapshot: dict, picked) -> list[dict]:
+    '''selected sets in the shape of db_get_sets_for_exercise'''
+    return [
+        {
+            "set_id": int(snapshot["set_id"][i]),
+            "weight": float(snapshot["weight"][i]),
+            "reps": int(snapshot["reps"][i]),
+            "is_1rm": int(snapshot["is_1rm"][i]),
+            "session_id": int(snapshot["session_id"][i]),
+            "performed_at": _iso(snapshot["ts"][i]),
+        }
+        for i in picked
+    ]
+
+SERIES_COLUMNS = ("set_id", "weight", "reps", "is_1rm", "session_id", "performed_at")
+
+def series_columns(snapshot: dict | None, picked) -> dict[str, list]:
+    '''selected sets as {column: [values]}, same columns as series_rows; gathered column by column'''
+    np = numpy()
+    if snapshot is None or len(picked) == 0:
+        return {name: [] for name in SERIES_COLUMNS}
+    if np is not None:
+        gathered = {name: snapshot[name][picked].tolist() for name in ("set_id", "weight", "reps", "is_1rm", "session_id")}
+        ts = snapshot["ts"][picked].tolist()
+    else:
+        gathered = {
+            name: [snapshot[name][i] for i in picked]
+            for name in ("set_id", "weight", "reps", "is_1rm", "session_id")
+        }
+        ts = [snapshot["ts"][i] for i in picked]
+    gathered["performed_at"] = [_iso(t) for t in ts]
+    return {name: gathered[name] for name in SERIES_COLUMNS}
+
+def columns_from_rows(rows) -> dict:
+    '''db_get_sets_for_exercise rows -> the columns stats() reads'''
+    return {
+        "weight": [r["weight"] for r in rows],
+        "reps": [r["reps"] for r in rows],
+        "is_1rm": [r["is_1rm"] for r in rows],
+        "ts": [to_epoch(r["performed_at"]) for r in rows],
+    }
+
+def stats(columns: dict, picked=None) -> dict | None:
+    '''
+    I: columns, optionally the positions to use (default: all)
+    P: design.txt "View exercise stats"; best 1RM is the heaviest tested single if one
+       exists, otherwise the best Epley estimate. max weight ignores is_1rm
+    O: stats dict, or None when there are no sets
+    '''
+    np = numpy()
+    if picked is None:
+        picked = range(len(columns["weight"]))
+    if len(picked) == 0:
+        return None
+
+    if np is not None and isinstance(columns["weight"], np.ndarray):
+        weight = np.asarray(columns["weight"])[picked]
+        reps = np.asarray(columns["reps"])[picked]
+        is_1rm = np.asarray(columns["is_1rm"])[picked]
+        ts = np.asarray(columns["ts"])[picked]
+        top = int(np.argmax(weight))
+        e1rm = np.where(reps == 1, weight, weight * (1 + reps / 30))
+        tested = weight[is_1rm == 1]
+        max_weight, reps_at_max, max_ts = float(weight[top]), int(reps[top]), int(ts[top])
+        best_estimate = float(e1rm.max())
+        tested_1rm = float(tested.max()) if tested.size else None
+        last_ts = int(ts.max())
+    else:
+        weight = [columns["weight"][i] for i in picked]
+        reps = [columns["reps"][i] for i in picked]
+        is_1rm = [columns["is_1rm"][i] for i in picked]
+        ts = [columns["ts"][i] for i in picked]
+        top = max(range(len(weight)), key=weight.__getitem__)
+        max_weight, reps_at_max, max_ts = float(weight[top]), int(reps[top]), int(ts[top])
+        best_estimate = max(estimated_1rm(w, r) for w, r in zip(weight, reps))
+        tested = [w for w, rm in zip(weight, is_1rm) if rm == 1]
+        tested_1rm = float(max(tested)) if tested else None
+        last_ts = int(max(ts))
+
+    return {
+        "sets": len(picked),
+        "max_weight": max_weight,
+        "reps_at_max_weight": reps_at_max,
+        "max_weight_performed_at": _iso(max_ts),
+        "tested_1rm": tested_1rm,
+        "estimated_1rm": round(best_estimate, 1),
+        "best_1rm": tested_1rm if tested_1rm is not None else round(best_estimate, 1),
+        "last_performed_at": _iso(last_ts),
+    }
+
+def merge_stats(a: dict | None, b: dict | None) -> dict | None:
+    '''combine stats over two disjoint groups of sets (snapshot + active session)'''
+    if a is None or b is None:
+        return a or b
+    heavier = a if a["max_weight"] >= b["max_weight"] else b
+    tested = [t for t in (a["tested_1rm"], b["tested_1rm"]) if t is not None]
+    estimated = max(a["estimated_1rm"], b["estimated_1rm"])
+    tested_1rm = max(tested) if tested else None
+    return {
+        "sets": a["sets"] + b["sets"],
+        "max_weight": heavier["max_weight"],
+        "reps_at_max_weight": heavier["reps_at_max_weight"],
+        "max_weight_performed_at": heavier["max_weight_performed_at"],
+        "tested_1rm": tested_1rm,
+        "estimated_1rm": estimated,
+        "best_1rm": tested_1rm if tested_1rm is not None else estimated,
+        "last_performed_at": max(a["last_performed_at"], b["last_performed_at"]),
+    }
@@ -1,41 +1,83 @@
-import sqlite3
+import hashlib
+import json
+import os
 from datetime import datetime
 
-import bcrypt
-
 from src.repository.db import (
     get_conn,
+    mark_write,
+    place_new_user,
+    shard_urls,
+    user_shard,
     db_create_user,
+    db_copy_user,
+    db_delete_account,
+    db_session_exists,
     db_get_user,
     db_create_session,
-    db_get_active_session,
-    db_end_all_open_sessions,
-    db_insert_sets,
+    db_end_active_session,
+    db_add_sets_to_active_session,
     db_get_active_session_row,
     db_get_sessions_for_user,
-    db_get_active_session,
     db_get_sets_for_session, db_get_exercises_for_user, db_get_sets_for_exercise,
+    db_get_changes,
+    db_lock_user_writes,
+    db_purge_idempotency_keys,
+    db_get_idempotent_results,
+    db_save_idempotent_result,
+    db_get_unsnapshotted_sets_for_exercise,
+    db_get_sessions_with_sets,
+    db_get_personal_records,
+    db_search_sessions,
+    SESSION_FIELDS,
+    SET_FIELDS,
 )
+from src.repository import shards, snapshots
 from src.services.errors import BadRequestError, ConflictError, NotFoundError
+from src.services import analytics, events, group_commit, jobs
+
+# how long a batch operation's result is replayed for its idempotency key
+IDEMPOTENCY_TTL_HOURS = float(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
 
 def now_iso() -> str:
     return datetime.now().isoformat(timespec="seconds")
 
+def _local(t: datetime) -> datetime:
+    '''timestamps are stored naive in server-local time (now_iso()): an aware one is converted'''
+    return t.astimezone().replace(tzinfo=None) if t.tzinfo else t
+
+def local_iso(t: datetime) -> str:
+    '''a client-supplied timestamp as it is stored'''
+    return _local(t).isoformat(timespec="seconds")
+
 def create_user(username: str, password: str) -> dict:
+    import bcrypt  # deferred: only account endpoints need it, keep it off cold start
+
     created_at = now_iso()
     password_hash = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
-    with get_conn() as conn:
-        # if exists, treat as conflict
-        existing = db_get_user(conn, username)
-        if existing is not None:
-            raise ConflictError("Username already taken.")
-
-        user_id = db_create_user(conn, created_at, username, password_hash)
-        conn.commit()
+    shard = place_new_user(username)
+    # accounts and the directory live on shard 0
+    with get_conn(shard=0, autocommit=True) as conn:
+        user_id = db_create_user(conn, created_at, username, password_hash, shard)
+    if user_id is None:
+        raise ConflictError("Username already taken.")
+    if shard != 0:
+        try:
+            with get_conn(shard=shard, autocommit=True) as conn:
+                db_copy_user(conn, user_id, created_at, username, password_hash)
+        except Exception:
+            # without its home row every write would fail the shard's foreign keys:
+            # give the username back so signing up again can succeed
+            with get_conn(shard=0, autocommit=True) as conn:
+                db_delete_account(conn, user_id)
+            raise
     return {"user_id": user_id, "username": username, "created_at": created_at}
 
 def login_user(username: str, password: str) ->dict:
-    with get_conn() as conn:
+    import bcrypt
+
+    # stays on the primary: a replica may not have a just-created account yet
+    with get_conn(shard=0, autocommit=True) as conn:
         row = db_get_user(conn, username)
         if row is None:
             raise NotFoundError("No account found with that username.")
@@ -46,6 +88,12 @@ def login_user(username: str, password: str) ->dict:
 
 
 def create_session(user_id: int, session_name: str, performed_at: str | None, notes :str | None) -> dict:
+    with get_conn(autocommit=True, user_id=user_id) as conn:
+        session = _create_session(conn, user_id, session_name, performed_at, notes)
+    mark_write(user_id=user_id, session_id=session["session_id"])
+    return session
+
+def _create_session(conn, user_id: int, session_name: str, performed_at: str | None, notes :str | None) -> dict:
     performed_at = performed_at or now_iso()
 
     # Use custom name if provided, otherwise generate from date
@@ -53,12 +101,9 @@ def create_session(user_id: int, session_name: str, performed_at: str | None, no
         date_str = datetime.fromisoformat(performed_at).strftime("%m-%d-%Y")
         session_name = f"Session {date_str}"
 
-    with get_conn() as conn:
-        active = db_get_active_session(conn, user_id)
-        if active is not None:
-            raise ConflictError("Active session already exists")
-        session_id = db_create_session(conn, user_id, session_name, performed_at, notes)
-        conn.commit()
+    session_id = db_create_session(conn, user_id, session_name, performed_at, notes)
+    if session_id is None:
+        raise ConflictError("Active session already exists")
 
     return {
         "session_id": session_id,
@@ -70,12 +115,19 @@ def create_session(user_id: int, session_name: str, performed_at: str | None, no
     }
 
 def end_active_session(user_id: int, session_name: str = None) -> dict:
+    with get_conn(autocommit=True, user_id=user_id) as conn:
+        result = _end_active_session(conn, user_id, session_name)
+    mark_write(user_id=user_id)
+    return result
+
+def _end_active_session(conn, user_id: int, session_name: str = None) -> dict:
     ended_at = now_iso()
-    with get_conn() as conn:
-        n = db_end_all_open_sessions(conn, user_id, ended_at, session_name)
-        if n == 0:
-            raise BadRequestError("No active session found for this user")
-        conn.commit()
+    event = events.encode(user_id, {"type": "session_ended", "ended_at": ended_at, "session_name": session_name})
+    # the snapshot catches up in a job (src/services/jobs.py), not on this request
+    n = db_end_active_session(conn, user_id, ended_at, session_name, events.CHANNEL, event,
+                              jobs.jobs_for("session_ended"))
+    if n == 0:
+        raise BadRequestError("No active session found for this user")
 
     return {"user_id": user_id, "ended_at": ended_at, "ended_sessions": n}
 
@@ -87,33 +139,148 @@ def add_sets_to_active_session(
         exercise: str,
         sets: list[tuple[float, int, int]]
 ) -> dict:
-    exercise_norm = normalize_exercise(exercise)
+    if group_commit.enabled():
+        result = _add_sets_grouped(user_id, exercise, sets)
+    else:
+        with get_conn(autocommit=True, user_id=user_id) as conn:
+            result = _add_sets_to_active_session(conn, user_id, exercise, sets)
+    mark_write(user_id=user_id, session_id=result["session_id"])
+    return result
+
+_SET_CONFLICT = "Set insert failed due to a constraint (possible duplicate ordering or invalid values)"
 
+def _sets_event(user_id: int, exercise_norm: str, sets: list[tuple[float, int, int]]) -> str:
     if not exercise_norm:
         raise BadRequestError("Exercise name cannot be empty")
 
     if not sets:
         raise BadRequestError("must provide at least one set")
 
-    with get_conn() as conn:
-        session_id = db_get_active_session(conn, user_id)
-        if session_id is None:
-            raise BadRequestError("No active session found for this user")
+    # the session id is filled in by the statement that finds the active session
+    return events.encode(user_id, {
+        "type": "sets_added",
+        "exercise": exercise_norm,
+        "sets": [{"weight": w, "reps": r, "is_1rm": rm} for w, r, rm in sets],
+    })
+
+def _sets_added(exercise_norm: str, added) -> dict:
+    if added is None:
+        raise BadRequestError("No active session found for this user")
+    session_id, inserted = added
+    return {"session_id": session_id, "exercise": exercise_norm, "sets_inserted": inserted}
 
-        try:
-            inserted = db_insert_sets(conn, session_id, exercise_norm, sets)
-            conn.commit()
-        except sqlite3.IntegrityError as e:
-            raise ConflictError(
-                "Set insert failed due to a constraint (possible duplicate ordering or invalid values)"
-            ) from e
+def _add_sets_to_active_session(
+        conn,
+        user_id: int,
+        exercise: str,
+        sets: list[tuple[float, int, int]]
+) -> dict:
+    import psycopg2
 
-    return {"session_id": session_id, "exercise": exercise_norm, "sets_inserted": inserted}
+    exercise_norm = normalize_exercise(exercise)
+    event = _sets_event(user_id, exercise_norm, sets)
+    try:
+        added = db_add_sets_to_active_session(conn, user_id, exercise_norm, sets, events.CHANNEL, event,
+                                              jobs.jobs_for("sets_added"))
+    except psycopg2.IntegrityError as e:
+        raise ConflictError(_SET_CONFLICT) from e
+    return _sets_added(exercise_norm, added)
+
+def _add_sets_grouped(user_id: int, exercise: str, sets: list[tuple[float, int, int]]) -> dict:
+    '''the same insert, committed together with other requests' (see group_commit.py)'''
+    import psycopg2
+
+    exercise_norm = normalize_exercise(exercise)
+    event = _sets_event(user_id, exercise_norm, sets)
+    try:
+        added = group_commit.add_sets(user_id, exercise_norm, sets, event)
+    except psycopg2.IntegrityError as e:
+        raise ConflictError(_SET_CONFLICT) from e
+    return _sets_added(exercise_norm, added)
+
+# idempotent write batches
+
+# operation name -> (service function taking a conn, HTTP status of a success)
+BATCH_OPERATIONS = {
+    "start_session": (_create_session, 201),
+    "add_sets": (_add_sets_to_active_session, 201),
+    "end_session": (_end_active_session, 200),
+}
+_ERROR_STATUS = {BadRequestError: 400, NotFoundError: 404, ConflictError: 409}
+
+def _request_hash(op: str, kwargs: dict) -> str:
+    '''fingerprint of what an idempotency key was used for'''
+    canonical = json.dumps([op, kwargs], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def apply_write_batch(user_id: int, operations: list[tuple[str, str, dict]]) -> list[dict]:
+    '''
+    I: user id, queued operations as (idempotency_key, operation name, keyword args)
+    P:  (1) serialize this user's batches and drop expired keys
+        (2) replay the stored result for keys already applied; a key reused for a different
+            operation or arguments gets a 422 instead, since replaying would fake a success
+        (3) run the rest in order, each under a savepoint, in one transaction
+        (4) store each success under its key; failures are not stored, so a retry runs them again
+    O: one result per operation, in order
+    '''
+    keys = [key for key, _, _ in operations]
+    if len(set(keys)) != len(keys):
+        raise BadRequestError("Idempotency keys must be unique within a batch")
+
+    results = []
+    touched_sessions = set()
+    with get_conn(user_id=user_id) as conn:
+        db_lock_user_writes(conn, user_id)
+        db_purge_idempotency_keys(conn, user_id, IDEMPOTENCY_TTL_HOURS)
+        applied = db_get_idempotent_results(conn, user_id, keys, IDEMPOTENCY_TTL_HOURS)
+
+        cur = conn.cursor()
+        for key, op, kwargs in operations:
+            request_hash = _request_hash(op, kwargs)
+            if key in applied:
+                status, body, stored_hash = applied[key]
+                if stored_hash is not None and stored_hash != request_hash:
+                    results.append({
+                        "idempotency_key": key,
+                        "status": 422,
+                        "replayed": False,
+                        "detail": "Idempotency key was already used for a different operation",
+                    })
+                    continue
+                results.append({"idempotency_key": key, "status": status, "replayed": True, **body})
+                continue
+
+            func, status = BATCH_OPERATIONS[op]
+            cur.execute("SAVEPOINT batch_op;")
+            try:
+                result = func(conn, user_id, **kwargs)
+            except tuple(_ERROR_STATUS) as e:
+                cur.execute("ROLLBACK TO SAVEPOINT batch_op;")
+                results.append({
+                    "idempotency_key": key,
+                    "status": _ERROR_STATUS[type(e)],
+                    "replayed": False,
+                    "detail": str(e),
+                })
+                continue
+            cur.execute("RELEASE SAVEPOINT batch_op;")
+
+            db_save_idempotent_result(conn, user_id, key, status, {"result": result}, request_hash)
+            if "session_id" in result:
+                touched_sessions.add(result["session_id"])
+            results.append({"idempotency_key": key, "status": status, "replayed": False, "result": result})
+
+        conn.commit()
+
+    mark_write(user_id=user_id)
+    for session_id in touched_sessions:
+        mark_write(session_id=session_id)
+    return results
 
 # for GET requests
 
 def get_active_session(user_id: int):
-    with get_conn() as conn:
+    with get_conn(readonly=True, user_id=user_id) as conn:
         row = db_get_active_session_row(conn, user_id)
 
         if row is None:
@@ -121,26 +288,97 @@ def get_active_session(user_id: int):
 
         return dict(row)
 
-def get_sessions_for_user(user_id: int):
-    with get_conn() as conn:
-        rows = db_get_sessions_for_user(conn, user_id)
+def _window(start: datetime | None, end: datetime | None) -> tuple[datetime | None, datetime | None]:
+    '''validate a [start, end) filter, with aware bounds converted like stored timestamps'''
+    start, end = (_local(t) if t is not None else None for t in (start, end))
+    if start is not None and end is not None and start >= end:
+        raise BadRequestError("start must be before end")
+    return start, end
+
+def parse_fields(fields: str | None, include_sets: bool) -> tuple[list[str], list[str]]:
+    '''
+    I: fields selector, e.g. "session_id,performed_at,sets.weight,sets.reps"
+    P: plain names pick session columns, "sets."-prefixed names pick set columns;
+       a side with nothing selected gets every column (set columns only with include=sets)
+    O: (session columns, set columns)
+    '''
+    requested = [f.strip() for f in (fields or "").split(",") if f.strip()]
+    session_fields = [f for f in requested if not f.startswith("sets.")]
+    set_fields = [f[len("sets."):] for f in requested if f.startswith("sets.")]
+
+    unknown = [f for f in session_fields if f not in SESSION_FIELDS]
+    unknown += [f"sets.{f}" for f in set_fields if f not in SET_FIELDS]
+    if unknown:
+        raise BadRequestError(f"Unknown fields: {', '.join(unknown)}")
+    if set_fields and not include_sets:
+        raise BadRequestError("sets.* fields require include=sets")
+
+    session_fields = list(dict.fromkeys(session_fields)) or list(SESSION_FIELDS)
+    set_fields = (list(dict.fromkeys(set_fields)) or list(SET_FIELDS)) if include_sets else []
+    return session_fields, set_fields
+
+def get_sessions_for_user(user_id: int, start: datetime = None, end: datetime = None,
+                          include_sets: bool = False, fields: str = None, as_columns: bool = False):
+    start, end = _window(start, end)
+    if as_columns:
+        if include_sets or fields:
+            raise BadRequestError("Column format is only available for the flat session list")
+        with get_conn(readonly=True, user_id=user_id) as conn:
+            return db_get_sessions_for_user(conn, user_id, start, end, as_columns=True)
+
+    if include_sets or fields:
+        # history view: one joined query instead of one /sessions/{id}/sets call per session
+        session_fields, set_fields = parse_fields(fields, include_sets)
+        with get_conn(readonly=True, user_id=user_id) as conn:
+            return db_get_sessions_with_sets(conn, user_id, session_fields, set_fields, start, end)
+
+    with get_conn(readonly=True, user_id=user_id) as conn:
+        rows = db_get_sessions_for_user(conn, user_id, start, end)
 
         if rows is None:
             raise NotFoundError("No active sessions found for this user")
 
         return [dict(r) for r in rows]
 
-def get_sets_for_session(session_id: int):
-    with get_conn() as conn:
-        rows = db_get_sets_for_session(conn, session_id)
+SEARCH_MAX_LIMIT = 50
+
+def search_sessions(user_id: int, q: str, limit: int = 20, offset: int = 0, match: str = "any") -> dict:
+    '''
+    ranked full-text search over the user's session names and notes.
+    match="any" ranks sessions by how well they cover the words; match="all" requires every
+    term and accepts web-search syntax ("quoted phrase", or, -term)
+    '''
+    if not q or not q.strip():
+        raise BadRequestError("q must not be empty")
+    if match not in ("any", "all"):
+        raise BadRequestError("match must be 'any' or 'all'")
+    if not 1 <= limit <= SEARCH_MAX_LIMIT:
+        raise BadRequestError(f"limit must be between 1 and {SEARCH_MAX_LIMIT}")
+    if offset < 0:
+        raise BadRequestError("offset must not be negative")
+
+    with get_conn(readonly=True, user_id=user_id) as conn:
+        # one extra row says whether there is a next page
+        rows = db_search_sessions(conn, user_id, q, match == "all", limit + 1, offset)
 
-        if rows is None:
-            return []
+    return {
+        "results": [dict(r) for r in rows[:limit]],
+        "next_offset": offset + limit if len(rows) > limit else None,
+    }
 
-        return [dict(r) for r in rows]
+def get_sets_for_session(session_id: int):
+    # the id names the shard that created the session; a moved user's sessions live elsewhere
+    n_shards = len(shard_urls())
+    hinted = shards.shard_of_id(session_id, n_shards)
+    for shard in [hinted] + [s for s in range(n_shards) if s != hinted]:
+        with get_conn(readonly=True, session_id=session_id, shard=shard) as conn:
+            rows = db_get_sets_for_session(conn, session_id)
+            if rows or n_shards == 1 or db_session_exists(conn, session_id):
+                return [dict(r) for r in rows]
+    return []
 
 def get_exercises_for_user(user_id: int):
-    with get_conn() as conn:
+    with get_conn(readonly=True, user_id=user_id) as conn:
         rows = db_get_exercises_for_user(conn, user_id)
 
         if rows is None:
@@ -148,7 +386,77 @@ def get_exercises_for_user(user_id: int):
 
         return [row["exercise"] for row in rows]
 
-def get_sets_for_exercise(user_id: int, exercise: str):
-    with get_conn() as conn:
-        rows = db_get_sets_for_exercise(conn, user_id, exercise)
-        return [dict(r) for r in rows]
\ No newline at end of file
+def get_sets_for_exercise(user_id: int, exercise: str, start: datetime = None, end: datetime = None,
+                          as_columns: bool = False):
+    '''rows by default; as_columns=True returns {column: [values]} for compact encodings'''
+    start, end = _window(start, end)
+    if snapshots.enabled():
+        snapshot, active_rows = _snapshot_and_active_rows(user_id, exercise)
+        picked = analytics.select_exercise(snapshot, exercise, start, end) if snapshot else []
+        active = [
+            dict(r) for r in active_rows
+            if (start is None or r["performed_at"] >= start) and (end is None or r["performed_at"] < end)
+        ]
+        if as_columns:
+            columns = analytics.series_columns(snapshot, picked) if snapshot else analytics.series_columns(None, [])
+            for row in active:
+                for name, values in columns.items():
+                    values.append(row[name])
+            return columns
+        history = analytics.series_rows(snapshot, picked) if snapshot else []
+        return history + active
+
+    with get_conn(readonly=True, user_id=user_id) as conn:
+        if as_columns:
+            return db_get_sets_for_exercise(conn, user_id, exercise, start, end, as_columns=True)
+        rows = db_get_sets_for_exercise(conn, user_id, exercise, start, end)
+        return [dict(r) for r in rows]
+
+def get_exercise_stats(user_id: int, exercise: str):
+    if snapshots.enabled():
+        snapshot, active_rows = _snapshot_and_active_rows(user_id, exercise)
+        history = analytics.stats(snapshot, analytics.select_exercise(snapshot, exercise)) if snapshot else None
+        result = analytics.merge_stats(history, analytics.stats(analytics.columns_from_rows(active_rows)))
+    else:
+        with get_conn(readonly=True, user_id=user_id) as conn:
+            rows = db_get_sets_for_exercise(conn, user_id, exercise)
+        result = analytics.stats(analytics.columns_from_rows(rows))
+
+    if result is None:
+        raise NotFoundError(f"No sets found for exercise {exercise}")
+    return {"exercise": exercise, **result}
+
+def _snapshot_and_active_rows(user_id: int, exercise: str):
+    '''
+    ended sessions come from the memory-mapped snapshot as it stands; the refresh job
+    (src/services/jobs.py) tops it up, never a read. only sessions it doesn't cover yet,
+    the active one and any ended since the job last ran, are read row by row
+    '''
+    snapshot = snapshots.load_snapshot(user_id)
+    covered = [int(sid) for sid in snapshot["covered_sessions"]] if snapshot else []
+    with get_conn(readonly=True, user_id=user_id) as conn:
+        active_rows = db_get_unsnapshotted_sets_for_exercise(conn, user_id, exercise, covered)
+    return snapshot, active_rows
+
+def get_personal_records(user_id: int) -> list[dict]:
+    '''best set per exercise; maintained by the personal_records job, so it can trail a write briefly'''
+    with get_conn(readonly=True, user_id=user_id) as conn:
+        return [dict(r) for r in db_get_personal_records(conn, user_id)]
+
+def get_changes_for_user(user_id: int, since: int = 0) -> dict:
+    '''sessions and sets created or updated since the client's cursor, plus the next cursor'''
+    if since < 0:
+        raise BadRequestError("since must be a cursor returned by a previous sync, or 0")
+
+    shard = user_shard(user_id)
+    with get_conn(readonly=True, user_id=user_id) as conn:
+        cursor, sessions, sets, full = db_get_changes(conn, user_id, shards.decode_cursor(since, shard))
+
+    # full_sync: the cursor was 0, from another shard, or older than the retained change log;
+    # the response holds everything the user has and the client should replace its copy
+    return {
+        "cursor": shards.encode_cursor(cursor, shard),
+        "full_sync": full,
+        "sessions": [dict(r) for r in sessions],
+        "sets": [dict(r) for r in sets],
+    }
@@ -0,0 +1,117 @@
+"""
+Live event fan-out for Lift Log.
+
+Each write sends its event with pg_notify from inside its own statement (the payload
+comes from encode), so an event exists only if the write commits. Each worker process
+runs one LISTEN thread per shard, started when its first viewer subscribes, and hands
+every notification to the asyncio queues of that user's local subscribers. A viewer with nothing new to
+see is parked on its queue and costs no queries.
+"""
+
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+
+from src.repository import db
+
+logger = logging.getLogger("uvicorn.error")
+
+CHANNEL = "lift_log_events"
+HEARTBEAT_SECONDS = 15.0
+QUEUE_SIZE = 100
+NOTIFY_PAYLOAD_LIMIT = 8000  # bytes; Postgres rejects a longer NOTIFY payload
+# the write statements append the ids they assign (session_id, first_set_index) to the payload
+_ADDED_BY_STATEMENT = len(', "session_id": %d, "first_set_index": %d' % (2**63 - 1, 2**63 - 1))
+
+_subscribers: dict[int, set[tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+_subscribers_lock = threading.Lock()
+_listeners: dict[int, threading.Thread] = {}  # shard -> LISTEN thread
+
+def encode(user_id: int, event: dict) -> str:
+    '''
+    NOTIFY payload for an event; writes that notify from their own statement send this on CHANNEL.
+    an event too big for NOTIFY loses its sets, then everything but its type and ids: viewers refetch
+    '''
+    limit = NOTIFY_PAYLOAD_LIMIT - _ADDED_BY_STATEMENT
+    for fields in (
+        event,
+        {k: v for k, v in event.items() if k != "sets"},
+        {k: v for k, v in event.items() if k == "type" or k.endswith("_id")},
+    ):
+        payload = json.dumps({"user_id": user_id, **fields}, default=str)
+        if len(payload.encode()) <= limit:
+            break
+    return payload
+
+def subscribe(user_id: int) -> asyncio.Queue:
+    '''call from the event loop that will consume the queue'''
+    queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    with _subscribers_lock:
+        _subscribers.setdefault(user_id, set()).add((asyncio.get_running_loop(), queue))
+    _ensure_listener()
+    return queue
+
+def unsubscribe(user_id: int, queue: asyncio.Queue):
+    with _subscribers_lock:
+        viewers = _subscribers.get(user_id, set())
+        viewers.difference_update({v for v in viewers if v[1] is queue})
+        if not viewers:
+            _subscribers.pop(user_id, None)
+
+def dispatch(payload: str):
+    '''hand one notification payload to every local subscriber of its user'''
+    event = json.loads(payload)
+    user_id = event.pop("user_id")
+    with _subscribers_lock:
+        viewers = list(_subscribers.get(user_id, ()))
+    for loop, queue in viewers:
+        loop.call_soon_threadsafe(_offer, queue, event)
+
+def _offer(queue: asyncio.Queue, event: dict):
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        # a viewer this far behind should refetch; don't let it hold memory
+        logger.warning("dropping live event for a slow viewer")
+
+def format_sse(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+def _ensure_listener():
+    # a viewer's user can live on any shard, and a moved user's events switch shards
+    with _subscribers_lock:
+        for shard in range(len(db.shard_urls())):
+            listener = _listeners.get(shard)
+            if listener is not None and listener.is_alive():
+                continue
+            listener = _listeners[shard] = threading.Thread(
+                target=_listen_forever, args=(shard,), name=f"event-listener-{shard}", daemon=True,
+            )
+            listener.start()
+
+def _listen_forever(shard: int):
+    backoff = 1.0
+    while True:
+        try:
+            conn = db.db_listen(CHANNEL, shard)
+        except Exception:
+            logger.exception("event listener could not connect; retrying in %.0fs", backoff)
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+            continue
+
+        backoff = 1.0
+        try:
+            while True:
+                if select.select([conn], [], [], HEARTBEAT_SECONDS) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    dispatch(conn.notifies.pop(0).payload)
+        except Exception:
+            logger.exception("event listener lost its connection; reconnecting")
+        finally:
+            conn.close()
@@ -0,0 +1,151 @@
+"""
+Group commit for set inserts.
+
+At peak hours many users log sets at the same moment, and each insert pays for its
+own commit. With GROUP_COMMIT_MS set, add_sets_to_active_session hands its insert to a
+writer thread for the user's shard instead. The writer waits until GROUP_COMMIT_MS after
+the oldest queued insert (or until GROUP_COMMIT_MAX_BATCH are queued), writes them all
+with one multi-row statement and a single commit, and resolves each caller with its own
+result. Inserts that arrive while a batch is being written form the next batch.
+
+Batches are written in arrival order, one at a time per shard, so a user's sets keep
+the order they were sent in. If the batch statement is rejected (a constraint violation
+or bad value) its requests are written again one by one, so only the request at fault
+gets an error. Any other failure fails the whole batch: the commit may have happened.
+
+Off by default: with little traffic, an insert just waits out the window alone.
+"""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Sequence
+
+from src.repository.db import (
+    get_conn,
+    user_placement,
+    UserMovingError,
+    db_add_sets_for_many,
+    db_add_sets_to_active_session,
+)
+from src.services import events, jobs
+
+logger = logging.getLogger("uvicorn.error")
+
+GROUP_COMMIT_MS = float(os.environ.get('GROUP_COMMIT_MS', '0'))  # 0 disables
+GROUP_COMMIT_MAX_BATCH = int(os.environ.get('GROUP_COMMIT_MAX_BATCH', '256'))
+
+# batches written by this worker process since it started
+stats = {"batches": 0, "requests": 0, "retried_one_by_one": 0}
+
+def enabled() -> bool:
+    return GROUP_COMMIT_MS > 0
+
+class Writer:
+    '''
+    queues requests and writes them in batches from its own thread.
+    write(requests) returns one result or exception per request, in order
+    '''
+
+    def __init__(self, write: Callable[[list], Sequence], window: float, max_batch: int,
+                 name: str = "group-commit"):
+        self.window = window
+        self.max_batch = max_batch
+        self._write = write
+        self._pending: list[tuple[object, Future]] = []
+        self._oldest = 0.0
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, request) -> Future:
+        future = Future()
+        with self._cond:
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append((request, future))
+            # wake the writer for the first request and for a full batch; otherwise it's sleeping out the window
+            if len(self._pending) in (1, self.max_batch):
+                self._cond.notify()
+        return future
+
+    def _next_batch(self) -> list[tuple[object, Future]]:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = self._oldest + self.window
+            while len(self._pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            # anything left over is already past its window and goes out next
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                results = self._write([request for request, _ in batch])
+            except Exception as e:
+                logger.exception("group commit of %s requests failed", len(batch))
+                results = [e] * len(batch)
+            for (_, future), result in zip(batch, results):
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+_writers: dict[int, Writer] = {}  # shard -> writer
+_writers_lock = threading.Lock()
+
+def _writer(shard: int) -> Writer:
+    with _writers_lock:
+        writer = _writers.get(shard)
+        if writer is None:
+            writer = _writers[shard] = Writer(
+                lambda requests: _write_batch(shard, requests), GROUP_COMMIT_MS / 1000,
+                GROUP_COMMIT_MAX_BATCH, name=f"group-commit-{shard}",
+            )
+        return writer
+
+def _write_batch(shard: int, requests: list[tuple]) -> list:
+    import psycopg2
+
+    stats["batches"] += 1
+    stats["requests"] += len(requests)
+    try:
+        with get_conn(shard=shard, autocommit=True) as conn:
+            return db_add_sets_for_many(conn, requests, events.CHANNEL, jobs.jobs_for("sets_added"))
+    except (psycopg2.IntegrityError, psycopg2.DataError) as e:
+        # the server rejected the statement, so nothing was written. any other error
+        # (a dropped connection, say) may have come after the commit: retrying could
+        # insert the sets twice, so those fail the whole batch in Writer._run
+        if len(requests) == 1:
+            return [e]
+    # the statement is all or nothing: write them one by one to find the request at fault
+    stats["retried_one_by_one"] += 1
+    return [_write_one(shard, request) for request in requests]
+
+def _write_one(shard: int, request: tuple):
+    user_id, exercise, sets, event = request
+    try:
+        with get_conn(shard=shard, autocommit=True) as conn:
+            return db_add_sets_to_active_session(conn, user_id, exercise, sets, events.CHANNEL, event,
+                                                 jobs.jobs_for("sets_added"))
+    except Exception as e:
+        return e
+
+def add_sets(user_id: int, exercise: str, sets: list[tuple[float, int, int]], event: str):
+    '''
+    I: user id, normalized exercise, (weight, reps, is_1rm) rows, NOTIFY event
+    P: queue the insert with everyone else's and wait for its batch to commit
+    O: what db_add_sets_to_active_session returns; raises what it would raise
+    '''
+    shard, moving = user_placement(user_id)
+    if moving:
+        raise UserMovingError(f"user {user_id} is being moved to another shard")
+    return _writer(shard).submit((user_id, exercise, sets, event)).result()
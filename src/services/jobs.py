@@ -0,0 +1,147 @@
+"""
+Deferred work for Lift Log.
+
+Writes queue jobs in the jobs table from the same statement that changes the data,
+so a job exists exactly when its write commits. Each API worker process runs a few
+asyncio workers that lease due jobs (FOR UPDATE SKIP LOCKED, so processes never take
+the same one), run them off the event loop, and delete them when done.
+
+There is at most one pending job per (kind, user): a write that lands while the job is
+queued or running bumps its generation, and a job whose generation moved on while it
+ran is run again. Failures are retried with exponential backoff; after JOB_MAX_ATTEMPTS
+the job is kept with failed_at set and stops counting as pending.
+
+Idle workers also trim the delta-sync change_log past CHANGE_LOG_TTL_HOURS.
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+from src.repository.db import (
+    get_conn,
+    shard_urls,
+    db_claim_jobs,
+    db_complete_job,
+    db_fail_job,
+    db_job_metrics,
+    db_prune_change_log,
+    db_refresh_personal_records,
+)
+from src.repository import snapshots
+
+logger = logging.getLogger("uvicorn.error")
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))  # per API worker process; 0 disables
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', '1'))
+JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', '60'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '5'))
+JOB_BACKOFF_SECONDS = float(os.environ.get('JOB_BACKOFF_SECONDS', '2'))
+JOB_BACKOFF_MAX_SECONDS = 300.0
+# delta-sync history; an older cursor gets a full sync instead
+CHANGE_LOG_TTL_HOURS = float(os.environ.get('CHANGE_LOG_TTL_HOURS', '720'))
+CHANGE_LOG_PRUNE_SECONDS = 60.0
+_next_prune = 0.0
+
+# jobs run in this worker process since it started
+stats = {"completed": 0, "retried": 0, "failed": 0}
+
+def _refresh_snapshot(user_id: int):
+    '''append newly ended sessions to the user's analytics snapshot'''
+    with get_conn(autocommit=True, user_id=user_id) as conn:
+        snapshots.refresh_snapshot(conn, user_id)
+
+def _refresh_personal_records(user_id: int):
+    with get_conn(autocommit=True, user_id=user_id) as conn:
+        db_refresh_personal_records(conn, user_id)
+
+# job kind -> handler taking the user id. handlers must be safe to run twice
+HANDLERS = {
+    "refresh_snapshot": _refresh_snapshot,
+    "personal_records": _refresh_personal_records,
+}
+
+def jobs_for(event_type: str) -> list[str]:
+    '''job kinds a write queues for its event type'''
+    if event_type == "sets_added":
+        return ["personal_records"]
+    if event_type == "session_ended":
+        return ["refresh_snapshot"] if snapshots.enabled() else []
+    return []
+
+def backoff_seconds(attempts: int) -> float:
+    '''delay before retry number `attempts`: doubles each time, capped'''
+    return min(JOB_BACKOFF_SECONDS * 2 ** (attempts - 1), JOB_BACKOFF_MAX_SECONDS)
+
+def run_due_jobs(limit: int = 1) -> int:
+    '''claim and run up to limit due jobs from each shard; returns how many were claimed'''
+    claimed = []
+    for shard in range(len(shard_urls())):
+        with get_conn(shard=shard, autocommit=True) as conn:
+            claimed += [{**job, "shard": shard} for job in db_claim_jobs(conn, limit, JOB_LEASE_SECONDS)]
+    for job in claimed:
+        _run(job)
+    return len(claimed)
+
+def _run(job: dict):
+    try:
+        HANDLERS[job["kind"]](job["user_id"])
+    except Exception as e:
+        give_up = job["attempts"] >= JOB_MAX_ATTEMPTS
+        logger.exception(
+            "job %s (%s for user %s) failed on attempt %s%s", job["job_id"], job["kind"], job["user_id"],
+            job["attempts"], "; giving up" if give_up else "",
+        )
+        with get_conn(shard=job["shard"], autocommit=True) as conn:
+            db_fail_job(conn, job["job_id"], repr(e), backoff_seconds(job["attempts"]), give_up)
+        stats["failed" if give_up else "retried"] += 1
+        return
+
+    with get_conn(shard=job["shard"], autocommit=True) as conn:
+        db_complete_job(conn, job["job_id"], job["generation"])
+    stats["completed"] += 1
+
+def prune_change_log(now: float = None) -> int:
+    '''trim expired change_log rows on every shard, at most once a minute per process'''
+    global _next_prune
+    now = time.monotonic() if now is None else now
+    if now < _next_prune:
+        return 0
+    _next_prune = now + CHANGE_LOG_PRUNE_SECONDS
+    pruned = 0
+    for shard in range(len(shard_urls())):
+        with get_conn(shard=shard, autocommit=True) as conn:
+            pruned += db_prune_change_log(conn, CHANGE_LOG_TTL_HOURS)
+    return pruned
+
+async def _worker():
+    while True:
+        try:
+            claimed = await asyncio.to_thread(run_due_jobs)
+            if not claimed:
+                # housekeeping only while the queue is idle
+                await asyncio.to_thread(prune_change_log)
+        except Exception:
+            logger.exception("job worker could not reach the database; retrying in %.0fs", JOB_POLL_SECONDS)
+            claimed = 0
+        if not claimed:
+            await asyncio.sleep(JOB_POLL_SECONDS)
+
+def start() -> list[asyncio.Task]:
+    '''start this process's workers on the running event loop'''
+    return [asyncio.create_task(_worker(), name=f"job-worker-{i}") for i in range(JOB_WORKERS)]
+
+async def stop(tasks: list[asyncio.Task]):
+    # a job cut off mid-run keeps its lease and is picked up again once the lease runs out
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+def metrics() -> dict:
+    '''queue depth and lag per shard and job kind (all processes), plus this process's counters'''
+    queue = []
+    for shard in range(len(shard_urls())):
+        with get_conn(shard=shard, autocommit=True) as conn:
+            queue += [{"shard": shard, **r} for r in db_job_metrics(conn)]
+    return {"workers": JOB_WORKERS, "processed": dict(stats), "queue": queue}
@@ -5,10 +5,15 @@ Provides higher-level operations that coordinate between the
 database layer and user-facing workflows.
 """
 
-from typing import Callable
+from typing import Callable, Iterable, Iterator, Optional
+import re
 import sqlite3
+import time
 from datetime import datetime
-from src.repository.db import db_insert_sets, get_conn, db_get_active_session, db_create_user, db_get_user
+from src.repository.db import (db_insert_sets, get_conn, db_get_active_session, db_create_user, db_get_user,
+                               db_create_imported_session, db_insert_session_sets,
+                               db_enqueue_jobs)
+from src.services import jobs
 
 SetRow = tuple[float, int, int] # (weight, reps, is_1rm)
 # CONSTANTS for main menu
@@ -43,7 +48,7 @@ def add_sets_from_entry(
     '''
 
     # check whether there is currently an active session
-    with get_conn() as conn:
+    with get_conn(user_id=user_id) as conn:
         session_id = db_get_active_session(conn, user_id)
         if session_id is None:
             raise NoActiveSessionError()
@@ -116,6 +121,142 @@ def parse_set_token(token: str) -> tuple[float, int]:
 
     return weight, reps
 
+# bulk text-log import
+# FORMAT (one session per header, one exercise per line):
+#   # 2024-01-05 push day
+#   bench press: 135x5, 155x3, 225x1 1RM
+#   squat: 315x5, 315x5
+
+ONE_RM_MARKER = re.compile(r"\s+1rm$", re.IGNORECASE)
+
+ImportSession = tuple[str, Optional[str], list[tuple[str, float, int, int, int]]]
+# (performed_at, session_name, [(exercise, weight, reps, is_1rm, set_index), ...])
+
+def parse_marked_set_token(token: str) -> tuple[float, int, int]:
+    '''
+    I: 'weightxreps', optionally followed by the 1RM marker: '225x1 1RM'
+    O: weight (float), reps (int), is_1rm (0/1)
+    the marker replaces the interactive 1RM prompt; it only counts on singles
+    '''
+    marked = ONE_RM_MARKER.search(token) is not None
+    weight, reps = parse_set_token(ONE_RM_MARKER.sub("", token))
+    if marked and reps != 1:
+        raise ValueError(f"1RM marker only allowed on singles in '{token}'")
+    return weight, reps, 1 if marked else 0
+
+def parse_session_header(line: str) -> tuple[str, Optional[str]]:
+    '''
+    I: '# 2024-01-05 push day' or '# 2024-01-05T18:30'
+    O: (performed_at ISO timestamp, session name or None)
+    '''
+    parts = line.lstrip("#").split(None, 1)
+    if not parts:
+        raise ValueError("Session header is missing a date")
+    try:
+        performed_at = datetime.fromisoformat(parts[0]).isoformat(timespec="seconds")
+    except ValueError:
+        raise ValueError(f"Invalid session date '{parts[0]}'. Expected YYYY-MM-DD")
+    name = parts[1].strip() if len(parts) == 2 else None
+    return performed_at, name or None
+
+def parse_log(lines: Iterable[str], on_error: Callable[[int, str], None]) -> Iterator[ImportSession]:
+    '''
+    I: lines of a text log, callback for (line number, message)
+    P: stream sessions one at a time. bad tokens are reported and skipped (the rest of
+       the line is kept); bad lines are reported and skipped; lines under a bad header
+       are skipped until the next good one
+    R: one ImportSession per header that has at least one valid set
+    '''
+    current = None
+    next_index: dict[str, int] = {}
+
+    for line_no, raw in enumerate(lines, start=1):
+        line = raw.strip()
+        if not line:
+            continue
+
+        if line.startswith("#"):
+            if current is not None and current[2]:
+                yield current
+            try:
+                performed_at, name = parse_session_header(line)
+                current = (performed_at, name, [])
+            except ValueError as e:
+                on_error(line_no, str(e))
+                current = None
+            next_index = {}
+            continue
+
+        if current is None:
+            on_error(line_no, "Sets must follow a session header like '# 2024-01-05'")
+            continue
+
+        try:
+            exercise, tokens = parse_entry_line(line)
+        except ValueError as e:
+            on_error(line_no, str(e))
+            continue
+
+        for token in tokens:
+            try:
+                weight, reps, is_1rm = parse_marked_set_token(token)
+            except ValueError as e:
+                on_error(line_no, str(e))
+                continue
+            next_index[exercise] = next_index.get(exercise, 0) + 1
+            current[2].append((exercise, weight, reps, is_1rm, next_index[exercise]))
+
+    if current is not None and current[2]:
+        yield current
+
+def import_log(user_id: int, lines: Iterable[str], *, on_error: Callable[[int, str], None]) -> dict:
+    '''
+    Business logic:
+    - streams sessions out of parse_log
+    - each session is created already ended, with all of its sets in one INSERT and one commit
+    - a session already logged at the same time under the same name is skipped, so importing
+      the same file again (or again after a failure part way) adds nothing twice
+    Returns counts and lines/second
+    '''
+    line_count = 0
+
+    def counted(source):
+        nonlocal line_count
+        for line in source:
+            line_count += 1
+            yield line
+
+    started = time.perf_counter()
+    sessions = sets = already_imported = 0
+    with get_conn(user_id=user_id) as conn:
+        for performed_at, name, rows in parse_log(counted(lines), on_error):
+            session_id = db_create_imported_session(conn, user_id, name, performed_at)
+            if session_id is None:
+                already_imported += 1
+                continue
+            sets += db_insert_session_sets(conn, session_id, rows)
+            conn.commit()
+            sessions += 1
+        if sessions:
+            db_enqueue_jobs(conn, user_id, jobs.jobs_for("session_ended") + jobs.jobs_for("sets_added"))
+            conn.commit()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "lines": line_count,
+        "sessions": sessions,
+        "sets": sets,
+        "already_imported": already_imported,
+        "seconds": elapsed,
+        "lines_per_second": line_count / elapsed if elapsed > 0 else float("inf"),
+    }
+
+def get_user_id(username: str) -> Optional[int]:
+    '''user id for an existing account, or None'''
+    with get_conn(readonly=True) as conn:
+        row = db_get_user(conn, normalize_username(username))
+    return row["user_id"] if row else None
+
 # UI functions
 def get_username():
     '''
@@ -151,14 +292,13 @@ def get_or_create_user(username: str) -> int:
     username = normalize_username(username)
     created_at = datetime.now().isoformat(timespec="seconds")
 
-    # check whether user exists
-    conn = get_conn()
-    user_id = db_get_user(conn, username)
-    if user_id is not None:
-        return user_id
+    with get_conn() as conn:
+        # check whether user exists
+        user_id = db_get_user(conn, username)
+        if user_id is not None:
+            return user_id
 
-    # create new user
-    user_id = db_create_user(conn, created_at, username)
-    conn.commit()
-    conn.close()
+        # create new user
+        user_id = db_create_user(conn, created_at, username)
+        conn.commit()
     return user_id
\ No newline at end of file
@@ -1,47 +1,64 @@
-import tempfile
+import uuid
+
 import pytest
 from fastapi.testclient import TestClient
-import src
 
 from src.api.main import app
 from src.repository import db
 
 @pytest.fixture
 def client():
-    with tempfile.NamedTemporaryFile() as tmp:
-        db.TEST_DB_PATH = tmp.name
-        db.db_init_db()
-
-        client = TestClient(app)
-        yield client
+    # one Postgres for the whole suite: every test starts from empty tables on every shard
+    db.db_init_db()
+    for shard in range(len(db.shard_urls())):
+        with db.get_conn(shard=shard) as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT tablename FROM pg_tables
+                WHERE schemaname = current_schema() AND tablename <> 'schema_version';
+            """)
+            cur.execute(f"TRUNCATE {', '.join(row[0] for row in cur.fetchall())} CASCADE;")
+    return TestClient(app)
 
-        db.TEST_DB_PATH = None
+def _username() -> str:
+    return f"lifter_{uuid.uuid4().hex[:8]}"
 
 def test_create_user(client):
-    res = client.post("/users", json={"username": "sherman"})
+    username = _username()
+    res = client.post("/users", json={"username": username})
     assert res.status_code == 201
     data = res.json()
     assert "user_id" in data
-    assert data["username"] == "sherman"
+    assert data["username"] == username
 
 def test_duplicate_username(client):
-    client.post("/users", json={"username": "sherman"})
-    res = client.post("/users", json={"username": "sherman"})
+    username = _username()
+    client.post("/users", json={"username": username})
+    res = client.post("/users", json={"username": username})
     assert res.status_code == 409
 
 def test_create_session(client):
-    user = client.post("/users", json={"username": "sherman"}).json()
+    user = client.post("/users", json={"username": _username()}).json()
     res = client.post(f"/users/{user['user_id']}/sessions", json={})
     assert res.status_code == 201
 
 def test_only_one_active_session(client):
-    user = client.post("/users", json={"username": "sherman"}).json()
+    user = client.post("/users", json={"username": _username()}).json()
     client.post(f"/users/{user['user_id']}/sessions", json={})
     res = client.post(f"/users/{user['user_id']}/sessions", json={})
     assert res.status_code == 409
 
+def test_end_session_name_is_capped(client):
+    user_id = client.post("/users", json={"username": _username()}).json()["user_id"]
+    client.post(f"/users/{user_id}/sessions", json={})
+
+    res = client.post(f"/users/{user_id}/sessions/end", json={"session_name": "x" * 9000})
+    assert res.status_code == 422
+    res = client.post(f"/users/{user_id}/sessions/end", json={"session_name": "x" * 100})
+    assert res.status_code == 200 and res.json()["ended_sessions"] == 1
+
 def test_add_sets(client):
-    user = client.post("/users", json={"username": "sherman"}).json()
+    user = client.post("/users", json={"username": _username()}).json()
     client.post(f"/users/{user['user_id']}/sessions", json={})
 
     payload = {
@@ -56,7 +73,7 @@ def test_add_sets(client):
     assert res.json()["sets_inserted"] == 2
 
 def test_add_sets_without_session(client):
-    user = client.post("/users", json={"username": "sherman"}).json()
+    user = client.post("/users", json={"username": _username()}).json()
 
     payload = {
         "sets": [
@@ -68,7 +85,7 @@ def test_add_sets_without_session(client):
     assert res.status_code == 400
 
 def test_mixed_exercise_batch(client):
-    user = client.post("/users", json={"username": "sherman"}).json()
+    user = client.post("/users", json={"username": _username()}).json()
     client.post(f"/users/{user['user_id']}/sessions", json={})
 
     payload = {
@@ -79,4 +96,254 @@ def test_mixed_exercise_batch(client):
     }
 
     res = client.post(f"/users/{user['user_id']}/sets", json=payload)
-    assert res.status_code == 400
\ No newline at end of file
+    assert res.status_code == 400
+
+def test_changes_since_cursor(client):
+    user = client.post("/users", json={"username": _username(), "password": "secret123"}).json()
+    user_id = user["user_id"]
+    client.post(f"/users/{user_id}/sessions", json={})
+
+    first = client.get(f"/users/{user_id}/changes", params={"since": 0}).json()
+    assert len(first["sessions"]) == 1
+    assert first["sets"] == []
+
+    payload = {"sets": [{"exercise": "bench press", "weight": 225, "reps": 5}]}
+    client.post(f"/users/{user_id}/sets", json=payload)
+
+    second = client.get(f"/users/{user_id}/changes", params={"since": first["cursor"]}).json()
+    assert second["sessions"] == []
+    assert [s["weight"] for s in second["sets"]] == [225]
+    assert second["cursor"] >= first["cursor"]
+    assert first["full_sync"] and not second["full_sync"]
+
+def test_cursor_older_than_pruned_change_log_gets_full_sync(client):
+    user_id = client.post("/users", json={"username": _username(), "password": "secret123"}).json()["user_id"]
+    client.post(f"/users/{user_id}/sessions", json={})
+    cursor = client.get(f"/users/{user_id}/changes", params={"since": 0}).json()["cursor"]
+    client.post(f"/users/{user_id}/sets", json={"sets": [{"exercise": "squat", "weight": 315, "reps": 5}]})
+
+    with db.get_conn() as conn:
+        assert db.db_prune_change_log(conn, ttl_hours=0) > 0
+
+    # the set's log row is gone, yet nothing is missed: the stale cursor gets everything
+    res = client.get(f"/users/{user_id}/changes", params={"since": cursor}).json()
+    assert res["full_sync"]
+    assert len(res["sessions"]) == 1 and [s["weight"] for s in res["sets"]] == [315]
+
+def test_batch_retry_replays_without_duplicating_sets(client):
+    user = client.post("/users", json={"username": _username(), "password": "secret123"}).json()
+    user_id = user["user_id"]
+
+    batch = {
+        "operations": [
+            {"idempotency_key": "op-1", "op": "start_session"},
+            {
+                "idempotency_key": "op-2",
+                "op": "add_sets",
+                "sets": [{"exercise": "bench press", "weight": 225, "reps": 5}],
+            },
+        ]
+    }
+    first = client.post(f"/users/{user_id}/batch", json=batch).json()["results"]
+    assert [r["status"] for r in first] == [201, 201]
+    assert not any(r["replayed"] for r in first)
+
+    # the response was "lost"; the client retries the same batch
+    retry = client.post(f"/users/{user_id}/batch", json=batch).json()["results"]
+    assert all(r["replayed"] for r in retry)
+    assert retry[1]["result"] == first[1]["result"]
+
+    session_id = first[0]["result"]["session_id"]
+    assert len(client.get(f"/sessions/{session_id}/sets").json()) == 1
+
+def test_batch_key_reused_for_different_operation_is_refused(client):
+    user_id = client.post("/users", json={"username": _username(), "password": "secret123"}).json()["user_id"]
+    client.post(f"/users/{user_id}/sessions", json={})
+
+    def add(weight):
+        op = {"idempotency_key": "op-1", "op": "add_sets", "sets": [{"exercise": "squat", "weight": weight, "reps": 5}]}
+        return client.post(f"/users/{user_id}/batch", json={"operations": [op]}).json()["results"][0]
+
+    assert add(315)["status"] == 201
+    # a client bug sends other sets under the same key: not a retry, so no replay and no write
+    mismatch = add(405)
+    assert mismatch["status"] == 422 and not mismatch["replayed"]
+    assert add(315)["replayed"]
+
+def test_bad_add_sets_fails_only_its_operation(client):
+    user_id = client.post("/users", json={"username": _username(), "password": "secret123"}).json()["user_id"]
+    batch = {"operations": [
+        {"idempotency_key": "op-1", "op": "start_session"},
+        {"idempotency_key": "op-2", "op": "add_sets", "sets": [
+            {"exercise": "squat", "weight": 315, "reps": 5}, {"exercise": "bench press", "weight": 225, "reps": 5},
+        ]},
+        {"idempotency_key": "op-3", "op": "add_sets", "sets": [{"exercise": "squat", "weight": 315, "reps": 5}]},
+    ]}
+    res = client.post(f"/users/{user_id}/batch", json=batch)
+    assert res.status_code == 200
+    results = res.json()["results"]
+    assert [r["status"] for r in results] == [201, 400, 201]
+    assert [r["idempotency_key"] for r in results] == ["op-1", "op-2", "op-3"]
+    assert len(client.get(f"/sessions/{results[0]['result']['session_id']}/sets").json()) == 1
+
+def test_sessions_date_range(client):
+    user = client.post("/users", json={"username": _username(), "password": "secret123"}).json()
+    user_id = user["user_id"]
+    for day in ("2024-01-05", "2024-02-05"):
+        client.post(f"/users/{user_id}/sessions", json={"performed_at": f"{day}T10:00:00"})
+        client.post(f"/users/{user_id}/sessions/end")
+
+    res = client.get(f"/users/{user_id}/sessions", params={"start": "2024-02-01T00:00:00", "end": "2024-03-01T00:00:00"})
+    assert res.status_code == 200
+    assert [s["performed_at"] for s in res.json()] == ["2024-02-05T10:00:00"]
+
+    res = client.get(f"/users/{user_id}/sessions", params={"start": "2024-03-01T00:00:00", "end": "2024-02-01T00:00:00"})
+    assert res.status_code == 400
+
+def test_session_posted_with_offset_matches_filter_in_that_offset(client):
+    user_id = client.post("/users", json={"username": _username(), "password": "secret123"}).json()["user_id"]
+    client.post(f"/users/{user_id}/sessions", json={"performed_at": "2024-02-05T10:00:00+05:00"})
+    client.post(f"/users/{user_id}/sessions/end")
+    batch = {"operations": [
+        {"idempotency_key": "op-1", "op": "start_session", "performed_at": "2024-02-06T10:00:00+05:00"},
+        {"idempotency_key": "op-2", "op": "end_session"},
+    ]}
+    assert [r["status"] for r in client.post(f"/users/{user_id}/batch", json=batch).json()["results"]] == [201, 200]
+
+    for day in ("2024-02-05", "2024-02-06"):
+        params = {"start": f"{day}T09:30:00+05:00", "end": f"{day}T10:30:00+05:00"}
+        assert len(client.get(f"/users/{user_id}/sessions", params=params).json()) == 1
+
+def test_sessions_with_embedded_sets(client):
+    user = client.post("/users", json={"username": _username(), "password": "secret123"}).json()
+    user_id = user["user_id"]
+    client.post(f"/users/{user_id}/sessions", json={})
+    payload = {"sets": [{"exercise": "bench press", "weight": 225, "reps": 5}] * 2}
+    client.post(f"/users/{user_id}/sets", json=payload)
+
+    res = client.get(f"/users/{user_id}/sessions", params={"include": "sets", "fields": "session_id,sets.weight"})
+    assert res.status_code == 200
+    [session] = res.json()
+    assert set(session) == {"session_id", "sets"}
+    assert session["sets"] == [{"weight": 225}, {"weight": 225}]
+
+def _round_trips(call):
+    before = db.round_trips()
+    res = call()
+    return res, db.round_trips() - before
+
+def test_endpoint_round_trips(client):
+    # every single-statement endpoint costs one round trip, prepared or not yet prepared
+    username = _username()
+    res, trips = _round_trips(lambda: client.post("/users", json={"username": username, "password": "secret123"}))
+    assert res.status_code == 201 and trips == 1
+    user_id = res.json()["user_id"]
+
+    res, trips = _round_trips(lambda: client.post("/users", json={"username": username, "password": "secret123"}))
+    assert res.status_code == 409 and trips == 1
+
+    res, trips = _round_trips(lambda: client.post(f"/users/{user_id}/sets", json={"sets": [{"exercise": "squat", "weight": 315, "reps": 3}]}))
+    assert res.status_code == 400 and trips == 1
+
+    for _ in range(2):
+        res, trips = _round_trips(lambda: client.post(f"/users/{user_id}/sessions", json={}))
+        assert trips == 1
+    assert res.status_code == 409
+
+    payload = {"sets": [{"exercise": "bench press", "weight": 225, "reps": 5}] * 3}
+    for _ in range(2):
+        res, trips = _round_trips(lambda: client.post(f"/users/{user_id}/sets", json=payload))
+        assert res.status_code == 201 and trips == 1
+
+    res, trips = _round_trips(lambda: client.get(f"/users/{user_id}/sessions"))
+    assert res.status_code == 200 and trips == 1
+
+    res, trips = _round_trips(lambda: client.get(f"/users/{user_id}/sessions", params={"include": "sets"}))
+    assert [s["set_index"] for s in res.json()[0]["sets"]] == [1, 2, 3, 4, 5, 6]
+    assert trips == 1
+
+    res, trips = _round_trips(lambda: client.post(f"/users/{user_id}/sessions/end", json={}))
+    assert res.status_code == 200 and trips == 1
+
+def test_personal_records_follow_queued_jobs(client):
+    from src.services import jobs
+
+    user_id = client.post("/users", json={"username": _username(), "password": "secret123"}).json()["user_id"]
+    client.post(f"/users/{user_id}/sessions", json={})
+    client.post(f"/users/{user_id}/sets", json={"sets": [{"exercise": "bench press", "weight": 225, "reps": 5}]})
+    # a second write before the job runs re-queues it instead of adding another
+    client.post(f"/users/{user_id}/sets", json={"sets": [{"exercise": "bench press", "weight": 245, "reps": 3}]})
+
+    queue = client.get("/debug-jobs").json()["queue"]
+    assert [(q["kind"], q["pending"]) for q in queue] == [("personal_records", 1)]
+    assert client.get(f"/users/{user_id}/records").json() == []
+
+    while jobs.run_due_jobs(limit=10):
+        pass
+
+    [record] = client.get(f"/users/{user_id}/records").json()
+    assert (record["exercise"], record["weight"], record["reps"]) == ("bench press", 245, 3)
+    assert client.get("/debug-jobs").json()["queue"] == []
+
+def test_search_sessions_ranked_and_paged(client):
+    user_id = client.post("/users", json={"username": _username(), "password": "secret123"}).json()["user_id"]
+    notes = [
+        ("Deload week", "light, easy"),
+        ("Leg day", "lower back hurt on the second set of squats"),
+        ("Push", "deload after the meet"),
+    ]
+    for name, note in notes:
+        client.post(f"/users/{user_id}/sessions", json={"session_name": name, "notes": note})
+        client.post(f"/users/{user_id}/sessions/end", json={})
+
+    res = client.get(f"/users/{user_id}/sessions/search", params={"q": "deload week"})
+    assert res.status_code == 200
+    # the name match outranks the notes match; "any" still returns the partial one
+    assert [r["session_name"] for r in res.json()["results"]] == ["Deload week", "Push"]
+
+    res = client.get(f"/users/{user_id}/sessions/search", params={"q": "the day my back hurt"}).json()
+    assert res["results"][0]["session_name"] == "Leg day"
+    assert "<b>back</b>" in res["results"][0]["snippet"]
+
+    res = client.get(f"/users/{user_id}/sessions/search", params={"q": "deload", "limit": 1}).json()
+    assert len(res["results"]) == 1 and res["next_offset"] == 1
+    res = client.get(f"/users/{user_id}/sessions/search", params={"q": "deload week", "match": "all"}).json()
+    assert [r["session_name"] for r in res["results"]] == ["Deload week"]
+
+def test_group_commit_keeps_each_request_apart(client, monkeypatch):
+    import threading
+    from src.services import group_commit
+
+    monkeypatch.setattr(group_commit, "GROUP_COMMIT_MS", 200.0)
+    monkeypatch.setattr(group_commit, "_writers", {})
+    users = [client.post("/users", json={"username": _username(), "password": "secret123"}).json()["user_id"]
+             for i in range(3)]
+    for user_id in users[:2]:
+        client.post(f"/users/{user_id}/sessions", json={})
+    batches = group_commit.stats["batches"]
+
+    # two users log at once; the third has no active session and must fail on its own
+    responses = {}
+    def post(user_id, weight):
+        responses[(user_id, weight)] = client.post(
+            f"/users/{user_id}/sets", json={"sets": [{"exercise": "squat", "weight": weight, "reps": 5}] * 2},
+        )
+    threads = [threading.Thread(target=post, args=(u, 100 + u)) for u in users]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert group_commit.stats["batches"] - batches == 1
+
+    assert responses[(users[2], 100 + users[2])].status_code == 400
+    for user_id in users[:2]:
+        assert responses[(user_id, 100 + user_id)].json()["sets_inserted"] == 2
+
+    # one user's requests, one after another, keep their order across batches
+    for weight in (200, 205):
+        assert client.post(f"/users/{users[0]}/sets", json={"sets": [{"exercise": "squat", "weight": weight, "reps": 1}]}).status_code == 201
+    session_id = client.get(f"/users/{users[0]}/sessions/active").json()["session_id"]
+    sets = client.get(f"/sessions/{session_id}/sets").json()
+    assert [(s["set_index"], s["weight"]) for s in sets] == [
+        (1, 100 + users[0]), (2, 100 + users[0]), (3, 200), (4, 205),
+    ]
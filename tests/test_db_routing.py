@@ -0,0 +1,130 @@
+import os
+import time
+import uuid
+
+import pytest
+
+from src.repository import db
+
+PRIMARY = "postgresql://primary/liftlog"
+REPLICAS = ["postgresql://replica-a/liftlog", "postgresql://replica-b/liftlog"]
+
+@pytest.fixture
+def routing(monkeypatch):
+    monkeypatch.setattr(db, "DATABASE_URL", PRIMARY)
+    monkeypatch.setattr(db, "DATABASE_REPLICA_URLS", list(REPLICAS))
+    monkeypatch.setattr(db, "READ_YOUR_WRITES_SECONDS", 5.0)
+    monkeypatch.setattr(db, "_recent_writes", {})
+
+def test_writes_go_to_primary(routing):
+    assert db.pick_dsn() == PRIMARY
+    assert db.pick_dsn(user_id=1) == PRIMARY
+
+def test_reads_round_robin_across_replicas(routing):
+    picked = {db.pick_dsn(readonly=True, user_id=1) for _ in range(4)}
+    assert picked == set(REPLICAS)
+
+def test_reads_without_replicas_use_primary(routing, monkeypatch):
+    monkeypatch.setattr(db, "DATABASE_REPLICA_URLS", [])
+    assert db.pick_dsn(readonly=True, user_id=1) == PRIMARY
+
+def test_read_your_writes_window_per_user(routing):
+    db.mark_write(user_id=1)
+    assert db.pick_dsn(readonly=True, user_id=1) == PRIMARY
+    # other users are unaffected
+    assert db.pick_dsn(readonly=True, user_id=2) in REPLICAS
+
+def test_read_your_writes_window_per_session(routing):
+    db.mark_write(user_id=1, session_id=10)
+    assert db.pick_dsn(readonly=True, session_id=10) == PRIMARY
+    assert db.pick_dsn(readonly=True, session_id=11) in REPLICAS
+
+def test_read_your_writes_window_expires(routing, monkeypatch):
+    db.mark_write(user_id=1)
+    real_monotonic = time.monotonic
+    monkeypatch.setattr(db.time, "monotonic", lambda: real_monotonic() + 10)
+    assert db.pick_dsn(readonly=True, user_id=1) in REPLICAS
+
+def _routing_client():
+    from fastapi import FastAPI, HTTPException
+    from fastapi.testclient import TestClient
+    from src.api.consistency import ReadYourWritesMiddleware
+
+    app = FastAPI()
+
+    @app.post("/write")
+    def write(ok: bool = True):
+        if not ok:
+            raise HTTPException(status_code=400)
+        return {}
+
+    @app.get("/read")
+    def read():
+        return {"dsn": db.pick_dsn(readonly=True, user_id=1)}
+
+    app.add_middleware(ReadYourWritesMiddleware)
+    return TestClient(app)
+
+def test_read_your_writes_follows_the_client_to_another_worker(routing):
+    client = _routing_client()
+    client.post("/write")
+    # the read lands on a worker that never saw the write
+    assert db._recent_writes == {}
+    assert client.get("/read").json()["dsn"] == PRIMARY
+    # other clients still read from replicas
+    assert _routing_client().get("/read").json()["dsn"] in REPLICAS
+
+def test_failed_write_sets_no_marker(routing):
+    client = _routing_client()
+    assert client.post("/write", params={"ok": False}).status_code == 400
+    assert client.get("/read").json()["dsn"] in REPLICAS
+
+def test_client_marker_expires(routing):
+    from src.api.consistency import COOKIE
+
+    client = _routing_client()
+    client.cookies.set(COOKIE, str(time.time() - 10))
+    assert client.get("/read").json()["dsn"] in REPLICAS
+    client.cookies.set(COOKIE, "not-a-time")
+    assert client.get("/read").json()["dsn"] in REPLICAS
+
+def _in_recovery(conn) -> bool:
+    cur = conn.cursor()
+    cur.execute("SELECT pg_is_in_recovery();")
+    return cur.fetchone()[0]
+
+# streaming replication check: needs a primary and a replica, e.g.
+# LIFT_LOG_TEST_PRIMARY_URL=postgresql://localhost:5432/liftlog
+# LIFT_LOG_TEST_REPLICA_URL=postgresql://localhost:5433/liftlog
+@pytest.mark.skipif(
+    not (os.environ.get("LIFT_LOG_TEST_PRIMARY_URL") and os.environ.get("LIFT_LOG_TEST_REPLICA_URL")),
+    reason="needs a primary and a streaming replica",
+)
+def test_replica_serves_reads_after_window(monkeypatch):
+    monkeypatch.setattr(db, "DATABASE_URL", os.environ["LIFT_LOG_TEST_PRIMARY_URL"])
+    monkeypatch.setattr(db, "DATABASE_REPLICA_URLS", [os.environ["LIFT_LOG_TEST_REPLICA_URL"]])
+    monkeypatch.setattr(db, "READ_YOUR_WRITES_SECONDS", 1.0)
+    monkeypatch.setattr(db, "_recent_writes", {})
+    db.db_init_db()
+
+    username = f"replica-{uuid.uuid4().hex[:8]}"
+    with db.get_conn() as conn:
+        user_id = db.db_create_user(conn, "2024-01-01T00:00:00", username, "x")
+        conn.commit()
+    db.mark_write(user_id=user_id)
+
+    # inside the window the read is pinned to the primary, which has the row
+    with db.get_conn(readonly=True, user_id=user_id) as conn:
+        assert not _in_recovery(conn)
+        assert db.db_get_user(conn, username) is not None
+
+    # after the window the replica answers, once it has replayed the insert
+    time.sleep(1.1)
+    deadline = time.monotonic() + 5
+    while True:
+        with db.get_conn(readonly=True, user_id=user_id) as conn:
+            assert _in_recovery(conn)
+            if db.db_get_user(conn, username) is not None:
+                break
+        assert time.monotonic() < deadline, "replica never caught up"
+        time.sleep(0.1)
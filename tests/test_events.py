@@ -0,0 +1,58 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from src.services import events
+
+@pytest.fixture(autouse=True)
+def no_listener(monkeypatch):
+    # fan-out is tested on its own; no Postgres LISTEN connection
+    monkeypatch.setattr(events, "_ensure_listener", lambda: None)
+    monkeypatch.setattr(events, "_subscribers", {})
+
+def test_dispatch_fans_out_to_that_users_viewers():
+    async def scenario():
+        phone = events.subscribe(1)
+        tablet = events.subscribe(1)
+        other = events.subscribe(2)
+
+        payload = json.dumps({"user_id": 1, "type": "sets_added", "session_id": 5})
+        threading.Thread(target=events.dispatch, args=(payload,)).start()
+
+        for queue in (phone, tablet):
+            event = await asyncio.wait_for(queue.get(), timeout=1)
+            assert event == {"type": "sets_added", "session_id": 5}
+        assert other.empty()
+
+    asyncio.run(scenario())
+
+def test_unsubscribe_removes_viewer():
+    async def scenario():
+        queue = events.subscribe(1)
+        events.unsubscribe(1, queue)
+        assert 1 not in events._subscribers
+
+    asyncio.run(scenario())
+
+def test_encode_drops_set_details_over_notify_limit():
+    many_sets = [{"weight": 135.0, "reps": 5, "is_1rm": 0}] * 1000
+    payload = events.encode(1, {"type": "sets_added", "exercise": "squat", "sets": many_sets})
+    assert json.loads(payload) == {"user_id": 1, "type": "sets_added", "exercise": "squat"}
+
+def test_oversized_event_falls_back_to_type_and_ids():
+    payload = events.encode(1, {"type": "session_ended", "session_id": 5, "session_name": "x" * 9000})
+    assert json.loads(payload) == {"user_id": 1, "type": "session_ended", "session_id": 5}
+
+def test_payload_fits_with_the_ids_the_statement_adds():
+    many_sets = [{"weight": 135.0, "reps": 5, "is_1rm": 0}] * 1000
+    for event in ({"type": "sets_added", "exercise": "é" * 7900, "sets": many_sets},
+                  {"type": "sets_added", "exercise": "x" * 7850}):
+        payload = json.loads(events.encode(2**63 - 1, event))
+        # what pg_notify receives after the statement's jsonb_build_object
+        payload.update(session_id=2**63 - 1, first_set_index=2**63 - 1)
+        assert len(json.dumps(payload).encode()) <= events.NOTIFY_PAYLOAD_LIMIT
+
+def test_format_sse():
+    assert events.format_sse({"type": "session_ended"}) == 'event: session_ended\ndata: {"type": "session_ended"}\n\n'
@@ -0,0 +1,28 @@
+import json
+import sys
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from src.api import formats
+
+def test_negotiate_defaults_to_json():
+    assert formats.negotiate(None) == formats.JSON
+    assert formats.negotiate("text/html, */*;q=0.8") == formats.JSON
+
+def test_negotiate_prefers_highest_q():
+    accept = "application/json;q=0.5, application/vnd.liftlog.columns+json"
+    assert formats.negotiate(accept) == formats.COLUMNS_JSON
+    assert formats.negotiate("application/x-msgpack") == formats.MSGPACK
+
+def test_columns_json_keys_once():
+    columns = {"weight": [225.0, 235.0], "performed_at": [datetime(2024, 1, 5, 10), datetime(2024, 1, 7, 10)]}
+    body = json.loads(formats.encode_columns(columns, formats.COLUMNS_JSON))
+    assert body == {"weight": [225.0, 235.0], "performed_at": ["2024-01-05T10:00:00", "2024-01-07T10:00:00"]}
+
+def test_msgpack_is_optional(monkeypatch):
+    monkeypatch.setitem(sys.modules, "msgpack", None)  # import fails as if not installed
+    with pytest.raises(HTTPException) as e:
+        formats.encode_columns({"weight": [225.0]}, formats.MSGPACK)
+    assert e.value.status_code == 406
@@ -0,0 +1,67 @@
+import gzip
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src.api import assets
+from src.api.main import app
+
+# no `with`: the lifespan (database check, job workers) doesn't run, and the frontend needs neither
+client = TestClient(app)
+
+def test_page_calls_its_own_origin():
+    html = client.get("/", headers={"Accept-Encoding": "identity"}).text
+    assert "lift-log-cmso.onrender.com" not in html
+    assert "<style>" not in html and "<script>" not in html
+
+    script = next(path for path in assets.bundle() if path.endswith(".js"))
+    assert f'<script src="{script}"></script>' in html
+    assert "const API = '';" in client.get(script).text
+
+def test_assets_are_fingerprinted_and_immutable():
+    paths = [path for path in assets.bundle() if path.startswith("/assets/")]
+    assert len(paths) == 2
+    for path in paths:
+        res = client.get(path)
+        assert res.status_code == 200
+        assert res.headers["cache-control"] == assets.IMMUTABLE
+        assert assets.bundle()[path].digest in path
+    assert client.get("/assets/app.0000000000000000.js").status_code == 404
+
+def test_precompressed_copy_is_sent():
+    res = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert res.headers["content-encoding"] == "gzip"
+    assert res.headers["vary"] == "Accept-Encoding"
+    assert res.headers["cache-control"] == "no-cache"
+    raw = client.get("/", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in raw.headers
+    assert gzip.decompress(assets.bundle()["/"].bodies["gzip"]).decode() == raw.text
+
+def test_repeat_load_is_a_304():
+    first = client.get("/", headers={"Accept-Encoding": "gzip"})
+    res = client.get("/", headers={"Accept-Encoding": "gzip", "If-None-Match": first.headers["etag"]})
+    assert res.status_code == 304
+    assert res.content == b""
+    # another encoding is another representation
+    res = client.get("/", headers={"Accept-Encoding": "identity", "If-None-Match": first.headers["etag"]})
+    assert res.status_code == 200
+
+@pytest.mark.parametrize("header, expected", [
+    (None, "identity"),
+    ("gzip, deflate, br", "br"),
+    ("gzip;q=1.0, br;q=0.5", "gzip"),
+    ("br;q=0, gzip", "gzip"),
+    ("*", "br"),
+    ("identity", "identity"),
+])
+def test_negotiate_encoding(header, expected):
+    assert assets.negotiate(header, {"identity", "gzip", "br"}) == expected
+
+def test_brotli_is_optional():
+    assert assets.negotiate("br, gzip", {"identity", "gzip"}) == "gzip"
+
+def test_etag_comparison():
+    assert assets.not_modified('W/"abc", "def"', '"abc"')
+    assert assets.not_modified("*", '"abc"')
+    assert not assets.not_modified('"abc-gzip"', '"abc"')
+    assert not assets.not_modified(None, '"abc"')
@@ -0,0 +1,93 @@
+import threading
+
+import pytest
+
+from src.services import group_commit
+
+class RecordingWrite:
+    '''stands in for the database: answers each request with its own value or error'''
+
+    def __init__(self, hold: threading.Event = None):
+        self.batches = []
+        self.hold = hold
+        self.writing = threading.Event()
+
+    def __call__(self, requests):
+        self.writing.set()
+        if self.hold is not None:
+            self.hold.wait()
+        self.batches.append(list(requests))
+        return [ValueError(r) if r == "bad" else r.upper() for r in requests]
+
+def test_concurrent_requests_share_a_commit():
+    write = RecordingWrite()
+    writer = group_commit.Writer(write, window=0.05, max_batch=100)
+    futures = [writer.submit(r) for r in ("a", "b", "c")]
+    assert [f.result(timeout=2) for f in futures] == ["A", "B", "C"]
+    assert write.batches == [["a", "b", "c"]]
+
+def test_one_bad_request_fails_alone():
+    writer = group_commit.Writer(RecordingWrite(), window=0.05, max_batch=100)
+    good, bad, after = (writer.submit(r) for r in ("a", "bad", "c"))
+    with pytest.raises(ValueError):
+        bad.result(timeout=2)
+    assert good.result(timeout=2) == "A" and after.result(timeout=2) == "C"
+
+def test_full_batch_goes_out_without_waiting():
+    write = RecordingWrite()
+    writer = group_commit.Writer(write, window=60, max_batch=2)
+    futures = [writer.submit(r) for r in ("a", "b")]
+    assert [f.result(timeout=2) for f in futures] == ["A", "B"]
+
+def test_requests_arriving_during_a_write_form_the_next_batch_in_order():
+    hold = threading.Event()
+    write = RecordingWrite(hold)
+    writer = group_commit.Writer(write, window=0.0, max_batch=3)
+    first = writer.submit("a")
+    write.writing.wait(timeout=2)
+    # the writer is now stuck on ["a"]; these queue up behind it, one over the batch size
+    rest = [writer.submit(r) for r in ("b", "c", "d", "e")]
+    hold.set()
+    assert [f.result(timeout=2) for f in [first, *rest]] == ["A", "B", "C", "D", "E"]
+    assert write.batches == [["a"], ["b", "c", "d"], ["e"]]
+
+def test_a_failed_write_fails_its_whole_batch():
+    def write(requests):
+        raise ConnectionError("database went away")
+
+    writer = group_commit.Writer(write, window=0.0, max_batch=10)
+    with pytest.raises(ConnectionError):
+        writer.submit("a").result(timeout=2)
+    # and the writer keeps going
+    writer._write = RecordingWrite()
+    assert writer.submit("b").result(timeout=2) == "B"
+
+class FakeConn:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+@pytest.mark.parametrize("error, retried", [("IntegrityError", True), ("OperationalError", False)])
+def test_only_a_rejected_batch_is_retried_one_by_one(monkeypatch, error, retried):
+    psycopg2 = pytest.importorskip("psycopg2")
+    written = []
+
+    def add_sets_for_many(conn, requests, channel, jobs):
+        raise getattr(psycopg2, error)("batch failed")
+
+    monkeypatch.setattr(group_commit, "get_conn", lambda **kwargs: FakeConn())
+    monkeypatch.setattr(group_commit, "db_add_sets_for_many", add_sets_for_many)
+    monkeypatch.setattr(group_commit, "db_add_sets_to_active_session",
+                        lambda conn, user_id, *args: written.append(user_id) or (user_id, 1))
+    requests = [(1, "squat", [(100.0, 5, 0)], "{}"), (2, "squat", [(100.0, 5, 0)], "{}")]
+
+    if retried:
+        assert group_commit._write_batch(0, requests) == [(1, 1), (2, 1)]
+        assert written == [1, 2]
+    else:
+        # the connection may have dropped after the commit: never write the sets again
+        with pytest.raises(psycopg2.OperationalError):
+            group_commit._write_batch(0, requests)
+        assert written == []
@@ -0,0 +1,62 @@
+import uuid
+
+import pytest
+
+from src.repository import db
+from src.services import api_services
+from src.services.services import import_log, parse_log, parse_marked_set_token, parse_session_header
+
+LOG = """
+# 2024-01-05 Push Day
+bench press: 135x5, 155x3, 225x1 1RM
+Bench Press: 135x8
+overhead press: 95x5, abcx5, 105x
+
+# 2024-01-07
+squat: 315x5
+""".splitlines()
+
+def parse(lines):
+    errors = []
+    sessions = list(parse_log(lines, lambda line_no, msg: errors.append(line_no)))
+    return sessions, errors
+
+def test_parse_log_sessions_and_set_order():
+    sessions, errors = parse(LOG)
+
+    assert [(s[0], s[1]) for s in sessions] == [
+        ("2024-01-05T00:00:00", "Push Day"),
+        ("2024-01-07T00:00:00", None),
+    ]
+    bench = [row for row in sessions[0][2] if row[0] == "bench press"]
+    assert [(w, r, rm, idx) for _, w, r, rm, idx in bench] == [
+        (135.0, 5, 0, 1), (155.0, 3, 0, 2), (225.0, 1, 1, 3), (135.0, 8, 0, 4),
+    ]
+    # bad tokens are reported, the rest of the line is kept
+    assert errors == [5, 5]
+    press = [row for row in sessions[0][2] if row[0] == "overhead press"]
+    assert [row[4] for row in press] == [1]
+
+def test_parse_log_skips_lines_under_bad_header():
+    sessions, errors = parse(["bench press: 135x5", "# not-a-date", "squat: 315x5", "# 2024-02-01", "squat: 225x5"])
+    assert errors == [1, 2, 3]
+    assert len(sessions) == 1 and sessions[0][2] == [("squat", 225.0, 5, 0, 1)]
+
+def test_marker_only_on_singles():
+    assert parse_marked_set_token("225x1 1rm") == (225.0, 1, 1)
+    assert parse_marked_set_token("225x1") == (225.0, 1, 0)
+    with pytest.raises(ValueError):
+        parse_marked_set_token("225x2 1RM")
+
+def test_session_header_datetime():
+    assert parse_session_header("# 2024-01-05T18:30 evening") == ("2024-01-05T18:30:00", "evening")
+
+def test_import_twice_adds_nothing_the_second_time():
+    db.db_init_db()
+    user_id = api_services.create_user(f"importer_{uuid.uuid4().hex[:8]}", "secret123")["user_id"]
+
+    first = import_log(user_id, LOG, on_error=lambda line_no, msg: None)
+    assert (first["sessions"], first["sets"], first["already_imported"]) == (2, 6, 0)
+    again = import_log(user_id, LOG, on_error=lambda line_no, msg: None)
+    assert (again["sessions"], again["sets"], again["already_imported"]) == (0, 0, 2)
+    assert len(api_services.get_sessions_for_user(user_id)) == 2
@@ -0,0 +1,64 @@
+from contextlib import nullcontext
+
+import pytest
+
+from src.services import jobs
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    calls = []
+    monkeypatch.setattr(jobs, "get_conn", lambda **kwargs: nullcontext())
+    monkeypatch.setattr(jobs, "db_complete_job", lambda conn, job_id, generation: calls.append(("complete", job_id, generation)))
+    monkeypatch.setattr(jobs, "db_fail_job", lambda conn, job_id, error, retry_in, give_up: calls.append(("fail", job_id, retry_in, give_up)))
+    monkeypatch.setattr(jobs, "stats", {"completed": 0, "retried": 0, "failed": 0})
+    return calls
+
+def _job(kind, attempts=1):
+    return {"job_id": 7, "kind": kind, "user_id": 3, "generation": 2, "attempts": attempts, "shard": 0}
+
+def test_backoff_doubles_and_caps(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_BACKOFF_SECONDS", 2.0)
+    assert [jobs.backoff_seconds(n) for n in (1, 2, 3, 4)] == [2.0, 4.0, 8.0, 16.0]
+    assert jobs.backoff_seconds(50) == jobs.JOB_BACKOFF_MAX_SECONDS
+
+def test_snapshot_jobs_only_when_snapshots_are_on(monkeypatch):
+    monkeypatch.setattr(jobs.snapshots, "SNAPSHOT_DIR", "")
+    assert jobs.jobs_for("session_ended") == []
+    monkeypatch.setattr(jobs.snapshots, "SNAPSHOT_DIR", "/tmp/snapshots")
+    assert jobs.jobs_for("session_ended") == ["refresh_snapshot"]
+    assert jobs.jobs_for("sets_added") == ["personal_records"]
+
+def test_success_completes_the_claimed_generation(fake_db, monkeypatch):
+    ran = []
+    monkeypatch.setitem(jobs.HANDLERS, "personal_records", ran.append)
+    jobs._run(_job("personal_records"))
+    assert ran == [3]
+    assert fake_db == [("complete", 7, 2)]
+    assert jobs.stats["completed"] == 1
+
+def test_failure_backs_off_then_gives_up(fake_db, monkeypatch):
+    def broken(user_id):
+        raise RuntimeError("boom")
+    monkeypatch.setitem(jobs.HANDLERS, "personal_records", broken)
+    monkeypatch.setattr(jobs, "JOB_MAX_ATTEMPTS", 3)
+
+    jobs._run(_job("personal_records", attempts=2))
+    jobs._run(_job("personal_records", attempts=3))
+    assert fake_db == [
+        ("fail", 7, jobs.backoff_seconds(2), False),
+        ("fail", 7, jobs.backoff_seconds(3), True),
+    ]
+    assert jobs.stats == {"completed": 0, "retried": 1, "failed": 1}
+
+def test_unknown_kind_is_a_failure(fake_db):
+    jobs._run(_job("no_such_kind"))
+    assert fake_db[0][0] == "fail"
+
+def test_change_log_pruned_at_most_once_a_minute(fake_db, monkeypatch):
+    monkeypatch.setattr(jobs, "_next_prune", 0.0)
+    monkeypatch.setattr(jobs, "shard_urls", lambda: ["postgresql://a", "postgresql://b"])
+    monkeypatch.setattr(jobs, "db_prune_change_log", lambda conn, ttl_hours: fake_db.append(("prune", ttl_hours)) or 5)
+    assert jobs.prune_change_log(now=100.0) == 10
+    assert jobs.prune_change_log(now=130.0) == 0
+    assert jobs.prune_change_log(now=161.0) == 10
+    assert fake_db == [("prune", jobs.CHANGE_LOG_TTL_HOURS)] * 4
@@ -0,0 +1,111 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.api import limits
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def make_client(budgets, clock=None, **kwargs):
+    app = FastAPI()
+
+    @app.get("/users/{user_id}/sessions")
+    def sessions(user_id: int):
+        return []
+
+    @app.post("/login")
+    def login():
+        return {}
+
+    @app.get("/healthz")
+    def healthz():
+        return {}
+
+    limiter = limits.RateLimiter(budgets, clock=clock or FakeClock())
+    app.add_middleware(limits.LimitsMiddleware, limiter=limiter, **kwargs)
+    return TestClient(app)
+
+def test_bucket_refills_over_time():
+    bucket = limits.TokenBucket(rate=1, capacity=2, now=0)
+    assert bucket.take(0) == 0 and bucket.take(0) == 0
+    assert bucket.take(0) == 1.0
+    assert bucket.take(1.0) == 0
+
+def test_classify_routes():
+    assert limits.classify("POST", "/login") == ("login", None)
+    assert limits.classify("GET", "/users/7/sessions") == ("history", "7")
+    assert limits.classify("GET", "/users/7/sessions/search") == ("history", "7")
+    assert limits.classify("POST", "/users/7/sets") == ("default", "7")
+
+def test_per_user_limit_does_not_affect_other_users():
+    budgets = {"history": {"user": (1, 2)}, "default": {}, "login": {}}
+    client = make_client(budgets)
+
+    assert [client.get("/users/1/sessions").status_code for _ in range(3)] == [200, 200, 429]
+    res = client.get("/users/1/sessions")
+    assert res.status_code == 429 and int(res.headers["retry-after"]) >= 1
+    assert client.get("/users/2/sessions").status_code == 200
+
+def test_login_limited_per_ip():
+    budgets = {"login": {"ip": (0.1, 1)}, "history": {}, "default": {}}
+    client = make_client(budgets)
+    assert client.post("/login").status_code == 200
+    assert client.post("/login").status_code == 429
+
+def test_forwarded_clients_get_their_own_login_budget(monkeypatch):
+    from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+    from src.api import server
+
+    # TestClient connects from "testclient": stand it in for the host's proxy
+    monkeypatch.setenv("FORWARDED_ALLOW_IPS", "testclient")
+    budgets = {"login": {"ip": (0.1, 1)}, "history": {}, "default": {}}
+    # what uvicorn puts in front of the app with server.py's settings
+    app = make_client(budgets).app
+    client = TestClient(ProxyHeadersMiddleware(app, trusted_hosts=server.forwarded_allow_ips()))
+
+    first = {"X-Forwarded-For": "203.0.113.7"}
+    assert client.post("/login", headers=first).status_code == 200
+    assert client.post("/login", headers=first).status_code == 429
+    assert client.post("/login", headers={"X-Forwarded-For": "198.51.100.23"}).status_code == 200
+
+def test_spoofed_forwarded_address_keeps_the_real_clients_budget(monkeypatch):
+    from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+    from src.api import server
+
+    monkeypatch.setenv("FORWARDED_ALLOW_IPS", "testclient")
+    budgets = {"login": {"ip": (0.1, 1)}, "history": {}, "default": {}}
+    app = make_client(budgets).app
+    client = TestClient(ProxyHeadersMiddleware(app, trusted_hosts=server.forwarded_allow_ips()))
+
+    # the proxy appends the real address; whatever the client sent comes before it
+    assert client.post("/login", headers={"X-Forwarded-For": "10.0.0.1, 203.0.113.7"}).status_code == 200
+    assert client.post("/login", headers={"X-Forwarded-For": "10.0.0.2, 203.0.113.7"}).status_code == 429
+
+def test_forwarded_header_is_ignored_by_default(monkeypatch):
+    from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+    from src.api import server
+
+    monkeypatch.delenv("FORWARDED_ALLOW_IPS", raising=False)
+    assert server.forwarded_allow_ips() == "127.0.0.1"
+    budgets = {"login": {"ip": (0.1, 1)}, "history": {}, "default": {}}
+    app = make_client(budgets).app
+    client = TestClient(ProxyHeadersMiddleware(app, trusted_hosts=server.forwarded_allow_ips()))
+
+    assert client.post("/login", headers={"X-Forwarded-For": "10.0.0.1"}).status_code == 200
+    assert client.post("/login", headers={"X-Forwarded-For": "10.0.0.2"}).status_code == 429
+
+def test_sheds_load_when_pool_is_backed_up(monkeypatch):
+    budgets = {"login": {}, "history": {}, "default": {}}
+    client = make_client(budgets, max_pool_waiters=4)
+
+    monkeypatch.setattr(limits.db, "pool_waiters", lambda: 4)
+    assert client.get("/users/1/sessions").status_code == 503
+    # probes still answer
+    assert client.get("/healthz").status_code == 200
+
+    monkeypatch.setattr(limits.db, "pool_waiters", lambda: 0)
+    assert client.get("/users/1/sessions").status_code == 200
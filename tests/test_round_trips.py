@@ -0,0 +1,73 @@
+import psycopg2
+import pytest
+
+from src.repository import db
+
+class RecordingCursor:
+    '''stands in for a pooled connection's cursor: records what would be sent'''
+
+    def __init__(self, error=None):
+        self.connection = self
+        self.prepared = set()
+        self.sent = []
+        self.error = error
+
+    def execute(self, query, params=None):
+        self.sent.append((query, params))
+        if self.error is not None:
+            raise self.error
+
+def _error(pgcode):
+    class Error(psycopg2.Error):
+        pass
+    Error.pgcode = pgcode
+    return Error()
+
+@pytest.fixture(autouse=True)
+def prepared_statements(monkeypatch):
+    monkeypatch.setattr(db, "DB_PREPARED_STATEMENTS", True)
+
+SQL = "SELECT a FROM t WHERE b = %s AND c LIKE 'x%%' AND d = %s;"
+
+def test_first_use_prepares_and_executes_in_one_message():
+    cur = RecordingCursor()
+    db._execute_prepared(cur, "pick", SQL, (1, "y"))
+
+    [(query, params)] = cur.sent
+    assert query == "PREPARE pick AS SELECT a FROM t WHERE b = $1 AND c LIKE 'x%%' AND d = $2; EXECUTE pick (%s, %s);"
+    assert params == (1, "y")
+    assert cur.prepared == {"pick"}
+
+def test_later_uses_only_execute():
+    cur = RecordingCursor()
+    db._execute_prepared(cur, "pick", SQL, (1, "y"))
+    db._execute_prepared(cur, "pick", SQL, (2, "z"))
+
+    assert cur.sent[1] == ("EXECUTE pick (%s, %s);", (2, "z"))
+
+def test_execute_error_keeps_the_statement_prepared():
+    # e.g. a unique violation: PREPARE already ran, only EXECUTE failed
+    cur = RecordingCursor(error=_error("23505"))
+    with pytest.raises(psycopg2.Error):
+        db._execute_prepared(cur, "pick", SQL, (1, "y"))
+    assert cur.prepared == {"pick"}
+
+def test_prepare_error_is_not_cached():
+    cur = RecordingCursor(error=_error("42601"))
+    with pytest.raises(psycopg2.Error):
+        db._execute_prepared(cur, "pick", SQL, (1, "y"))
+    assert cur.prepared == set()
+
+def test_lost_statement_is_prepared_again():
+    cur = RecordingCursor()
+    cur.prepared.add("pick")
+    cur.error = _error("26000")
+    with pytest.raises(psycopg2.Error):
+        db._execute_prepared(cur, "pick", SQL, (1, "y"))
+    assert cur.prepared == set()
+
+def test_disabled_runs_plain_sql(monkeypatch):
+    monkeypatch.setattr(db, "DB_PREPARED_STATEMENTS", False)
+    cur = RecordingCursor()
+    db._execute_prepared(cur, "pick", SQL, (1, "y"))
+    assert cur.sent == [(SQL, (1, "y"))]
@@ -0,0 +1,33 @@
+import pytest
+
+from src.api import server
+
+def test_pool_size_explicit(monkeypatch):
+    monkeypatch.setenv("DB_POOL_SIZE", "7")
+    assert server.worker_pool_size(4) == 7
+
+def test_pool_size_split_across_workers(monkeypatch):
+    monkeypatch.delenv("DB_POOL_SIZE", raising=False)
+    monkeypatch.setenv("DB_MAX_CONNECTIONS", "20")
+    assert server.worker_pool_size(4) == 5
+    assert server.worker_pool_size(40) == 1
+
+@pytest.mark.parametrize("cold_start, migrated", [("1", False), ("0", True)])
+def test_cold_start_binds_before_the_schema_check(monkeypatch, cold_start, migrated):
+    calls = []
+    monkeypatch.setenv("LIFT_LOG_COLD_START", cold_start)
+    monkeypatch.setenv("WEB_CONCURRENCY", "1")
+    monkeypatch.delenv("DB_POOL_SIZE", raising=False)  # main() sets it for the workers; undone afterwards
+    monkeypatch.setattr(server, "db_init_db", lambda: calls.append("db_init_db"))
+    monkeypatch.setattr(server, "close_pools", lambda: None)
+    monkeypatch.setattr(server.uvicorn, "run", lambda *args, **kwargs: calls.append("run"))
+    server.main()
+    assert calls == (["db_init_db", "run"] if migrated else ["run"])
+
+def test_healthz_answers_without_database():
+    from fastapi.testclient import TestClient
+    from src.api.main import app
+
+    res = TestClient(app).get("/healthz")
+    assert res.status_code == 200
+    assert res.json()["status"] == "ok"
@@ -0,0 +1,64 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from src.services.api_services import _window, local_iso, parse_fields, search_sessions
+from src.services.errors import BadRequestError
+
+def test_defaults_to_every_column():
+    sessions, sets = parse_fields(None, include_sets=True)
+    assert "performed_at" in sessions and "weight" in sets
+    assert parse_fields(None, include_sets=False)[1] == []
+
+def test_sparse_selection():
+    assert parse_fields("performed_at,sets.weight,sets.reps", include_sets=True) == (
+        ["performed_at"], ["weight", "reps"],
+    )
+    # only set columns chosen: sessions keep every column
+    sessions, sets = parse_fields("sets.weight", include_sets=True)
+    assert "session_id" in sessions and sets == ["weight"]
+
+def test_rejects_unknown_fields():
+    with pytest.raises(BadRequestError):
+        parse_fields("performed_at,password_hash", include_sets=False)
+    with pytest.raises(BadRequestError):
+        parse_fields("sets.weight", include_sets=False)
+
+@pytest.mark.parametrize("kwargs", [
+    {"q": "  "},
+    {"q": "deload", "match": "some"},
+    {"q": "deload", "limit": 0},
+    {"q": "deload", "limit": 51},
+    {"q": "deload", "offset": -1},
+])
+def test_search_rejects_bad_queries_before_the_database(kwargs):
+    with pytest.raises(BadRequestError):
+        search_sessions(1, **kwargs)
+
+@pytest.fixture
+def server_in_new_york():
+    # a fixed UTC-5 zone (POSIX TZ syntax, no tz database needed)
+    saved = os.environ.get("TZ")
+    os.environ["TZ"] = "EST+5"
+    time.tzset()
+    yield
+    if saved is None:
+        os.environ.pop("TZ")
+    else:
+        os.environ["TZ"] = saved
+    time.tzset()
+
+def test_aware_bounds_match_server_local_timestamps(server_in_new_york):
+    # performed_at is stored as naive server-local time, like now_iso() writes it
+    start = datetime(2024, 1, 5, 15, 0, tzinfo=timezone.utc)
+    end = datetime(2024, 1, 5, 19, 0, tzinfo=timezone(timedelta(hours=2)))
+    assert _window(start, None) == (datetime(2024, 1, 5, 10, 0), None)
+    assert _window(start, end) == (datetime(2024, 1, 5, 10, 0), datetime(2024, 1, 5, 12, 0))
+    # naive bounds are already server-local
+    assert _window(datetime(2024, 1, 5, 10), None) == (datetime(2024, 1, 5, 10), None)
+
+def test_aware_performed_at_is_stored_as_server_local_time(server_in_new_york):
+    assert local_iso(datetime(2024, 1, 5, 20, 0, tzinfo=timezone(timedelta(hours=5)))) == "2024-01-05T10:00:00"
+    assert local_iso(datetime(2024, 1, 5, 10, 0)) == "2024-01-05T10:00:00"
@@ -0,0 +1,157 @@
+import os
+import uuid
+
+import pytest
+
+from src.repository import db, shards
+
+def test_ring_spreads_users_evenly():
+    ring = shards.Ring(4)
+    counts = [0] * 4
+    for i in range(20_000):
+        counts[ring.shard_for(f"user-{i}")] += 1
+    assert min(counts) > 20_000 / 4 * 0.7
+
+def test_adding_a_shard_moves_only_its_share():
+    before, after = shards.Ring(4), shards.Ring(5)
+    keys = [f"user-{i}" for i in range(20_000)]
+    moved = [k for k in keys if before.shard_for(k) != after.shard_for(k)]
+    # only keys taken over by the new shard change place, about a fifth of them
+    assert all(after.shard_for(k) == 4 for k in moved)
+    assert len(moved) < len(keys) * 0.3
+
+def test_ids_name_their_shard():
+    start = shards.aligned_start(1000, 3)
+    assert start > 1000
+    ids = [start + n * shards.SHARD_ID_STRIDE for n in range(5)]
+    assert {shards.shard_of_id(i, n_shards=4) for i in ids} == {3}
+    # a shard that isn't configured (an id from before sharding) falls back to shard 0
+    assert shards.shard_of_id(shards.SHARD_ID_STRIDE - 1, n_shards=4) == 0
+
+def test_cursor_from_another_shard_means_full_sync():
+    cursor = shards.encode_cursor(123456, 2)
+    assert shards.decode_cursor(cursor, 2) == 123456
+    assert shards.decode_cursor(cursor, 1) == 0
+    assert shards.decode_cursor(0, 0) == 0
+
+def test_directory_caches_until_ttl():
+    now = [0.0]
+    loads = []
+
+    def load(user_id):
+        loads.append(user_id)
+        return (2, False) if user_id == 7 else None
+
+    directory = shards.Directory(ttl=10, load=load, clock=lambda: now[0])
+    assert directory.placement(7) == (2, False)
+    assert directory.placement(7) == (2, False)
+    assert directory.placement(8) == (0, False)
+    assert loads == [7, 8]
+
+    now[0] = 11
+    directory.placement(7)
+    assert loads == [7, 8, 7]
+
+def test_directory_does_not_cache_unknown_users():
+    placements = {}
+    directory = shards.Directory(ttl=10, load=placements.get, clock=lambda: 0.0)
+    assert directory.placement(9) == (0, False)
+    # signed up on shard 2 right after the miss: the next lookup must see it
+    placements[9] = (2, False)
+    assert directory.placement(9) == (2, False)
+
+@pytest.fixture
+def two_shards(monkeypatch):
+    monkeypatch.setattr(db, "DATABASE_URL", "postgresql://shard0/liftlog")
+    monkeypatch.setattr(db, "DATABASE_SHARD_URLS", ["postgresql://shard1/liftlog"])
+    monkeypatch.setattr(db, "DATABASE_REPLICA_URLS", [])
+    monkeypatch.setattr(db, "_directory", shards.Directory(60, {5: (1, False), 6: (1, True)}.get))
+
+def test_routing_follows_the_directory(two_shards):
+    assert db.pick_dsn(user_id=5) == "postgresql://shard1/liftlog"
+    assert db.pick_dsn(readonly=True, user_id=4) == "postgresql://shard0/liftlog"
+    assert db.pick_dsn(session_id=shards.aligned_start(0, 1)) == "postgresql://shard1/liftlog"
+    assert db.pick_dsn(shard=1) == "postgresql://shard1/liftlog"
+
+def test_writes_for_a_moving_user_are_refused(two_shards):
+    with pytest.raises(db.UserMovingError):
+        with db.get_conn(user_id=6):
+            pass
+
+def test_unsharded_never_consults_a_directory(monkeypatch):
+    monkeypatch.setattr(db, "DATABASE_SHARD_URLS", [])
+    monkeypatch.setattr(db, "_directory", None)
+    assert db.user_placement(12345) == (0, False)
+    assert db.place_new_user("anyone") == 0
+    assert db._directory is None
+
+# end-to-end move: needs two empty local instances, e.g.
+# LIFT_LOG_TEST_SHARD_URLS=postgresql://localhost:5432/liftlog,postgresql://localhost:5434/liftlog
+@pytest.mark.skipif(
+    len(os.environ.get("LIFT_LOG_TEST_SHARD_URLS", "").split(",")) < 2,
+    reason="needs two Postgres instances",
+)
+def test_move_user_between_shards(monkeypatch):
+    from fastapi.testclient import TestClient
+    from src.api.main import app
+    from src.repository import rebalance
+
+    first, *rest = os.environ["LIFT_LOG_TEST_SHARD_URLS"].split(",")
+    monkeypatch.setattr(db, "DATABASE_URL", first)
+    monkeypatch.setattr(db, "DATABASE_SHARD_URLS", rest)
+    monkeypatch.setattr(db, "DATABASE_REPLICA_URLS", [])
+    monkeypatch.setattr(db, "SHARD_DIRECTORY_TTL", 0.0)
+    monkeypatch.setattr(db, "_directory", None)
+    db.close_pools()
+    db.db_init_db()
+    client = TestClient(app)
+
+    # sign up until the ring puts someone off shard 0
+    while True:
+        username = f"shard-{uuid.uuid4().hex[:8]}"
+        user_id = client.post("/users", json={"username": username, "password": "secret123"}).json()["user_id"]
+        if db.user_shard(user_id) != 0:
+            break
+    home = db.user_shard(user_id)
+
+    session_id = client.post(f"/users/{user_id}/sessions", json={}).json()["session_id"]
+    assert shards.shard_of_id(session_id, len(db.shard_urls())) == home
+    client.post(f"/users/{user_id}/sets", json={"sets": [{"exercise": "squat", "weight": 315, "reps": 5}]})
+    cursor = client.get(f"/users/{user_id}/changes", params={"since": 0}).json()["cursor"]
+
+    moved = rebalance.move_user(user_id, 0, sleep=lambda s: None, log=lambda m: None)
+    assert moved["from"] == home and moved["copied"] > 0
+    assert db.user_shard(user_id) == 0
+
+    # the session id still names the old shard; the lookup falls back to the new one
+    assert [s["weight"] for s in client.get(f"/sessions/{session_id}/sets").json()] == [315]
+    # an old cursor can't be trusted on the new shard: full resync
+    assert len(client.get(f"/users/{user_id}/changes", params={"since": cursor}).json()["sets"]) == 1
+    assert client.post(f"/users/{user_id}/sets", json={"sets": [{"exercise": "squat", "weight": 325, "reps": 5}]}).status_code == 201
+    with db.get_conn(shard=home) as conn:
+        assert db.db_export_user_rows(conn, user_id)["sessions"] == []
+    db.close_pools()
+
+def test_signup_is_undone_when_the_home_shard_is_unreachable(monkeypatch):
+    from contextlib import contextmanager
+    from src.services import api_services
+
+    deleted = []
+
+    @contextmanager
+    def get_conn(*, shard, autocommit):
+        yield shard
+
+    def copy_user(conn, *args):
+        raise ConnectionError("shard 1 is down")
+
+    monkeypatch.setattr(api_services, "place_new_user", lambda username: 1)
+    monkeypatch.setattr(api_services, "get_conn", get_conn)
+    monkeypatch.setattr(api_services, "db_create_user", lambda conn, *args: 42)
+    monkeypatch.setattr(api_services, "db_copy_user", copy_user)
+    monkeypatch.setattr(api_services, "db_delete_account", lambda conn, user_id: deleted.append((conn, user_id)))
+
+    with pytest.raises(ConnectionError):
+        api_services.create_user("sherman", "secret123")
+    # the account goes away on shard 0, so the username can sign up again
+    assert deleted == [(0, 42)]
@@ -0,0 +1,100 @@
+import pytest
+
+from src.repository import snapshots
+from src.services import analytics
+
+# session_id -> (performed_at, ended, [(set_id, exercise, weight, reps, is_1rm)])
+SESSIONS = {
+    1: ("2024-01-01T10:00:00", True, [(1, "bench press", 135.0, 5, 0), (2, "bench press", 185.0, 3, 0)]),
+    2: ("2024-01-03T10:00:00", True, [(3, "squat", 225.0, 5, 0), (4, "bench press", 200.0, 1, 1)]),
+    3: ("2024-01-05T10:00:00", False, [(5, "bench press", 205.0, 1, 0)]),
+}
+
+@pytest.fixture
+def fake_db(monkeypatch, tmp_path):
+    monkeypatch.setattr(snapshots, "SNAPSHOT_DIR", str(tmp_path))
+    fetched = []
+
+    def ended():
+        return [sid for sid, (_, is_ended, _) in SESSIONS.items() if is_ended]
+
+    def sets_for(conn, session_ids):
+        fetched.append(list(session_ids))
+        return [
+            {"set_id": set_id, "session_id": sid, "exercise": ex, "weight": w, "reps": r, "is_1rm": rm,
+             "performed_at": SESSIONS[sid][0]}
+            for sid in session_ids for set_id, ex, w, r, rm in SESSIONS[sid][2]
+        ]
+
+    monkeypatch.setattr(snapshots, "db_count_ended_sessions", lambda conn, user_id: len(ended()))
+    monkeypatch.setattr(snapshots, "db_get_ended_session_ids", lambda conn, user_id: ended())
+    monkeypatch.setattr(snapshots, "db_get_sets_for_sessions", sets_for)
+    return fetched
+
+def test_refresh_is_incremental(fake_db, monkeypatch):
+    assert snapshots.refresh_snapshot(None, 1) == 4
+    assert snapshots.refresh_snapshot(None, 1) == 0
+
+    # session 3 ends: only its sets are fetched and appended
+    monkeypatch.setitem(SESSIONS, 3, (SESSIONS[3][0], True, SESSIONS[3][2]))
+    assert snapshots.refresh_snapshot(None, 1) == 1
+    assert fake_db == [[1, 2], [3]]
+    assert snapshots.load_snapshot(1)["rows"] == 5
+
+def test_series_and_stats_from_snapshot(fake_db):
+    snapshots.refresh_snapshot(None, 1)
+    snapshot = snapshots.load_snapshot(1)
+    picked = analytics.select_exercise(snapshot, "bench press")
+
+    series = analytics.series_rows(snapshot, picked)
+    assert [r["set_id"] for r in series] == [1, 2, 4]
+    assert series[-1]["performed_at"] == "2024-01-03T10:00:00"
+
+    stats = analytics.stats(snapshot, picked)
+    assert stats["sets"] == 3
+    assert stats["max_weight"] == 200.0
+    assert stats["tested_1rm"] == 200.0
+    assert stats["best_1rm"] == 200.0  # tested single wins over the estimate
+
+def test_merge_with_active_session_rows(fake_db):
+    snapshots.refresh_snapshot(None, 1)
+    snapshot = snapshots.load_snapshot(1)
+    history = analytics.stats(snapshot, analytics.select_exercise(snapshot, "bench press"))
+
+    active = [{"weight": 205.0, "reps": 1, "is_1rm": 0, "performed_at": SESSIONS[3][0]}]
+    merged = analytics.merge_stats(history, analytics.stats(analytics.columns_from_rows(active)))
+    assert merged["sets"] == 4
+    assert merged["max_weight"] == 205.0
+    assert merged["best_1rm"] == 200.0
+
+def test_no_snapshot_yet(fake_db):
+    assert snapshots.load_snapshot(99) is None
+
+def test_select_exercise_time_window(fake_db):
+    from datetime import datetime
+
+    snapshots.refresh_snapshot(None, 1)
+    snapshot = snapshots.load_snapshot(1)
+    picked = analytics.select_exercise(snapshot, "bench press", start=datetime(2024, 1, 2), end=datetime(2024, 1, 4))
+    assert [r["set_id"] for r in analytics.series_rows(snapshot, picked)] == [4]
+
+def test_reads_leave_refreshing_to_the_job(fake_db, monkeypatch):
+    from contextlib import nullcontext
+    from src.services import api_services
+
+    snapshots.refresh_snapshot(None, 1)
+    # session 3 ends, but its refresh job hasn't run yet
+    monkeypatch.setitem(SESSIONS, 3, (SESSIONS[3][0], True, SESSIONS[3][2]))
+    monkeypatch.setattr(snapshots, "refresh_snapshot", lambda conn, user_id: pytest.fail("read refreshed"))
+    monkeypatch.setattr(api_services, "get_conn", lambda **kwargs: nullcontext())
+    asked = []
+
+    def unsnapshotted(conn, user_id, exercise, covered):
+        asked.append(covered)
+        return [{"set_id": 5, "weight": 205.0, "reps": 1, "is_1rm": 0, "session_id": 3,
+                 "performed_at": SESSIONS[3][0]}]
+
+    monkeypatch.setattr(api_services, "db_get_unsnapshotted_sets_for_exercise", unsnapshotted)
+    stats = api_services.get_exercise_stats(1, "bench press")
+    assert asked == [[1, 2]]
+    assert stats["sets"] == 4 and stats["max_weight"] == 205.0